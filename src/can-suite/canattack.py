@@ -15,6 +15,7 @@ from pyfiglet import figlet_format
 from termcolor import colored
 from utils.core import CANConnection, MITMFilter, MessageColorIndex as MCI, is_valid_bitrate, is_valid_com_port, is_valid_filter, mitm_filter_attack, replay_traffic
 from utils.OBDLink import OBDConnection, OBDCommands
+from utils.transport import TRANSPORTS
 
 
 # Show extended error messages
@@ -33,6 +34,7 @@ def parse_args() -> Namespace:
     parser.add_argument("--pcan", help="Use PCAN USB(-FD) Dongle for Connection", action='store_true')
     parser.add_argument("--fd", help="Use for connection to CAN-FD targets", action='store_true')
     parser.add_argument("--baudrate", help="Set baudrate of CAN Bus (500 Kbit/s by default)", type=str)
+    parser.add_argument("--transport", "-t", help="Transport backend (native by default, pcan with --pcan, python-can with --compatibility)", choices=list(TRANSPORTS))
 
     return parser.parse_args()
 
@@ -67,9 +69,8 @@ def main():
         if is_valid_bitrate(args.baudrate):
             core.BAUDRATE = core.VALID_BITRATES[args.baudrate]
 
-    # FIXME: Add pcan option
     try:
-        can_socket = CANConnection(args.interface)
+        can_socket = CANConnection(core.CAN_INTERFACE, fd=core.FD_MODE, pcan=core.USE_PCAN, baud_rate=core.BAUDRATE, transport=args.transport)
     except Exception as _:
         print(f"{core.MessageColorIndex.ERROR} Error initializing CAN Socket.")
         sys.exit(1)
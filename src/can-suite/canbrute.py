@@ -4,21 +4,65 @@
     Script to Brute Force CAN Messages for a certain Arbitration ID
     (c) Jannik Schmied, 2023
 """
+import os
 import subprocess
 import sys
 from argparse import ArgumentParser, Namespace
+from multiprocessing import Process, Queue
+from re import sub
 from pyfiglet import figlet_format
 from shlex import split
+from socket import timeout as SocketTimeout
+from time import monotonic, perf_counter, sleep
+
+import numpy as np
+
+from utils.bitrates import BITRATES
+from utils.campaign import CHECKPOINT_INTERVAL, Campaign, CampaignMismatchException, InvalidShardException, parse_shard, shard_range
+from utils.keyspace import MAX_LENGTH, MAX_LENGTH_FD, MIN_LENGTH, ORDERS, is_valid_length, keyspace, keyspace_size
+from utils.ratecontrol import DEFAULT_BITRATE, RateController, bitrate
+from utils.sensitivity import BYTE_VALUES, byte_pair_sweep, byte_pairs, parse_positions, search_space, single_byte_sweep
+from utils.oracle import DEFAULT_LEARN_TIME, DEFAULT_WINDOW, ResponseOracle, write_hits
+from utils.pcantx import BAUD_RATES
+from utils.socketcan import CAN_EFF_FLAG, CAN_EFF_MASK, DEFAULT_BATCH_SIZE, NativeCANSocket, format_can_id, pack_block, parse_id_list
+from utils.transport import TRANSPORTS, open_transport
 
 
 VERBOSE: bool = False
+HITS: list = []
+# cansend or any transport backend (see utils.transport)
+ENGINES: tuple = ("cansend",) + tuple(TRANSPORTS)
+STRATEGIES: tuple = ("exhaustive", "sensitivity")
+BASELINE_TIMEOUT: float = 5.0
 
 
 def parse_args() -> Namespace:
     parser = ArgumentParser()
-    parser.add_argument("--id", "-i", help="Arbitration ID to bruteforce", type=str, required=True)
-    parser.add_argument("--length", "-l", help="Message length (1-8 bytes)", type=int, required=True)
-    parser.add_argument("--interface", "-I", help="Interface to which message should be send (e.g. can0)", type=str, required=True)
+    parser.add_argument("--id", "-i", help="Arbitration ID(s) to bruteforce, comma separated IDs and ranges (e.g. 7DF or 700-7FF,18DAF110)", type=str, required=True)
+    parser.add_argument("--length", "-l", help="Message length (1-8 bytes, 1-64 bytes with --fd)", type=int, required=True)
+    parser.add_argument("--interface", "-I", help="Interface(s) to which message should be send, comma separated (e.g. can0 or can0,can1)", type=str, required=True)
+    parser.add_argument("--workers", "-w", help="Worker processes the IDs are split across (default: one per interface)", type=int)
+    parser.add_argument("--engine", "-e", help="Transmit engine: one raw socket (native), one process per frame (cansend), a PCAN adapter (pcan, interface is a PCAN channel e.g. PCAN_USBBUS1), python-can ([bustype:]channel) or an in-process bus (loopback)", choices=ENGINES, default="native")
+    parser.add_argument("--batch", "-b", help=f"Frames per batch written by all engines but cansend (default: {DEFAULT_BATCH_SIZE})", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--rate", help="Target transmit rate in frames/s", type=float)
+    parser.add_argument("--load", help="Target bus load in percent (alternative to --rate)", type=float)
+    parser.add_argument("--bitrate", help=f"Bus bitrate in kbit/s used for bus load calculation and by the pcan and python-can engines (default: {DEFAULT_BITRATE})", type=str, default=DEFAULT_BITRATE)
+    parser.add_argument("--strategy", "-s", help="Search strategy: whole keyspace (exhaustive) or byte positions around a baseline (sensitivity)", choices=STRATEGIES, default="exhaustive")
+    parser.add_argument("--baseline", help="Baseline payload in hex for the sensitivity strategy (default: observed on the bus)", type=str)
+    parser.add_argument("--reactive", help="Comma separated byte positions to sweep pairwise (default: asked after the single byte phase)", type=str)
+    parser.add_argument("--oracle", help="Monitor the bus and attribute reactions to injected candidates", action='store_true')
+    parser.add_argument("--watch", help="Comma separated IDs whose payload changes count as reaction (oracle)", type=str)
+    parser.add_argument("--window", help=f"Reaction window after an injection in ms (default: {DEFAULT_WINDOW * 1000:.0f})", type=float, default=DEFAULT_WINDOW * 1000)
+    parser.add_argument("--learn", help=f"Seconds of regular traffic learned before injecting (default: {DEFAULT_LEARN_TIME:.0f})", type=float, default=DEFAULT_LEARN_TIME)
+    parser.add_argument("--hits", help="Hit list CSV file (default: canbrute_hits_<id>.csv)", type=str)
+    parser.add_argument("--confirm", help="Replay suspects of every hit one by one to pin down the causing candidate", action='store_true')
+    parser.add_argument("--stop-on-hit", help="Stop the campaign at the first hit", action='store_true')
+    parser.add_argument("--order", "-o", help="Keyspace enumeration order (default: counting)", choices=list(ORDERS), default="counting")
+    parser.add_argument("--seed", help="Seed for the random enumeration order", type=int, default=0)
+    parser.add_argument("--shard", help="Sweep only shard k of N equal keyspace slices (default: 1/1)", type=str, default="1/1")
+    parser.add_argument("--state", help="Campaign state file (default: derived from id, length, order and shard)", type=str)
+    parser.add_argument("--resume", "-r", help="Resume campaign from its state file", action='store_true')
+    parser.add_argument("--fd", help="Brute force CAN-FD frames (not with the cansend engine)", action='store_true')
     parser.add_argument("--verbose", "-v", help="Output current message", action='store_true')
     return parser.parse_args()
 
@@ -37,88 +81,323 @@ def send_msg(msg):
         proc.terminate()
 
 
-def b1byte(msg):
-    for byte1 in range(0x100):
-        tmsg = msg
-        tmsg += "{:02x}".format(byte1)
-        send_msg(tmsg)
-
-
-def b2bytes(msg):
-    for byte1 in range(0x100):
-        for byte2 in range(0x100):
-            tmsg = msg
-            tmsg += "{:02x}".format(byte1) + "{:02x}".format(byte2)
-            send_msg(tmsg)
-
-
-def b3bytes(msg):
-    for byte1 in range(0x100):
-        for byte2 in range(0x100):
-            for byte3 in range(0x100):
-                tmsg = msg
-                tmsg += "{:02x}".format(byte1) + "{:02x}".format(byte2) + "{:02x}".format(byte3)
-                send_msg(tmsg)
-
-
-def b4bytes(msg):
-    for byte1 in range(0x100):
-        for byte2 in range(0x100):
-            for byte3 in range(0x100):
-                for byte4 in range(0x100):
-                    tmsg = msg
-                    tmsg += "{:02x}".format(byte1) + "{:02x}".format(byte2) + "{:02x}".format(byte3) + "{:02x}".format(byte4)
-                    send_msg(tmsg)
-
-
-def b5bytes(msg):
-    for byte1 in range(0x100):
-        for byte2 in range(0x100):
-            for byte3 in range(0x100):
-                for byte4 in range(0x100):
-                    for byte5 in range(0x100):
-                        tmsg = msg
-                        tmsg += "{:02x}".format(byte1) + "{:02x}".format(byte2) + "{:02x}".format(byte3) + "{:02x}".format(byte4) + "{:02x}".format(byte5)
-                        send_msg(tmsg)
-
-
-def b6bytes(msg):
-    for byte1 in range(0x100):
-        for byte2 in range(0x100):
-            for byte3 in range(0x100):
-                for byte4 in range(0x100):
-                    for byte5 in range(0x100):
-                        for byte6 in range(0x100):
-                            tmsg = msg
-                            tmsg += "{:02x}".format(byte1) + "{:02x}".format(byte2) + "{:02x}".format(byte3) + "{:02x}".format(byte4) + "{:02x}".format(byte5) + "{:02x}".format(byte6)
-                            send_msg(tmsg)
-
-
-def b7bytes(msg):
-    for byte1 in range(0x100):
-        for byte2 in range(0x100):
-            for byte3 in range(0x100):
-                for byte4 in range(0x100):
-                    for byte5 in range(0x100):
-                        for byte6 in range(0x100):
-                            for byte7 in range(0x100):
-                                tmsg = msg
-                                tmsg += "{:02x}".format(byte1) + "{:02x}".format(byte2) + "{:02x}".format(byte3) + "{:02x}".format(byte4) + "{:02x}".format(byte5) + "{:02x}".format(byte6) + "{:02x}".format(byte7)
-                                send_msg(tmsg)
-
-
-def b8bytes(msg):
-    for byte1 in range(0x100):
-        for byte2 in range(0x100):
-            for byte3 in range(0x100):
-                for byte4 in range(0x100):
-                    for byte5 in range(0x100):
-                        for byte6 in range(0x100):
-                            for byte7 in range(0x100):
-                                for byte8 in range(0x100):
-                                    tmsg = msg
-                                    tmsg += "{:02x}".format(byte1) + "{:02x}".format(byte2) + "{:02x}".format(byte3) + "{:02x}".format(byte4) + "{:02x}".format(byte5) + "{:02x}".format(byte6) + "{:02x}".format(byte7) + "{:02x}".format(byte8)
-                                    send_msg(tmsg)
+class CansendEngine:
+    """Transmit engine spawning one cansend process per frame"""
+    def __init__(self, interface: str, can_ids: list, rate: RateController = None) -> None:
+        self.interface = interface
+        self.can_ids = list(can_ids)
+        self.rate = rate
+        self.oracle = None
+        self.sent = 0
+
+    def send_block(self, payloads: np.ndarray, index: int = None, tag=None) -> None:
+        for row, payload in enumerate(payloads):
+            for can_id in self.can_ids:
+                if self.rate:
+                    self.rate.acquire(len(payload), bool(can_id & CAN_EFF_FLAG))
+                started = monotonic()
+                self.send_frame(can_id, payload.tobytes())
+                if self.oracle:
+                    self.oracle.record(can_id, payloads[row:row + 1], started, monotonic(), None if index is None else np.array([index + row]), tag)
+                self.sent += 1
+
+    def send_frame(self, can_id: int, payload: bytes) -> None:
+        send_msg(f"cansend {self.interface} {format_can_id(can_id)}#{payload.hex()}")
+
+    def close(self) -> None:
+        pass
+
+
+class NativeEngine:
+    """Transmit engine writing pre-packed frames in batches through one raw socket (or another transport passed as socket).
+    Candidates for several IDs are interleaved (ID changes fastest)."""
+    def __init__(self, interface: str, can_ids: list, batch_size: int = DEFAULT_BATCH_SIZE, fd: bool = False, rate: RateController = None, socket=None) -> None:
+        self.socket = socket or NativeCANSocket(interface, fd=fd, rate=rate)
+        self.interface = interface
+        self.rate = rate
+        self.can_ids = np.array(can_ids, dtype=np.uint32)
+        self.batch_size = max(batch_size, 1)
+        self.fd_mode = fd
+        self.oracle = None
+        self.sent = 0
+
+    def send_block(self, payloads: np.ndarray, index: int = None, tag=None) -> None:
+        ids = len(self.can_ids)
+
+        if ids > 1:
+            payloads = np.repeat(payloads, ids, axis=0)
+            can_ids = np.tile(self.can_ids, len(payloads) // ids)
+        else:
+            can_ids = int(self.can_ids[0])
+
+        frames = pack_block(can_ids, payloads, self.fd_mode)
+
+        for offset in range(0, len(frames), self.batch_size):
+            started = monotonic()
+            self.sent += self.socket.send_batch(frames[offset:offset + self.batch_size])
+
+            if self.oracle:
+                rows = slice(offset, offset + self.batch_size)
+                indices = None if index is None else index + np.arange(offset, min(offset + self.batch_size, len(frames))) // ids
+                self.oracle.record(can_ids[rows] if ids > 1 else can_ids, payloads[rows], started, monotonic(), indices, tag)
+
+        if VERBOSE:
+            print(f"[i] Current message: {format_can_id(int(frames[-1]['can_id']))}#{payloads[-1].tobytes().hex()}", end="\r")
+
+    def send_frame(self, can_id: int, payload: bytes) -> None:
+        self.socket.send(can_id, payload)
+
+    def close(self) -> None:
+        self.socket.close()
+
+
+def observe_baseline(interface: str, target: int, timeout: float = BASELINE_TIMEOUT) -> bytes:
+    """Wait for a frame with the target ID on the bus and return its payload"""
+    deadline = monotonic() + timeout
+
+    with NativeCANSocket(interface) as sock:
+        while (remaining := deadline - monotonic()) > 0:
+            sock.settimeout(remaining)
+            try:
+                frame_id, data = sock.recv()
+            except SocketTimeout:
+                break
+            if frame_id & (CAN_EFF_FLAG | CAN_EFF_MASK) == target:
+                return data
+
+    raise TimeoutError(f"no frame with ID {format_can_id(target)} observed within {timeout:.0f} s")
+
+
+def collect_hits(engine, confirm: bool = False) -> list:
+    """Fetch new hits of the response oracle (if enabled) and print them"""
+    if not engine.oracle:
+        return []
+
+    hits = engine.oracle.pop_hits()
+
+    if confirm:
+        hits = [engine.oracle.confirm(engine.send_frame, hit) for hit in hits]
+
+    for hit in hits:
+        print(f"\n[+] Hit: {hit.describe()}")
+
+    HITS.extend(hits)
+    return hits
+
+
+def run_exhaustive(args: Namespace, engine, label: str) -> bool:
+    """Sweep (a shard of) the whole keyspace, returns False if the campaign failed"""
+    try:
+        shard, shards = parse_shard(args.shard)
+    except InvalidShardException as e:
+        print(f"[!] {e}")
+        return False
+
+    start, stop = shard_range(keyspace_size(args.length), shard, shards)
+    print(f"[i] Keyspace: {keyspace_size(args.length)} candidates ({args.order} order), shard {shard}/{shards}: {stop - start} candidates")
+
+    campaign = Campaign(label, args.length, args.order, args.seed, shard, shards, start, stop, cursor=start)
+    state_file = with_suffix(args.state, label, args) if args.state else Campaign.default_path(label, args.length, args.order, shard, shards)
+
+    if args.resume:
+        if os.path.exists(state_file):
+            try:
+                campaign = campaign.resume(state_file)
+            except CampaignMismatchException as e:
+                print(f"[!] Cannot resume: {e}")
+                return False
+            print(f"[i] Resuming at {campaign.cursor:#x} ({campaign.progress:.2%} done, {campaign.sent} frames sent so far)")
+        else:
+            print(f"[i] No campaign state found at {state_file}, starting from scratch.")
+
+    if campaign.done:
+        print("[+] Campaign already finished.")
+        return True
+
+    last_checkpoint = perf_counter()
+    last_tick = last_checkpoint
+    committed = engine.sent
+    ids = len(engine.can_ids)
+    failed = False
+
+    try:
+        for index, payloads in keyspace(args.length, args.order, start=campaign.cursor, stop=campaign.stop, seed=args.seed):
+            engine.send_block(payloads, index)
+
+            now = perf_counter()
+            campaign.advance((engine.sent - committed) // ids, now - last_tick, engine.sent - committed)
+            committed, last_tick = engine.sent, now
+
+            if now - last_checkpoint >= CHECKPOINT_INTERVAL:
+                campaign.save(state_file)
+                last_checkpoint = now
+
+            if collect_hits(engine, args.confirm) and args.stop_on_hit:
+                print("[*] Stopped at first hit.")
+                break
+    except KeyboardInterrupt:
+        print("\n[*] Stopped. (interrupted by user)")
+    except OSError as e:
+        print(f"\n[!] Error sending frames: {e}")
+        failed = True
+    finally:
+        # Candidates of an interrupted block are committed once sent to all IDs
+        candidates = (engine.sent - committed) // ids
+        campaign.advance(candidates, perf_counter() - last_tick, candidates * ids)
+        campaign.save(state_file)
+
+    print(f"\n[i] Campaign: {campaign.progress:.2%} of shard {shard}/{shards} done, state saved to {state_file}")
+
+    if not campaign.done:
+        print("[i] Continue with --resume.")
+
+    return not failed
+
+
+def run_sensitivity(args: Namespace, engine, label: str) -> bool:
+    """Sweep single byte positions around a baseline, then pairs of reactive positions"""
+    try:
+        if args.baseline:
+            baseline = bytes.fromhex(args.baseline)
+        elif len(engine.can_ids) > 1:
+            raise ValueError("several IDs need a common --baseline")
+        else:
+            print(f"[*] Waiting for baseline frame with ID {label}...")
+            baseline = observe_baseline(engine.interface, int(engine.can_ids[0]))
+    except (OSError, ValueError) as e:
+        print(f"[!] Error getting baseline payload: {e}")
+        return False
+
+    if len(baseline) != args.length:
+        print(f"[!] Baseline {baseline.hex()} is {len(baseline)} bytes long, expected {args.length}!")
+        return False
+
+    print(f"[i] Baseline: {label}#{baseline.hex()}")
+    print(f"[i] Search space: {search_space(args.length, [])} candidates (single byte phase) instead of {keyspace_size(args.length)}")
+
+    try:
+        for position in range(args.length):
+            print(f"[*] Sweeping byte {position} ({BYTE_VALUES} frames)")
+            engine.send_block(single_byte_sweep(baseline, position), tag=position)
+
+        if engine.oracle:
+            sleep(engine.oracle.window)
+        hits = collect_hits(engine, args.confirm)
+
+        if args.reactive is not None:
+            reactive = parse_positions(args.reactive, args.length)
+        elif engine.oracle:
+            reactive = sorted({hit.tag for hit in hits})
+            print(f"[i] Reactive byte positions detected by oracle: {reactive}")
+        else:
+            reactive = parse_positions(input("[?] Byte positions which caused a reaction (e.g. 0,3, Enter for none): "), args.length)
+
+        if len(reactive) < 2:
+            print("[i] Less than two reactive byte positions, no pair phase needed.")
+            return True
+
+        pairs = byte_pairs(reactive)
+        print(f"[i] Sweeping {len(pairs)} byte pairs of positions {reactive} ({len(pairs) * BYTE_VALUES * BYTE_VALUES} frames)")
+
+        for first, second in pairs:
+            print(f"[*] Sweeping bytes {first} and {second}")
+            engine.send_block(byte_pair_sweep(baseline, first, second), tag=f"{first},{second}")
+            if collect_hits(engine, args.confirm) and args.stop_on_hit:
+                print("[*] Stopped at first hit.")
+                break
+    except ValueError as e:
+        print(f"[!] Invalid byte positions: {e}")
+        return False
+    except KeyboardInterrupt:
+        print("\n[*] Stopped. (interrupted by user)")
+    except OSError as e:
+        print(f"\n[!] Error sending frames: {e}")
+        return False
+
+    return True
+
+
+def with_suffix(path: str, label: str, args: Namespace) -> str:
+    """Per worker file name (e.g. hits_w2of4.csv) if the campaign is split across workers"""
+    if label == args.id:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}_{label.rsplit(' ', 1)[-1]}{extension}"
+
+
+def run(args: Namespace, can_ids: list, interface: str, label: str, rate_share: int = 1) -> bool:
+    """Brute force all IDs in can_ids on one interface, returns False if the campaign failed"""
+    rate = None
+
+    if args.rate or args.load:
+        try:
+            # Workers sharing an interface share its target rate
+            rate = RateController(args.rate / rate_share if args.rate else None, args.load / rate_share if args.load else None, bitrate(args.bitrate))
+        except ValueError as e:
+            print(f"[!] Invalid rate: {e}")
+            return False
+
+    try:
+        if args.engine == "native":
+            engine = NativeEngine(interface, can_ids, args.batch, args.fd, rate)
+        elif args.engine == "cansend":
+            engine = CansendEngine(interface, can_ids, rate)
+        else:
+            transport = open_transport(args.engine, interface, args.fd, rate, baud_rate=BAUD_RATES[args.bitrate], bitrate=bitrate(args.bitrate), pool_size=args.batch)
+            engine = NativeEngine(interface, can_ids, args.batch, args.fd, rate, transport)
+    except (OSError, ValueError) as e:
+        print(f"[!] Error initializing {args.engine} engine on {interface}: {e}")
+        return False
+
+    if args.oracle:
+        try:
+            watch_ids = parse_id_list(args.watch) if args.watch else []
+            engine.oracle = ResponseOracle(interface, can_ids, watch_ids, args.window / 1000, args.fd)
+        except (OSError, ValueError) as e:
+            print(f"[!] Error initializing response oracle on {interface}: {e}")
+            engine.close()
+            return False
+
+        engine.oracle.start()
+        print(f"[*] Learning regular bus traffic on {interface} for {args.learn:.0f} s...")
+        engine.oracle.learn(args.learn)
+        print(f"[i] Known IDs: {len(engine.oracle.known_ids)}, watched IDs: {len(watch_ids)}")
+
+    start = perf_counter()
+
+    try:
+        if args.strategy == "sensitivity":
+            success = run_sensitivity(args, engine, label)
+        else:
+            success = run_exhaustive(args, engine, label)
+    finally:
+        if engine.oracle:
+            sleep(engine.oracle.window)
+            collect_hits(engine, args.confirm)
+            engine.oracle.stop()
+        engine.close()
+
+    elapsed = perf_counter() - start
+    achieved = engine.sent / elapsed if elapsed > 0 else 0.0
+    print(f"\n[i] {label}: sent {engine.sent} frames to {len(can_ids)} ID(s) on {interface} in {elapsed:.2f} s ({achieved:.0f} frames/s, engine: {args.engine})")
+
+    if rate:
+        print(f"[i] Rate: {rate.report()}")
+
+    if args.oracle:
+        hits_file = with_suffix(args.hits, label, args) if args.hits else f"canbrute_hits_{sub(r'[^0-9a-z]+', '_', label.lower().replace('0x', '')).strip('_')}.csv"
+        write_hits(hits_file, HITS)
+        print(f"[i] {len(HITS)} hits written to {hits_file}")
+
+    return success
+
+
+def run_worker(args: Namespace, can_ids: list, interface: str, label: str, rate_share: int, results: Queue) -> None:
+    """Worker process entry point"""
+    try:
+        results.put(run(args, can_ids, interface, label, rate_share))
+    except KeyboardInterrupt:
+        results.put(False)
 
 
 def main():
@@ -128,8 +407,34 @@ def main():
     print("(c) Jannik Schmied, 2023")
     print("-" * 56)
 
-    if args.length not in list(range(1, 9)):
-        print("[!] Invalid length! (must be between 1 and 8)")
+    if not is_valid_length(args.length, args.fd):
+        print(f"[!] Invalid length! (must be between {MIN_LENGTH} and {MAX_LENGTH_FD if args.fd else MAX_LENGTH})")
+        sys.exit(1)
+
+    if args.fd and args.engine == "cansend":
+        print("[!] CAN-FD is not supported by the cansend engine!")
+        sys.exit(1)
+
+    if args.engine not in ("native", "cansend") and (args.oracle or (args.strategy == "sensitivity" and not args.baseline)):
+        print(f"[!] The {args.engine} engine only transmits: the oracle and baseline observation need a SocketCAN interface (use --baseline)!")
+        sys.exit(1)
+
+    if args.engine != "cansend" and args.bitrate not in BITRATES:
+        print(f"[!] Invalid bitrate: {args.bitrate} (valid: {', '.join(BITRATES)})")
+        sys.exit(1)
+
+    try:
+        can_ids = parse_id_list(args.id)
+    except ValueError as e:
+        print(f"[!] Invalid ID: {e}")
+        sys.exit(1)
+
+    interfaces = [interface for interface in args.interface.replace(" ", "").split(",") if interface]
+    workers = max(1, min(args.workers or len(interfaces), len(can_ids)))
+
+    # A PCAN channel can only be opened by one process
+    if args.engine == "pcan" and workers > len(interfaces):
+        print("[!] The pcan engine runs one worker per PCAN channel!")
         sys.exit(1)
 
     if args.verbose:
@@ -137,29 +442,42 @@ def main():
         VERBOSE = True
 
     print("[*] Running...")
-
-    if not VERBOSE:
-        print("[i] Hint: use cansniffer to follow message flow or activate verbose mode (-v).")
-
-    msg = "cansend " + args.interface + " " + args.id + "#"
-
-    match args.length:
-        case 1:
-            b1byte(msg)
-        case 2:
-            b2bytes(msg)
-        case 3:
-            b3bytes(msg)
-        case 4:
-            b4bytes(msg)
-        case 5:
-            b5bytes(msg)
-        case 6:
-            b6bytes(msg)
-        case 7:
-            b7bytes(msg)
-        case 8:
-            b8bytes(msg)
+    print(f"[i] IDs: {len(can_ids)}, interfaces: {', '.join(interfaces)}, workers: {workers}")
+
+    if not VERBOSE and not args.oracle:
+        print("[i] Hint: use cansniffer to follow message flow, activate verbose mode (-v) or the response oracle (--oracle).")
+
+    if workers == 1:
+        success = run(args, can_ids, interfaces[0], args.id)
+    else:
+        # IDs are dealt round robin to the workers, workers round robin to the interfaces
+        results = Queue()
+        processes = []
+
+        for worker in range(workers):
+            interface = interfaces[worker % len(interfaces)]
+            rate_share = len(range(worker % len(interfaces), workers, len(interfaces)))
+            label = f"{args.id} w{worker + 1}of{workers}"
+            processes.append(Process(target=run_worker, args=(args, can_ids[worker::workers], interface, label, rate_share, results)))
+
+        for process in processes:
+            process.start()
+
+        success = True
+        for _ in processes:
+            while True:
+                try:
+                    success &= results.get()
+                    break
+                except KeyboardInterrupt:
+                    # Workers save their campaign state on their own
+                    print("\n[*] Stopping workers...")
+
+        for process in processes:
+            process.join()
+
+    if not success:
+        sys.exit(1)
 
     print("\n[+] Finished.\n")
     sys.exit(0)
@@ -6,15 +6,25 @@
     (c) Jannik Schmied, 2023
 """
 import sys
+import threading
 
 from argparse import ArgumentParser, Namespace
 from datetime import datetime
-from shlex import split
-from subprocess import Popen, DEVNULL, PIPE
-from time import sleep
+from time import perf_counter, sleep
 
 from pyfiglet import figlet_format
 
+from utils.analysis import analyze_capture, format_report
+from utils.bisection import bisect, rounds_needed
+from utils.candump import dedupe_log, record_log
+from utils.capture import CAPTURE_EXTENSION, convert_log, count_frames, export_log, is_capture_file, iter_frames, load, read_frames
+from utils.correlation import DEFAULT_TOP, correlate, read_pid_log
+from utils.index import CaptureIndex, index_path
+from utils.ingest import ingest
+from utils.oracle import DEFAULT_LEARN_TIME, ResponseOracle
+from utils.signals import extract_signals, write_dbc
+from utils.socketcan import CAN_MAX_DLEN, NativeCANSocket, format_can_id, pack_frame, parse_id_list
+
 
 # Show extended error messages
 DEBUG: bool = False
@@ -25,37 +35,304 @@ FILE: str
 SANITIZE: bool = False
 SILENT: bool = False
 INTERFACE: str = "vcan0"
+DELAY: float = 3000.0
+REPEAT: int = 1
+DEFAULT_SETTLE_TIME: float = 1.0
 
 
 def parse_args() -> Namespace:
     parser: ArgumentParser = ArgumentParser()
-    parser.add_argument("--file", "-f", help="Specify candump logfile (needs to be sanitized, use --sanitize/-s else)", type=str, required=True)
+    parser.add_argument("--file", "-f", help="Specify candump logfile (candump -l or ID#DATA lines, use --sanitize/-s to remove duplicates), several files with --merge", type=str, nargs="+", required=True)
     parser.add_argument("--sanitize", "-s", help="Sanitizes file for usage", action='store_true')
     parser.add_argument("--silent", help="Suppress unnecessary output", action='store_true')
     parser.add_argument("--interface", "-i", help="Specify CAN interface (default: vcan0)", type=str, default="vcan0")
+    parser.add_argument("--delay", "-d", help="Delay between two frames in milliseconds (default: 3000)", type=float, default=3000.0)
+    parser.add_argument("--repeat", "-r", help="Send each frame N times back-to-back (default: 1)", type=int, default=1)
+    parser.add_argument("--convert", "-c", help=f"Convert the logfile to the columnar capture format ({CAPTURE_EXTENSION}) or a columnar capture back to a candump logfile", type=str)
+    parser.add_argument("--merge", "-m", help=f"Merge the files into one time-ordered columnar capture ({CAPTURE_EXTENSION}) or candump logfile", type=str)
+    parser.add_argument("--workers", "-w", help="Worker processes parsing the files for --merge (default: one per core)", type=int)
+    parser.add_argument("--analyze", "-a", help="Analyze the logfile offline (bit-flip rates, byte entropy and classes per ID) instead of replaying it", action='store_true')
+    parser.add_argument("--top", help="Number of IDs in the analysis report (default: all)", type=int)
+    parser.add_argument("--dbc", help="Extract signals during analysis and export them as draft DBC file", type=str)
+    parser.add_argument("--obd", help="Record OBD-II PIDs (e.g. RPM,SPEED,COOLANT_TEMP) and raw traffic to the logfile, then correlate them", type=str)
+    parser.add_argument("--duration", help="Recording duration in seconds for --obd (default: 60)", type=float, default=60.0)
+    parser.add_argument("--correlate", help="Correlate the logfile with OBD-II readings from a CSV recorded with --obd", type=str)
+    parser.add_argument("--bisect", "-b", help="Isolate the frame causing an effect by replaying halves of the logfile", action='store_true')
+    parser.add_argument("--oracle", help="Detect the effect automatically via bus monitoring instead of asking (bisection)", action='store_true')
+    parser.add_argument("--watch", help="Comma separated IDs whose payload changes count as effect (oracle)", type=str)
+    parser.add_argument("--settle", help=f"Seconds to wait for the effect after each burst (default: {DEFAULT_SETTLE_TIME:.0f})", type=float, default=DEFAULT_SETTLE_TIME)
+    parser.add_argument("--time", "-t", help="Only use frames within START:END seconds from the beginning of the capture (either bound may be omitted)", type=str)
+    parser.add_argument("--ids", help="Only use frames of these comma separated IDs and ID ranges (e.g. 244,700-7FF)", type=str)
 
     return parser.parse_args()
 
 
 def sanitize(file: str) -> str:
+    """Remove duplicate frames from candump logfile, keeping the first occurrence of each frame"""
     new_file: str = f"candump_logfile_{datetime.now().strftime('%Y_%m_%d-%H_%M_%S')}_sanitized.log"
-    command: str = f"cat {file}" + " | awk '{print $3}' | sort | uniq" + f" > {new_file}"
 
     try:
-        sanitize_file_process = Popen(split(command), stdout=DEVNULL, stderr=PIPE)
-        sanitize_file_process.terminate()
+        total, unique = dedupe_log(file, new_file, read_frames(file))
+    except (FileNotFoundError, FileExistsError):
+        print("[!] File not found!")
+        sys.exit(1)
     except Exception as e:
         print("[!] An error occurred:", e)
         sys.exit(1)
 
+    if not SILENT:
+        print(f"[i] Kept {unique} unique of {total} frames in {new_file}")
+
     return new_file
 
 
+def parse_window(window: str) -> tuple:
+    """START:END in seconds from the beginning of the capture, omitted bounds are None"""
+    start, separator, end = window.partition(":")
+    if not separator:
+        raise ValueError(f"invalid time window: {window} (expected START:END)")
+    return float(start) if start else None, float(end) if end else None
+
+
+def select(file: str, window: str = None, ids: str = None):
+    """Frames within the time window and of the IDs, only the matching blocks are read via the index sidecar"""
+    try:
+        start, end = parse_window(window) if window else (None, None)
+        can_ids = parse_id_list(ids) if ids else None
+    except ValueError as e:
+        print(f"[!] Error: {e}")
+        sys.exit(1)
+
+    started = perf_counter()
+    index = CaptureIndex.open(file)
+
+    # Window bounds are relative to the first frame, the index holds absolute timestamps
+    start = index.begin + start if start is not None else None
+    end = index.begin + end if end is not None else None
+
+    blocks = index.select_blocks(can_ids, start, end)
+    frames = index.select(can_ids, start, end)
+
+    if not SILENT:
+        print(f"[i] Selected {len(frames)} of {index.frames} frames from {len(blocks)} of {len(index.blocks)} blocks "
+              f"({index_path(file)}, {perf_counter() - started:.2f} s)")
+
+    return frames
+
+
+def load_frames(file: str, args: Namespace):
+    """Capture array of the frames selected with --time/--ids, or of the whole file"""
+    if args.time or args.ids:
+        return select(file, args.time, args.ids)
+    return load(file)
+
+
+def analyze(file: str, args: Namespace) -> None:
+    """Print a ranked per ID payload analysis of the logfile"""
+    top, dbc = args.top, args.dbc
+
+    print("[*] Loading capture...")
+    started = perf_counter()
+    capture = load_frames(file, args)
+    loaded = perf_counter()
+
+    if not len(capture):
+        print("[!] No frames found in file!")
+        sys.exit(1)
+
+    statistics = analyze_capture(capture)
+    print(f"[i] {len(capture)} frames, {len(statistics)} IDs (loaded in {loaded - started:.1f} s, analyzed in {perf_counter() - loaded:.1f} s)")
+    print("[i] Flip rates per bit (MSB first) in tenths, '.' for bits that never flip")
+
+    for line in format_report(statistics, top):
+        print(line)
+
+    if not dbc:
+        return
+
+    print("[*] Extracting signals...")
+    signals = extract_signals(capture, statistics)
+
+    for stats in statistics[:top]:
+        print(f"[+] {format_can_id(stats.can_id)}:")
+        for signal in signals.get(stats.can_id, []):
+            print(f"    {signal.describe()}")
+
+    write_dbc(dbc, signals, {stats.can_id: stats.dlc for stats in statistics})
+    print(f"[i] {sum(map(len, signals.values()))} signals of {len(signals)} IDs written to {dbc} (draft, raw values)")
+
+
+def convert(file: str, output: str) -> None:
+    """Convert between candump logfiles and columnar captures (direction by the magic of the input)"""
+    started = perf_counter()
+
+    if is_capture_file(file):
+        count = export_log(file, output)
+        print(f"[+] Exported {count} frames to candump logfile {output} in {perf_counter() - started:.1f} s")
+    else:
+        count = convert_log(file, output)
+        print(f"[+] Converted {count} frames to columnar capture {output} in {perf_counter() - started:.1f} s")
+
+
+def merge(files: list, output: str, workers: int = None) -> None:
+    """Parse the files in parallel and merge them into one time-ordered capture"""
+    started = perf_counter()
+
+    def on_file(path: str, frames: int) -> None:
+        if not SILENT:
+            print(f"[i] Parsed {path}: {frames} frames")
+
+    print(f"[*] Merging {len(files)} files...")
+    count = ingest(files, output, workers, on_file=on_file)
+    print(f"[+] Merged {count} frames into {output} in {perf_counter() - started:.1f} s")
+
+
+def obd_path(file: str) -> str:
+    """PID log recorded next to the raw capture"""
+    return f"{file.rsplit('.', 1)[0]}_obd.csv"
+
+
+def record_obd(file: str, pids: str, duration: float) -> str:
+    """Record raw traffic and OBD-II PID readings at the same time, returns path of the PID log"""
+    # python-OBD (and scapy via utils.core) are only needed for recording
+    from utils.OBDLink import OBDCommands, OBDConnection
+
+    try:
+        commands = [OBDCommands.by_name(pid) for pid in pids.split(",") if pid]
+    except ValueError as e:
+        print(f"[!] {e}")
+        sys.exit(1)
+
+    obd_socket = OBDConnection()
+    if not obd_socket.ready:
+        print("[!] Error initializing OBD Device.")
+        sys.exit(1)
+
+    stop = threading.Event()
+    recorder = threading.Thread(target=record_log, args=(INTERFACE, file, stop), daemon=True)
+    recorder.start()
+
+    pid_file = obd_path(file)
+    print(f"[*] Recording {', '.join(command.name for command in commands)} and traffic on {INTERFACE} for {duration:.0f} s...")
+    samples = obd_socket.record(commands, pid_file, duration)
+
+    stop.set()
+    recorder.join()
+    print(f"[i] {samples} OBD readings written to {pid_file}, raw traffic to {file}")
+
+    return pid_file
+
+
+def correlate_obd(file: str, pid_file: str, args: Namespace) -> None:
+    """Print the raw bit fields best matching every recorded PID"""
+    top = args.top
+
+    print("[*] Loading capture and OBD readings...")
+    capture = load_frames(file, args)
+    pids = read_pid_log(pid_file)
+
+    if not len(capture) or not pids:
+        print("[!] No frames or OBD readings found!")
+        sys.exit(1)
+
+    statistics = analyze_capture(capture)
+    signals = extract_signals(capture, statistics)
+
+    try:
+        matches = correlate(capture, pids, signals, top=top or DEFAULT_TOP)
+    except ValueError as e:
+        print(f"[!] Error: {e}")
+        sys.exit(1)
+
+    for pid, pid_matches in matches.items():
+        print(f"[+] {pid} ({len(pids[pid][0])} readings):")
+        for match in pid_matches:
+            print(f"    {match.describe()}")
+
+
+def bisect_replay(file: str, args: Namespace) -> None:
+    """Isolate the frame responsible for an effect in about log2(n) rounds"""
+    frames = list(iter_frames(select(file, args.time, args.ids)) if args.time or args.ids else read_frames(file))
+
+    # CAN-FD frames (##) with more than 8 bytes cannot be sent on a classic socket
+    classic = [frame for frame in frames if len(frame.data) <= CAN_MAX_DLEN]
+    if len(classic) < len(frames):
+        print(f"[i] Skipping {len(frames) - len(classic)} CAN-FD frames")
+        frames = classic
+
+    if not frames:
+        print("[!] No frames found in file!")
+        sys.exit(1)
+
+    print(f"[*] Bisecting {len(frames)} frames (about {rounds_needed(len(frames))} rounds)")
+
+    try:
+        with NativeCANSocket(INTERFACE) as sock:
+            oracle = None
+            if args.oracle:
+                watch_ids = parse_id_list(args.watch) if args.watch else []
+                oracle = ResponseOracle(INTERFACE, {frame.can_id for frame in frames}, watch_ids)
+
+            try:
+                if oracle:
+                    oracle.start()
+                    print(f"[*] Learning regular bus traffic for {DEFAULT_LEARN_TIME:.0f} s...")
+                    oracle.learn(DEFAULT_LEARN_TIME)
+                bisect_frames(frames, sock, oracle, args)
+            except KeyboardInterrupt:
+                print("\n[i] Stopped. (Interrupted by user)")
+            finally:
+                if oracle:
+                    oracle.stop()
+    except (OSError, ValueError) as e:
+        print(f"[!] CAN socket error: {e}")
+        sys.exit(1)
+
+
+def bisect_frames(frames: list, sock: NativeCANSocket, oracle: ResponseOracle, args: Namespace) -> None:
+    """Replay halves of the frames until the responsible frame is found"""
+    def replay(subset: list) -> None:
+        if oracle:
+            oracle.reset()
+        if not SILENT:
+            print(f"[*] Replaying burst of {len(subset)} frames ({subset[0].compact()} ... {subset[-1].compact()})")
+        sock.send_batch(b"".join(pack_frame(frame.can_id, frame.data) * REPEAT for frame in subset))
+
+    def triggered() -> bool:
+        if oracle:
+            sleep(args.settle)
+            reactions = oracle.pop_reactions()
+            print(f"[i] Effect {'detected' if reactions else 'not detected'} ({reactions} reactions)")
+            return reactions > 0
+        return input("[?] Did the effect occur? (y/n) ").strip().lower() in ("y", "yes")
+
+    def on_round(round_number: int, remaining: int) -> None:
+        print(f"[*] Round {round_number}: {remaining} candidates left")
+
+    replay(frames)
+    if not triggered():
+        print("[!] Replaying the whole file did not trigger the effect, nothing to bisect.")
+        return
+
+    result = bisect(frames, replay, triggered, on_round=on_round)
+
+    if len(result) == 1:
+        print(f"[+] Responsible frame: {result[0].compact()} (first seen at {result[0].timestamp:.6f})")
+    else:
+        print(f"[!] Neither half alone triggers the effect, remaining {len(result)} frames:")
+        for frame in result:
+            print(f"    {frame.compact()}")
+
+
 def main():
     args = parse_args()
 
+    if len(args.file) > 1 and not args.merge:
+        print("[!] Several files can only be merged (--merge)!")
+        sys.exit(1)
+
     global FILE
-    FILE = args.file
+    FILE = args.file[0]
 
     if args.sanitize:
         global SANITIZE
@@ -67,6 +344,14 @@ def main():
         global INTERFACE
         INTERFACE = args.interface
 
+    if args.delay < 0 or args.repeat < 1:
+        print("[!] Delay must not be negative and repeat must be at least 1!")
+        sys.exit(1)
+
+    global DELAY, REPEAT
+    DELAY = args.delay
+    REPEAT = args.repeat
+
     file: str = FILE
 
     if not SILENT:
@@ -74,36 +359,75 @@ def main():
         print(f"(c) Jannik Schmied, 2022. Version {VERSION}")
         print("-" * 56)
 
+    if args.merge:
+        try:
+            merge(args.file, args.merge, args.workers)
+        except (FileNotFoundError, ValueError) as e:
+            print(f"[!] Error: {e}")
+            sys.exit(1)
+        return
+
+    if args.convert:
+        try:
+            convert(file, args.convert)
+        except FileNotFoundError:
+            print("[!] File not found!")
+            sys.exit(1)
+        return
+
+    if args.obd or args.correlate:
+        try:
+            pid_file = record_obd(file, args.obd, args.duration) if args.obd else args.correlate
+            correlate_obd(file, pid_file, args)
+        except FileNotFoundError:
+            print("[!] File not found!")
+            sys.exit(1)
+        return
+
+    # Analysis needs every transition, so it always runs on the unsanitized logfile
+    if args.analyze or args.dbc:
+        try:
+            analyze(file, args)
+        except FileNotFoundError:
+            print("[!] File not found!")
+            sys.exit(1)
+        return
+
     if SANITIZE:
         print(f"[*] Sanitizing file for further usage...")
         file = sanitize(file)
 
+    if args.bisect:
+        bisect_replay(file, args)
+        return
+
+    packet_counter: int = 0
+    send_counter: int = 0
+    skip_counter: int = 0
+
     try:
         print("[*] Reading file...")
-        with open(file, "r") as logfile:
-            lines = logfile.readlines()
-            packet_counter: int = 0
-            for line in lines:
-                packet_counter += 1
-            send_counter: int = 0
+        if args.time or args.ids:
+            selection = select(file, args.time, args.ids)
+            packet_counter = len(selection)
+            frames = iter_frames(selection)
+        else:
+            packet_counter = count_frames(file)
+            frames = read_frames(file)
 
+        with NativeCANSocket(INTERFACE) as sock:
             print("[*] Start reverse engineering process")
-            print(f"[i] Total packets: {packet_counter}")
-            for line in lines:
-                can_message = line
-                command = f"cansend {INTERFACE} {can_message}"
-
-                can_message = can_message.replace('\n', '').replace('\r', '')
-                print(f"[*] Sending packet {can_message} ({send_counter}/{packet_counter})")
-                for counter in range(1):
-                    try:
-                        send_can_message_process = Popen(split(command), stdout=PIPE, stderr=PIPE)
-                        send_counter += 1
-                        send_can_message_process.terminate()
-                    except Exception as e:
-                        print(f"[!] Error: {e}")
-                        exit(1)
-                sleep(3)
+            print(f"[i] Total packets: {packet_counter}, sending each {REPEAT}x with {DELAY:g} ms delay")
+            for frame in frames:
+                # CAN-FD frames (##) with more than 8 bytes cannot be sent on a classic socket
+                if len(frame.data) > CAN_MAX_DLEN:
+                    print(f"[i] Skipping CAN-FD packet {frame.compact()}")
+                    skip_counter += 1
+                    continue
+                print(f"[*] Sending packet {frame.compact()} ({send_counter}/{packet_counter})")
+                sock.send_batch(pack_frame(frame.can_id, frame.data) * REPEAT)
+                send_counter += 1
+                sleep(DELAY / 1000)
     except FileExistsError:
         print("[!] File not found!")
         sys.exit(1)
@@ -115,7 +439,7 @@ def main():
     except Exception as e:
         print(f"[!] Error: {e}")
     finally:
-        print(f"[i] Finished! Sent {send_counter} of {packet_counter} packets.")
+        print(f"[i] Finished! Sent {send_counter} of {packet_counter} packets{f' ({skip_counter} CAN-FD packets skipped)' if skip_counter else ''}.")
 
 
 if __name__ == '__main__':
@@ -4,9 +4,28 @@
     (c) Jannik Schmied, 2023
 """
 import os
-import subprocess
 import sys
 from argparse import ArgumentParser, Namespace
+from datetime import datetime
+from time import monotonic, perf_counter, time
+
+import numpy as np
+
+from utils.analysis import id_keys
+from utils.bisection import bisect, rounds_needed
+from utils.candump import FLAG_FD, READ_BUFFER, iter_capture, pack_capture, parse_chunk, read_log
+from utils.capture import iter_frames, load, log_lines
+from utils.index import LineIndex, lines_path
+from utils.mutation import DEFAULT_FUZZ_BATCH, MutationFuzzer, seeds_from_capture
+from utils.oracle import DEFAULT_LEARN_TIME, ResponseOracle, write_hits
+from utils.ratecontrol import DEFAULT_BITRATE, RateController, bitrate
+from utils.scheduler import MAX_SPEED, MIN_SPEED, ReplayScheduler
+from utils.socketcan import CAN_EFF_FLAG, NativeCANSocket, parse_id_list
+
+# Bytes of the log parsed at once (lines when reading via the line index) and frames handed to the socket per batch
+CHUNK_SIZE: int = 1 << 20
+CHUNK_LINES: int = 32768
+BATCH_SIZE: int = 4096
 
 
 def parse_args() -> Namespace:
@@ -14,32 +33,262 @@ def parse_args() -> Namespace:
     parser: ArgumentParser = ArgumentParser()
     parser.add_argument("--file", "-f", type=str, required=True)
     parser.add_argument("--interface", "-i", type=str, required=True)
+    parser.add_argument("--rate", help="Target transmit rate in frames/s", type=float)
+    parser.add_argument("--load", help="Target bus load in percent (alternative to --rate)", type=float)
+    parser.add_argument("--bitrate", help=f"Bus bitrate in kbit/s used for bus load calculation (default: {DEFAULT_BITRATE})", type=str, default=DEFAULT_BITRATE)
+    parser.add_argument("--speed", help=f"Replay speed factor for timestamped logs, {MIN_SPEED:g} to {MAX_SPEED:g} (default: 1)", type=float, default=1.0)
+    parser.add_argument("--start", help="First line to replay (default: 1)", type=int)
+    parser.add_argument("--end", help="Last line to replay (default: last line of the file)", type=int)
+    parser.add_argument("--step", help="Replay only every Nth line of the range (default: 1)", type=int, default=1)
+    parser.add_argument("--bisect", "-b", help="Narrow the line range down to the line causing a fault by replaying halves", action='store_true')
+    parser.add_argument("--fuzz", help="Fuzz with mutations of the frames in --file (seed capture) instead of replaying it", action='store_true')
+    parser.add_argument("--output", "-o", help="Log of all fuzz cases, replayable with this script (default: fuzz_<date>.log)", type=str)
+    parser.add_argument("--cases", help="Number of fuzz cases (default: until interrupted)", type=int)
+    parser.add_argument("--batch", help=f"Fuzz cases sent per batch (default: {DEFAULT_FUZZ_BATCH})", type=int, default=DEFAULT_FUZZ_BATCH)
+    parser.add_argument("--seed", help="Random seed for reproducible fuzzing runs", type=int)
+    parser.add_argument("--ids", help="Only use seed frames of these comma separated IDs and ID ranges (fuzzing)", type=str)
+    parser.add_argument("--watch", help="Comma separated IDs whose payload changes count as coverage (default: all IDs seen while learning)", type=str)
+    parser.add_argument("--learn", help=f"Seconds of bus traffic learned before fuzzing (default: {DEFAULT_LEARN_TIME:.0f})", type=float, default=DEFAULT_LEARN_TIME)
 
     return parser.parse_args()
 
 
+def has_timestamps(path: str) -> bool:
+    """candump -l lines carry timestamps, plain ID#DATA lines (caringcaribou) do not"""
+    first = next(read_log(path), None)
+    return bool(first and first.interface)
+
+
+def select_lines(args: Namespace, index: LineIndex) -> np.ndarray:
+    """Line numbers (0-based) selected with --start/--end/--step"""
+    start = args.start or 1
+    end = args.end or len(index)
+
+    if not 1 <= start <= end <= len(index):
+        raise ValueError(f"invalid line range {start}-{end} (file has {len(index)} lines)")
+    if args.step < 1:
+        raise ValueError("step must be at least 1")
+
+    return np.arange(start - 1, end, args.step)
+
+
+def read_chunks(file: str, index: LineIndex = None, lines: np.ndarray = None):
+    """Yield the log as capture arrays, only the given lines (read via the line index) if set"""
+    if lines is None:
+        yield from iter_capture(file, chunk_size=CHUNK_SIZE)
+        return
+
+    for offset in range(0, len(lines), CHUNK_LINES):
+        yield parse_chunk(index.read(lines[offset:offset + CHUNK_LINES]), index.width)
+
+
+def send_chunks(sock: NativeCANSocket, chunks, progress: bool = True) -> tuple:
+    """Send capture arrays in batches, returns (sent, skipped)"""
+    sent = 0
+    skipped = 0
+
+    for capture in chunks:
+        # CAN-FD frames (##) cannot be sent on a classic socket
+        classic = (capture["flags"] & FLAG_FD) == 0
+        skipped += len(capture) - int(classic.sum())
+        frames = pack_capture(capture[classic])
+
+        for offset in range(0, len(frames), BATCH_SIZE):
+            sent += sock.send_batch(frames[offset:offset + BATCH_SIZE])
+            if progress:
+                print(f"[i] Sent {sent} frames", end="\r")
+
+    return sent, skipped
+
+
+def replay_timed(args: Namespace, scheduler: ReplayScheduler, chunks, rate: RateController = None) -> None:
+    """Replay a timestamped log with its original inter-frame gaps (scaled by --speed) over one socket"""
+    sent = 0
+    skipped = 0
+
+    print(f"[*] Replaying with original timing at {scheduler.speed:g}x")
+
+    with NativeCANSocket(args.interface) as sock:
+        try:
+            for frame in (frame for capture in chunks for frame in iter_frames(capture)):
+                # CAN-FD frames (##) cannot be sent on a classic socket
+                if frame.fd:
+                    skipped += 1
+                    continue
+                scheduler.wait(frame.timestamp)
+                if rate:
+                    rate.acquire(len(frame.data), bool(frame.can_id & CAN_EFF_FLAG))
+                sock.send(frame.can_id, frame.data)
+                sent += 1
+        except KeyboardInterrupt:
+            print("\n[*] Stopped. (Interrupted by user)")
+
+    print(f"[i] Sent {sent} frames")
+    if skipped:
+        print(f"[!] Skipped {skipped} CAN-FD frames")
+    print(f"[i] Timing: {scheduler.report()}")
+
+
+def replay_batched(args: Namespace, chunks, rate: RateController = None) -> None:
+    """Parse the log chunk by chunk and send the frames in batches over one socket, as fast as the bus (or --rate) allows"""
+    sent = 0
+    skipped = 0
+    started = perf_counter()
+
+    with NativeCANSocket(args.interface, rate=rate) as sock:
+        try:
+            sent, skipped = send_chunks(sock, chunks)
+        except KeyboardInterrupt:
+            print("\n[*] Stopped. (Interrupted by user)")
+
+    elapsed = perf_counter() - started
+    print(f"\n[i] Sent {sent} frames in {elapsed:.1f} s ({sent / elapsed if elapsed > 0 else 0:.0f} frames/s)")
+    if skipped:
+        print(f"[!] Skipped {skipped} CAN-FD frames")
+
+
+def bisect_lines(args: Namespace, index: LineIndex, lines: np.ndarray, rate: RateController = None) -> None:
+    """Narrow the selected lines down to the one causing a fault in about log2(n) rounds"""
+    print(f"[*] Bisecting {len(lines)} lines {lines[0] + 1}-{lines[-1] + 1} (about {rounds_needed(len(lines))} rounds)")
+
+    with NativeCANSocket(args.interface, rate=rate) as sock:
+        def replay(subset: np.ndarray) -> None:
+            print(f"[*] Replaying {len(subset)} lines {subset[0] + 1}-{subset[-1] + 1}")
+            send_chunks(sock, read_chunks(args.file, index, subset), progress=False)
+
+        def triggered() -> bool:
+            return input("[?] Did the fault occur? (y/n, reset the ECU before answering) ").strip().lower() in ("y", "yes")
+
+        def on_round(round_number: int, remaining: int) -> None:
+            print(f"[*] Round {round_number}: {remaining} lines left")
+
+        try:
+            replay(lines)
+            if not triggered():
+                print("[!] Replaying the whole range did not trigger the fault, nothing to bisect.")
+                return
+
+            result = bisect(lines, replay, triggered, on_round=on_round)
+        except KeyboardInterrupt:
+            print("\n[*] Stopped. (Interrupted by user)")
+            return
+
+    if len(result) == 1:
+        print(f"[+] Responsible line {result[0] + 1}: {index.read(result).decode(errors='replace').strip()}")
+    else:
+        print(f"[!] Neither half alone triggers the fault, remaining {len(result)} lines {result[0] + 1}-{result[-1] + 1}:")
+        print(f"    --start {result[0] + 1} --end {result[-1] + 1} --step {args.step}")
+
+
+def fuzz(args: Namespace, rate: RateController = None) -> None:
+    """Mutate seed frames of the capture, prioritizing seeds whose mutants cause new reactions on the bus"""
+    capture = load(args.file)
+    seeds = seeds_from_capture(capture, set(parse_id_list(args.ids)) if args.ids else None)
+    fuzzer = MutationFuzzer(seeds, args.seed, args.batch)
+    output = args.output or f"fuzz_{datetime.now().strftime('%Y_%m_%d-%H_%M_%S')}.log"
+    hits = []
+
+    print(f"[i] {len(seeds)} seed frames of {len({seed.can_id for seed in seeds})} IDs from {args.file}")
+
+    oracle = ResponseOracle(args.interface, {seed.can_id for seed in seeds}, parse_id_list(args.watch) if args.watch else None,
+                            errors=True, watch_all=not args.watch)
+    oracle.start()
+    print(f"[*] Learning regular bus traffic for {args.learn:.0f} s...")
+    oracle.learn(args.learn)
+    print(f"[i] {len(oracle.learned_ids)} IDs learned, {len(oracle.periods)} of them periodic (heartbeat monitoring)")
+
+    started = perf_counter()
+    reported = started
+
+    try:
+        with NativeCANSocket(args.interface, rate=rate) as sock, open(output, "w", buffering=READ_BUFFER) as log:
+            print(f"[*] Fuzzing, cases are logged to {output}")
+
+            while not args.cases or fuzzer.cases < args.cases:
+                number, first, frames = fuzzer.next_batch()
+
+                sent, sent_time = monotonic(), time()
+                sock.send_batch(pack_capture(frames))
+                finished, finished_time = monotonic(), time()
+
+                # Case n is line n + 1 of the log
+                frames["timestamp"] = np.linspace(sent_time, finished_time, len(frames))
+                log.writelines(log_lines(frames, args.interface))
+                oracle.record(id_keys(frames), frames["data"], sent, finished, np.arange(first, first + len(frames)), number)
+
+                for hit in oracle.pop_hits():
+                    if fuzzer.feedback(hit, oracle.volatile):
+                        hits.append(hit)
+                        lines = [index + 1 for _, _, index, _ in hit.suspects]
+                        print(f"[+] New coverage: {hit.describe()} (lines {min(lines)}-{max(lines)})")
+
+                now = perf_counter()
+                if now - reported >= 1:
+                    reported = now
+                    print(f"[i] {fuzzer.cases} cases ({fuzzer.cases / (now - started):.0f}/s), corpus {len(fuzzer.corpus)}, coverage {len(fuzzer.coverage)}", end="\r")
+    except KeyboardInterrupt:
+        print("\n[*] Stopped. (Interrupted by user)")
+    finally:
+        oracle.stop()
+
+    elapsed = perf_counter() - started
+    print(f"\n[i] {fuzzer.cases} cases in {elapsed:.1f} s ({fuzzer.cases / elapsed if elapsed > 0 else 0:.0f}/s), {len(fuzzer.coverage)} reactions covered")
+
+    if hits:
+        hits_file = f"{output.rsplit('.', 1)[0]}_hits.csv"
+        write_hits(hits_file, hits)
+        print(f"[+] {len(hits)} new reactions written to {hits_file}, reproduce with --start/--end around the lines")
+
+
 def main():
     args = parse_args()
+    rate = None
 
-    if os.path.exists(args.file):
-        with open(args.file, 'r') as messages:
-            for msg_data in messages:
-                msg = ["cansend", args.interface, msg_data]
-
-                try:
-                    proc = subprocess.Popen(msg, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                    print(f"[i] Current: {msg.strip()}", end='\r')
-                except KeyboardInterrupt:
-                    print("\n[*] Stopped. (Interrupted by user)")
-                    exit(0)
-                except Exception as e:
-                    print("[!] Error:", e)
-                finally:
-                    proc.terminate()
-    else:
+    try:
+        scheduler = ReplayScheduler(args.speed)
+    except ValueError as e:
+        print(f"[!] Invalid speed: {e}")
+        sys.exit(1)
+
+    if args.rate or args.load:
+        try:
+            rate = RateController(args.rate, args.load, bitrate(args.bitrate))
+        except ValueError as e:
+            print(f"[!] Invalid rate: {e}")
+            sys.exit(1)
+
+    if not os.path.exists(args.file):
         print("[!] Error: file does not exist!")
         sys.exit(1)
 
+    index = lines = None
+    if args.start or args.end or args.step != 1 or args.bisect:
+        started = perf_counter()
+        index = LineIndex.open(args.file)
+        print(f"[i] Line index {lines_path(args.file)}: {len(index)} lines ({perf_counter() - started:.2f} s)")
+
+        try:
+            lines = select_lines(args, index)
+        except ValueError as e:
+            print(f"[!] Error: {e}")
+            sys.exit(1)
+
+    try:
+        if args.fuzz:
+            fuzz(args, rate)
+        elif args.bisect:
+            bisect_lines(args, index, lines, rate)
+        elif has_timestamps(args.file):
+            replay_timed(args, scheduler, read_chunks(args.file, index, lines), rate)
+        else:
+            replay_batched(args, read_chunks(args.file, index, lines), rate)
+    except (OSError, ValueError) as e:
+        print(f"[!] Error: {e}")
+        sys.exit(1)
+
+    if rate:
+        print(f"\n[i] Rate: {rate.report()}")
+
     print("\n[+] Finished.\n")
     sys.exit(0)
 
@@ -0,0 +1,37 @@
+import pytest
+
+from utils.bisection import bisect, rounds_needed
+
+
+def run(candidates: list, culprits: set, verify: bool = True) -> tuple:
+    replayed = []
+
+    def replay(subset: list) -> None:
+        replayed.append(set(subset))
+
+    def triggered() -> bool:
+        return culprits <= replayed[-1]
+
+    return bisect(candidates, replay, triggered, verify), len(replayed)
+
+
+@pytest.mark.parametrize("culprit", [0, 1, 500, 998, 999])
+def test_isolates_single_culprit(culprit):
+    result, replays = run(list(range(1000)), {culprit})
+    assert result == [culprit]
+    assert replays <= 2 * rounds_needed(1000)
+
+
+def test_culprits_in_both_halves():
+    result, _ = run(list(range(8)), {1, 6})
+    assert result == list(range(8))
+
+
+def test_without_verify_second_half_is_assumed():
+    result, replays = run(list(range(16)), {15}, verify=False)
+    assert result == [15]
+    assert replays == rounds_needed(16)
+
+
+def test_rounds_needed():
+    assert [rounds_needed(count) for count in (0, 1, 2, 3, 1024, 1025)] == [0, 0, 1, 2, 10, 11]
@@ -0,0 +1,50 @@
+from utils.candump import FD_FLAGS_MASK, FD_FLAGS_SHIFT, FLAG_EFF, FLAG_FD, FLAG_RTR, log_width, parse_chunk, parse_line
+from utils.socketcan import CAN_EFF_FLAG, CAN_MAX_DLEN, CAN_RTR_FLAG, CANFD_MAX_DLEN
+
+LOG = (b"(1.000000) can0 123#DEADBEEF\n"
+       b"(2.000000) can0 12345678#01\n"
+       b"(3.000000) can0 7DF#R\n"
+       b"(4.000000) can0 7E0##1112233445566778899AABBCC\n"
+       b"(5.000000) can0 7E1##3AA\n"
+       b"not a frame\n")
+
+
+def test_parse_chunk_flags():
+    frames = parse_chunk(LOG, CANFD_MAX_DLEN)
+
+    assert frames["can_id"].tolist() == [0x123, 0x12345678, 0x7DF, 0x7E0, 0x7E1]
+    assert frames["dlc"].tolist() == [4, 1, 0, 12, 1]
+    flags = frames["flags"].tolist()
+    assert flags[0] == 0
+    assert flags[1] == FLAG_EFF
+    assert flags[2] == FLAG_RTR
+    assert flags[3] & FLAG_FD and (flags[3] >> FD_FLAGS_SHIFT) & FD_FLAGS_MASK == 1
+    assert flags[4] & FLAG_FD and (flags[4] >> FD_FLAGS_SHIFT) & FD_FLAGS_MASK == 3
+    assert frames["data"][3, :12].tobytes() == bytes.fromhex("112233445566778899AABBCC")
+
+
+def test_parse_chunk_skips_frames_wider_than_width():
+    frames = parse_chunk(LOG, CAN_MAX_DLEN)
+    assert 0x7E0 not in frames["can_id"].tolist()
+    assert len(frames) == 4
+
+
+def test_parse_line_keeps_fd_flags():
+    for line in ("7E0##1DEADBEEF", "123#DEADBEEF", "123#R", "(1.500000) can0 12345678#0102"):
+        assert str(parse_line(line)) == line
+
+    frame = parse_line("7E0##1DEADBEEF")
+    assert frame.fd and frame.fd_flags == 1
+    assert frame.key != parse_line("7E0#DEADBEEF").key
+    assert parse_line("123#R").can_id == 0x123 | CAN_RTR_FLAG
+    assert parse_line("12345678#01").can_id == 0x12345678 | CAN_EFF_FLAG
+
+
+def test_log_width(tmp_path):
+    classic = tmp_path / "classic.log"
+    classic.write_bytes(b"(1.0) can0 123#AA\n")
+    fd = tmp_path / "fd.log"
+    fd.write_bytes(LOG)
+
+    assert log_width(str(classic)) == CAN_MAX_DLEN
+    assert log_width(str(fd)) == CANFD_MAX_DLEN
@@ -0,0 +1,55 @@
+import numpy as np
+
+from utils.candump import FLAG_FD, load_capture
+from utils.capture import convert_log, count_frames, export_log, is_capture_file, load, open_capture, read_frames
+from utils.socketcan import CAN_MAX_DLEN, CANFD_MAX_DLEN
+
+LOG = ("(1.000000) can0 123#DEADBEEF\n"
+       "(2.000000) can0 12345678#01\n"
+       "(3.000000) can0 7DF#R\n"
+       "(4.000000) can0 456##1112233445566778899AABBCC\n"
+       "(5.000000) can0 124#\n")
+
+
+def write_log(tmp_path, text: str = LOG) -> str:
+    path = tmp_path / "capture.log"
+    path.write_text(text)
+    return str(path)
+
+
+def test_cancol_round_trip(tmp_path):
+    log_path = write_log(tmp_path)
+    capture_path = str(tmp_path / "capture.cancol")
+
+    assert convert_log(log_path, capture_path) == 5
+    assert is_capture_file(capture_path) and not is_capture_file(log_path)
+
+    capture = open_capture(capture_path)
+    assert capture.width == CANFD_MAX_DLEN
+    assert capture.interface == "can0"
+    assert count_frames(capture_path) == count_frames(log_path) == 5
+    np.testing.assert_array_equal(capture["data"], load_capture(log_path)["data"])
+
+    exported = str(tmp_path / "exported.log")
+    assert export_log(capture_path, exported) == 5
+    assert open(exported).read() == LOG
+
+
+def test_classic_capture_width(tmp_path):
+    log_path = write_log(tmp_path, "(1.000000) can0 123#AA\n")
+    capture_path = str(tmp_path / "classic.cancol")
+    convert_log(log_path, capture_path)
+    assert open_capture(capture_path).width == CAN_MAX_DLEN
+
+
+def test_load_keeps_fd_frames(tmp_path):
+    capture = load(write_log(tmp_path))
+    assert len(capture) == 5
+    assert capture["flags"][capture["can_id"] == 0x456] & FLAG_FD
+
+
+def test_read_frames_of_capture_and_log_agree(tmp_path):
+    log_path = write_log(tmp_path)
+    capture_path = str(tmp_path / "capture.cancol")
+    convert_log(log_path, capture_path)
+    assert list(read_frames(capture_path)) == list(read_frames(log_path))
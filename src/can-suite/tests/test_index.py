@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from utils.capture import convert_log
+from utils.index import CaptureIndex, LineIndex
+from utils.candump import parse_chunk
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    lines = [f"({number:.6f}) can0 {0x100 + number % 4:03X}#{number % 256:02X}\n" for number in range(20000)]
+    lines[5000] = "(5000.000000) can0 456##1112233445566778899AABBCC\n"
+    path = tmp_path / "large.log"
+    path.write_text("".join(lines))
+    return str(path)
+
+
+def test_select_matches_full_scan(log_path):
+    index = CaptureIndex.open(log_path)
+    assert index.frames == 20000
+    assert len(index.blocks) > 1
+
+    frames = index.select([0x101], 100.0, 200.0)
+    assert frames["can_id"].tolist() == [0x101] * 25
+    assert frames["timestamp"].min() >= 100.0 and frames["timestamp"].max() <= 200.0
+
+
+def test_select_keeps_fd_frames(log_path):
+    frames = CaptureIndex.open(log_path).select([0x456])
+    assert len(frames) == 1
+    assert frames["data"][0, :12].tobytes() == bytes.fromhex("112233445566778899AABBCC")
+
+
+def test_select_on_columnar_capture(log_path, tmp_path):
+    capture_path = str(tmp_path / "large.cancol")
+    convert_log(log_path, capture_path)
+
+    frames = CaptureIndex.open(capture_path).select([0x456, 0x102])
+    expected = CaptureIndex.open(log_path).select([0x456, 0x102])
+    np.testing.assert_array_equal(frames["can_id"], expected["can_id"])
+    np.testing.assert_array_equal(frames["timestamp"], expected["timestamp"])
+
+
+def test_line_index(log_path):
+    index = LineIndex.open(log_path)
+    assert len(index) == 20000
+
+    frames = parse_chunk(index.read([4999, 5000, 7000]), index.width)
+    assert frames["can_id"].tolist() == [0x103, 0x456, 0x100]
@@ -0,0 +1,42 @@
+import numpy as np
+
+from utils.candump import capture_dtype
+from utils.capture import Capture, open_capture
+from utils.ingest import ingest, merge_captures
+
+
+def capture(timestamps: list, can_id: int) -> Capture:
+    frames = np.zeros(len(timestamps), dtype=capture_dtype())
+    frames["timestamp"] = timestamps
+    frames["can_id"] = can_id
+    return Capture.from_records(frames)
+
+
+def test_merge_captures_is_time_ordered_and_stable():
+    first = capture([1.0, 2.0, 4.0, 4.0], 0x100)
+    second = capture([0.5, 2.0, 3.0], 0x200)
+
+    merged = list(merge_captures([first, second]))
+    timestamps = np.concatenate([frames["timestamp"] for frames, _ in merged])
+    sources = np.concatenate([origins for _, origins in merged])
+    can_ids = np.concatenate([frames["can_id"] for frames, _ in merged])
+
+    assert timestamps.tolist() == [0.5, 1.0, 2.0, 2.0, 3.0, 4.0, 4.0]
+    # Equal timestamps keep the order of the inputs
+    assert sources.tolist() == [1, 0, 0, 1, 1, 0, 0]
+    assert (can_ids == np.where(sources == 0, 0x100, 0x200)).all()
+
+
+def test_ingest_merges_classic_and_fd_logs(tmp_path):
+    classic = tmp_path / "classic.log"
+    classic.write_text("(3.000000) can0 123#AA\n(1.000000) can0 123#BB\n")
+    fd = tmp_path / "fd.log"
+    fd.write_text("(2.000000) can1 456##1112233445566778899AABBCC\n")
+    output = str(tmp_path / "merged.cancol")
+
+    assert ingest([str(classic), str(fd)], output, workers=1) == 3
+
+    merged = open_capture(output)
+    assert merged.width == 64
+    assert merged["timestamp"].tolist() == [1.0, 2.0, 3.0]
+    assert merged["can_id"].tolist() == [0x123, 0x456, 0x123]
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from utils.keyspace import ORDERS, keyspace, keyspace_size, payload_block
+
+
+def as_ints(block: np.ndarray) -> np.ndarray:
+    return block.astype(np.uint64) @ (np.uint64(256) ** np.arange(block.shape[1] - 1, -1, -1, dtype=np.uint64))
+
+
+@pytest.mark.parametrize("order", ORDERS)
+@pytest.mark.parametrize("length", [1, 2])
+def test_payload_block_is_bijective(order, length):
+    block = payload_block(length, 0, keyspace_size(length), order, seed=7)
+    assert block.shape == (keyspace_size(length), length)
+    assert len(np.unique(as_ints(block))) == keyspace_size(length)
+
+
+@pytest.mark.parametrize("order", ORDERS)
+def test_keyspace_blocks_match_one_block(order):
+    blocks = np.concatenate([payload for _, payload in keyspace(2, order, block_size=1000, seed=3)])
+    np.testing.assert_array_equal(blocks, payload_block(2, 0, keyspace_size(2), order, seed=3))
+
+
+def test_counting_and_walk_orders():
+    assert payload_block(2, 1, 1).tolist() == [[0x00, 0x01]]
+    assert payload_block(2, 1, 1, "walk").tolist() == [[0x01, 0x00]]
+
+
+def test_gray_order_flips_one_bit():
+    values = as_ints(payload_block(2, 0, keyspace_size(2), "gray"))
+    flips = np.unpackbits((values[1:] ^ values[:-1]).astype(">u8").view(np.uint8))
+    assert flips.reshape(len(values) - 1, -1).sum(axis=1).tolist() == [1] * (len(values) - 1)
+
+
+def test_payload_block_across_64_bit_boundary():
+    block = payload_block(9, (1 << 64) - 1, 2)
+    assert block.tolist() == [[0x00] + [0xFF] * 8, [0x01] + [0x00] * 8]
+
+
+def test_unknown_order():
+    with pytest.raises(ValueError):
+        payload_block(1, 0, 1, "spiral")
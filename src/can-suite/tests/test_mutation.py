@@ -0,0 +1,34 @@
+from utils.mutation import NOVELTY_ENERGY, MutationFuzzer, Seed, coverage_key
+from utils.oracle import REACTION_CHANGED, REACTION_NEGATIVE_RESPONSE, REACTION_NEW_ID, Hit
+
+
+def hit(reaction: str, can_id: int, data: bytes, index: int = None, tag: int = None) -> Hit:
+    return Hit(0.0, reaction, can_id, data, 0x7E0, b"", index, tag)
+
+
+def test_coverage_key_ignores_volatile_bytes():
+    volatile = {0x300: 0x0000FF}
+    first = hit(REACTION_CHANGED, 0x300, b"\x01\x02\x10")
+    counter = hit(REACTION_CHANGED, 0x300, b"\x01\x02\x11")
+    value = hit(REACTION_CHANGED, 0x300, b"\x01\x03\x12")
+
+    assert coverage_key(first, volatile) == coverage_key(counter, volatile)
+    assert coverage_key(first, volatile) != coverage_key(value, volatile)
+    assert coverage_key(first) != coverage_key(counter)
+
+
+def test_coverage_key_of_responses_and_new_ids():
+    assert coverage_key(hit(REACTION_NEGATIVE_RESPONSE, 0x7E8, b"\x03\x7F\x10\x31\x00")) == (REACTION_NEGATIVE_RESPONSE, 0x7E8, b"\x7F\x10\x31")
+    assert coverage_key(hit(REACTION_NEW_ID, 0x555, b"\x01")) == coverage_key(hit(REACTION_NEW_ID, 0x555, b"\x02"))
+
+
+def test_feedback_adds_seeds_for_new_coverage_only():
+    fuzzer = MutationFuzzer([Seed(0x100, b"\x00\x00")], rng_seed=1, batch=16)
+    number, first, _ = fuzzer.next_batch()
+    volatile = {0x300: 0x00FF}
+
+    assert fuzzer.feedback(hit(REACTION_CHANGED, 0x300, b"\x01\x00", first, number), volatile)
+    assert not fuzzer.feedback(hit(REACTION_CHANGED, 0x300, b"\x01\x01", first + 1, number), volatile)
+    assert len(fuzzer.corpus) == 2
+    assert fuzzer.corpus[1].energy == NOVELTY_ENERGY
+    assert fuzzer.corpus[0].finds == 1
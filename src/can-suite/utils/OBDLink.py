@@ -7,6 +7,7 @@
 
     (c) Jannik Schmied, 2023
 """
+import csv
 import os
 import platform
 import sys
@@ -14,7 +15,7 @@ import sys
 from .core import is_valid_com_port
 from dataclasses import dataclass
 from re import match
-from time import sleep
+from time import sleep, time
 
 import obd
 
@@ -43,6 +44,13 @@ class OBDCommands:
     # Options
     OPTIONS = [ELM_VERSION, ELM_VOLTAGE, FUEL, RPM, SPEED, TEMP, CLEAR_DTC, CURRENT_DTC, GET_DTC]
 
+    @staticmethod
+    def by_name(name: str):
+        """Look up any python-OBD command by name (e.g. RPM, SPEED, COOLANT_TEMP)"""
+        if not obd.commands.has_name(name.upper()):
+            raise ValueError(f"unknown OBD command: {name}")
+        return obd.commands[name.upper()]
+
     @staticmethod
     def print_options():
         """Print available Commands"""
@@ -88,3 +96,40 @@ class OBDConnection:
 
         except KeyboardInterrupt:
             print("[!] Stopped. (interrupted by user)")
+
+    def sample(self, cmd):
+        """Query command once, returns (timestamp, value) or None for empty and non-numeric responses.
+        The timestamp is the middle of the request (epoch seconds, same clock as candump -l)."""
+        requested = time()
+        res = self.connection.query(cmd)
+        answered = time()
+
+        if res.is_null():
+            return None
+
+        value = getattr(res.value, "magnitude", res.value)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+
+        return (requested + answered) / 2, float(value)
+
+    def record(self, cmds: list, path: str, duration: float) -> int:
+        """Poll commands round robin for duration seconds and write time,pid,value CSV, returns number of samples"""
+        samples = 0
+        stop = time() + duration
+
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["time", "pid", "value"])
+
+            try:
+                while time() < stop:
+                    for cmd in cmds:
+                        sample = self.sample(cmd)
+                        if sample:
+                            writer.writerow([f"{sample[0]:.6f}", cmd.name, sample[1]])
+                            samples += 1
+            except KeyboardInterrupt:
+                print("[!] Stopped. (interrupted by user)")
+
+        return samples
@@ -0,0 +1,184 @@
+"""
+    CAN Suite payload analysis.
+
+    Library computing per arbitration ID bit-flip rates, byte entropy and a
+    byte classification (constant, counter, checksum, signal) of captures
+    loaded with candump.load_capture(). All statistics of one ID are computed
+    on whole NumPy columns, never frame by frame.
+
+    (c) Jannik Schmied, 2023
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+from .candump import FLAG_EFF, FLAG_RTR
+from .socketcan import CAN_EFF_FLAG, format_can_id
+
+# Byte classes
+BYTE_CONSTANT: str = "constant"
+BYTE_COUNTER: str = "counter"
+BYTE_CHECKSUM: str = "checksum"
+BYTE_SIGNAL: str = "signal"
+
+# Share of transitions which must fit a counter or checksum model
+MATCH_THRESHOLD: float = 0.95
+
+# Bit flip rates of CRC bytes stay around 0.5 whenever the payload changes
+CRC_FLIP_RATE: tuple = (0.3, 0.7)
+
+# Counter candidates: whole byte, low nibble and high nibble as (mask, shift, modulus)
+_COUNTER_FIELDS: tuple = ((0xFF, 0, 256), (0x0F, 0, 16), (0xF0, 4, 16))
+
+
+@dataclass
+class IDStatistics:
+    """Payload statistics of one arbitration ID. Bits are numbered MSB first (bit 0 is bit 7 of byte 0)."""
+    can_id: int
+    frames: int
+    dlc: int
+    period: float
+    flips: np.ndarray
+    flip_rate: np.ndarray
+    entropy: np.ndarray
+    classes: list
+
+    @property
+    def score(self) -> float:
+        """Activity of signal bytes, counters and checksums change all the time without carrying information"""
+        signal = np.repeat([kind == BYTE_SIGNAL for kind in self.classes], 8)
+        return float(self.flip_rate[signal].sum()) if self.dlc else 0.0
+
+    def heatmap(self, byte: int) -> str:
+        """Flip rate of the bits of one byte as digits (tenths), '.' for bits that never flip"""
+        rates = self.flip_rate[8 * byte:8 * byte + 8]
+        return "".join("." if rate == 0 else str(min(int(rate * 10), 9)) for rate in rates)
+
+
+def _mode_share(values: np.ndarray, exclude_zero: bool = False) -> float:
+    """Share of the most common value (optionally ignoring zero)"""
+    if not len(values):
+        return 0.0
+    counts = np.bincount(values)
+    if exclude_zero:
+        counts[0] = 0
+    return counts.max() / len(values)
+
+
+def _is_counter(column: np.ndarray) -> bool:
+    for mask, shift, modulus in _COUNTER_FIELDS:
+        # All changes have to happen inside the field
+        if np.any((column[1:] ^ column[:-1]) & (0xFF ^ mask)):
+            continue
+        values = (column & mask) >> shift
+        steps = (values[1:].astype(np.int16) - values[:-1]) % modulus
+        if _mode_share(steps, exclude_zero=True) >= MATCH_THRESHOLD and np.count_nonzero(steps) >= MATCH_THRESHOLD * len(steps):
+            return True
+    return False
+
+
+def _classify(data: np.ndarray, flips: np.ndarray) -> list:
+    frames, dlc = data.shape
+    changed = flips.reshape(dlc, 8).sum(axis=1) > 0
+    classes = [BYTE_SIGNAL if changed[byte] else BYTE_CONSTANT for byte in range(dlc)]
+
+    if frames < 3:
+        return classes
+
+    for byte in np.nonzero(changed)[0]:
+        if _is_counter(data[:, byte]):
+            classes[byte] = BYTE_COUNTER
+
+    # Additive checksum: byte = sum of the other bytes + constant (mod 256)
+    total = data.sum(axis=1, dtype=np.int64)
+    for byte in np.nonzero(changed)[0]:
+        if classes[byte] == BYTE_SIGNAL:
+            offset = (2 * data[:, byte].astype(np.int64) - total) % 256
+            if _mode_share(offset) >= MATCH_THRESHOLD:
+                classes[byte] = BYTE_CHECKSUM
+
+    if BYTE_CHECKSUM in classes:
+        return classes
+
+    # XOR checksum: XOR over all bytes is constant, attributed to the last changing byte
+    if _mode_share(np.bitwise_xor.reduce(data, axis=1)) >= MATCH_THRESHOLD:
+        candidates = [byte for byte in range(dlc) if classes[byte] == BYTE_SIGNAL]
+        if len(candidates) > 1:
+            classes[candidates[-1]] = BYTE_CHECKSUM
+            return classes
+
+    # CRC: changes whenever the rest of the payload changes, every bit flips about half of the time
+    xor = data[1:] ^ data[:-1]
+    crc_candidates = []
+    for byte in np.nonzero(changed)[0]:
+        if classes[byte] != BYTE_SIGNAL:
+            continue
+        others = np.delete(xor, byte, axis=1).any(axis=1)
+        if not others.any():
+            continue
+        follows = np.count_nonzero(xor[others, byte]) / np.count_nonzero(others)
+        rates = np.unpackbits(xor[others, byte:byte + 1], axis=1).mean(axis=0)
+        if follows >= MATCH_THRESHOLD and np.all((rates >= CRC_FLIP_RATE[0]) & (rates <= CRC_FLIP_RATE[1])):
+            crc_candidates.append(byte)
+
+    # Random looking bytes are only a CRC if other signals remain (fully random payloads are not)
+    if len(crc_candidates) == 1 and classes.count(BYTE_SIGNAL) > 1:
+        classes[crc_candidates[0]] = BYTE_CHECKSUM
+
+    return classes
+
+
+def id_keys(capture: np.ndarray) -> np.ndarray:
+    """Arbitration IDs of a capture with the EFF flag set for extended IDs (SocketCAN convention)"""
+    return capture["can_id"].astype(np.uint32) | np.where(capture["flags"] & FLAG_EFF, CAN_EFF_FLAG, 0).astype(np.uint32)
+
+
+def group_by_id(capture: np.ndarray) -> tuple:
+    """Data frames sorted by ID (stable, so each ID stays in time order) and the slice of every ID"""
+    capture = capture[(capture["flags"] & FLAG_RTR) == 0]
+    keys = id_keys(capture)
+    order = np.argsort(keys, kind="stable")
+    capture, keys = capture[order], keys[order]
+    ids, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+    return capture, [(int(can_id), slice(start, start + count)) for can_id, start, count in zip(ids, starts, counts)]
+
+
+def analyze_id(can_id: int, frames: np.ndarray) -> IDStatistics:
+    """Bit-flip rates, byte entropy and byte classes of the frames of one ID"""
+    count = len(frames)
+    dlc = int(frames["dlc"].max())
+    data = frames["data"][:, :dlc]
+
+    xor = data[1:] ^ data[:-1]
+    flips = np.unpackbits(xor, axis=1).sum(axis=0, dtype=np.int64)
+    flip_rate = flips / max(count - 1, 1)
+
+    # Shannon entropy of every byte column, one bincount over all columns at once
+    counts = np.bincount((data.astype(np.int64) + 256 * np.arange(dlc)).ravel(), minlength=256 * dlc).reshape(dlc, 256)
+    probabilities = counts / count
+    with np.errstate(divide="ignore", invalid="ignore"):
+        entropy = np.where(probabilities > 0, -probabilities * np.log2(probabilities), 0).sum(axis=1) + 0.0
+
+    period = float(np.median(np.diff(frames["timestamp"]))) if count > 1 else 0.0
+
+    return IDStatistics(can_id, count, dlc, period, flips, flip_rate, entropy, _classify(data, flips))
+
+
+def analyze_capture(capture: np.ndarray) -> list:
+    """Statistics of every ID of a capture, ranked by signal activity"""
+    capture, groups = group_by_id(capture)
+    statistics = [analyze_id(can_id, capture[group]) for can_id, group in groups]
+    return sorted(statistics, key=lambda stats: (stats.score, stats.frames), reverse=True)
+
+
+def format_report(statistics: list, top: int = None) -> list:
+    """Ranked text report, one block per ID"""
+    lines = []
+
+    for rank, stats in enumerate(statistics[:top], start=1):
+        lines.append(f"#{rank} {format_can_id(stats.can_id)}: {stats.frames} frames, dlc {stats.dlc}, "
+                     f"period {stats.period * 1000:.1f} ms, score {stats.score:.2f}")
+        for byte in range(stats.dlc):
+            lines.append(f"    byte {byte}: {stats.classes[byte]:<9} entropy {stats.entropy[byte]:.2f}  flips {stats.heatmap(byte)}")
+
+    return lines
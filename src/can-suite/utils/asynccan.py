@@ -0,0 +1,279 @@
+"""
+    CAN Suite asyncio transport.
+
+    Library running CAN I/O on an asyncio event loop over a non-blocking
+    AF_CAN raw socket. One reader registered with add_reader hands every
+    received frame to the matching subscriptions (async iterators with ID
+    and predicate filters), sends only wait while the TX queue is full.
+    Imitation, replay and MITM are coroutines, so sending, watching for
+    responses and timers share one thread.
+
+    (c) Jannik Schmied, 2023
+"""
+import asyncio
+import errno
+import inspect
+
+from .candump import read_log
+from .scheduler import MAX_SPEED, MIN_SPEED
+from .socketcan import (CAN_EFF_FLAG, CAN_EFF_MASK, CAN_MAX_DLEN, CANFD_FRAME_SIZE, DEFAULT_BATCH_SIZE, ENOBUFS_RETRY_DELAY, NativeCANSocket,
+                        pack_frame, unpack_frame)
+
+# Frames buffered per subscription, further frames are dropped until it is read
+SUBSCRIPTION_QUEUE_SIZE: int = 4096
+
+_ID_MASK: int = CAN_EFF_FLAG | CAN_EFF_MASK
+
+
+class Subscription:
+    """Received frames matching can_ids and predicate(can_id, data) as async iterator of (can_id, data).
+    Iteration ends after timeout seconds without a matching frame (never without timeout)."""
+    def __init__(self, transport, can_ids=None, predicate=None, timeout: float = None, maxsize: int = SUBSCRIPTION_QUEUE_SIZE) -> None:
+        self.transport = transport
+        self.can_ids = None if can_ids is None else {can_id & _ID_MASK for can_id in can_ids}
+        self.predicate = predicate
+        self.timeout = timeout
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> tuple:
+        try:
+            return await self.get()
+        except asyncio.TimeoutError:
+            raise StopAsyncIteration
+
+    def matches(self, can_id: int, data: bytes) -> bool:
+        if self.can_ids is not None and can_id & _ID_MASK not in self.can_ids:
+            return False
+        return self.predicate is None or bool(self.predicate(can_id, data))
+
+    def put(self, frame: tuple) -> None:
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def get(self) -> tuple:
+        """Next matching frame, raises asyncio.TimeoutError after timeout seconds"""
+        return await asyncio.wait_for(self.queue.get(), self.timeout)
+
+    def close(self) -> None:
+        self.transport.unsubscribe(self)
+
+
+class AsyncCANTransport:
+    """Non-blocking raw socket driven by the running event loop (create it inside a coroutine)"""
+    def __init__(self, native: NativeCANSocket) -> None:
+        self.native = native
+        self.socket = native.socket
+        self.fd_mode = native.fd_mode
+        self.subscriptions = []
+        self.tasks = set()
+        self.sent = 0
+        self.received = 0
+
+        self.socket.setblocking(False)
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(self.socket.fileno(), self._on_readable)
+
+    @classmethod
+    def open(cls, interface: str, fd: bool = False, receive_own: bool = False):
+        return cls(NativeCANSocket(interface, fd=fd, receive_own=receive_own))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+    def _on_readable(self) -> None:
+        # Bounded per call, so a flooded bus cannot starve the other coroutines
+        for _ in range(DEFAULT_BATCH_SIZE):
+            try:
+                buffer = self.socket.recv(CANFD_FRAME_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # Interface went down, subscriptions run into their timeout
+                self.loop.remove_reader(self.socket.fileno())
+                return
+
+            can_id, data = unpack_frame(buffer)
+            self.received += 1
+
+            for subscription in self.subscriptions:
+                if subscription.matches(can_id, data):
+                    subscription.put((can_id, data))
+
+    def frames(self, can_ids=None, predicate=None, timeout: float = None, maxsize: int = SUBSCRIPTION_QUEUE_SIZE) -> Subscription:
+        """Subscribe to frames received from now on (see Subscription), close it (or use it as context manager) when done"""
+        subscription = Subscription(self, can_ids, predicate, timeout, maxsize)
+        self.subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        if subscription in self.subscriptions:
+            self.subscriptions.remove(subscription)
+
+    async def send(self, can_id: int, data: bytes) -> None:
+        await self._send(pack_frame(can_id, data, self.fd_mode))
+
+    async def send_raw(self, frame: bytes) -> None:
+        await self._send(frame)
+
+    async def send_batch(self, frames) -> int:
+        """Send a contiguous buffer of pre-packed frames, yielding to the loop after every DEFAULT_BATCH_SIZE frames"""
+        view = memoryview(frames).cast("B")
+        frame_size = self.native.frame_size
+        count = len(view) // frame_size
+
+        for number, offset in enumerate(range(0, count * frame_size, frame_size), 1):
+            await self._send(view[offset:offset + frame_size])
+            if number % DEFAULT_BATCH_SIZE == 0:
+                await asyncio.sleep(0)
+
+        return count
+
+    async def _send(self, frame) -> None:
+        """Send without blocking the loop: wait for writability on EAGAIN, retry after a pause on ENOBUFS (TX queue full)"""
+        while True:
+            try:
+                self.socket.send(frame)
+                break
+            except BlockingIOError:
+                await self.loop.sock_sendall(self.socket, frame)
+                break
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                await asyncio.sleep(ENOBUFS_RETRY_DELAY)
+
+        self.sent += 1
+
+    async def recv(self, timeout: float = None, can_ids=None, predicate=None) -> tuple:
+        """Next matching frame received after the call as (can_id, data), raises asyncio.TimeoutError"""
+        with self.frames(can_ids, predicate, timeout) as frames:
+            return await frames.get()
+
+    async def request(self, can_id: int, data: bytes, response_ids=None, timeout: float = 1.0):
+        """Send a frame and return the first response (on response_ids if given) as (can_id, data), None on timeout"""
+        # Subscribed before sending, so a fast response is not missed
+        with self.frames(response_ids, timeout=timeout) as frames:
+            await self.send(can_id, data)
+            try:
+                return await frames.get()
+            except asyncio.TimeoutError:
+                return None
+
+    def start(self, coroutine) -> asyncio.Task:
+        """Run a coroutine as task of this transport, it is cancelled on close"""
+        task = self.loop.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def periodic(self, can_id: int, data: bytes, period: float, count: int = None) -> asyncio.Task:
+        """Send a frame every period seconds (count times or until cancelled) as task"""
+        return self.start(every(period, self.send, can_id, data, count=count))
+
+    async def close(self) -> None:
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        self.loop.remove_reader(self.socket.fileno())
+        self.native.close()
+
+
+async def every(period: float, callback, *args, count: int = None) -> int:
+    """Call callback(*args) (awaited if it returns an awaitable) every period seconds, count times or until cancelled.
+    Deadlines are taken from the loop clock, so slow calls do not accumulate drift. Returns number of calls."""
+    if period <= 0:
+        raise ValueError("period must be positive")
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time()
+    calls = 0
+
+    while count is None or calls < count:
+        result = callback(*args)
+        if inspect.isawaitable(result):
+            await result
+        calls += 1
+
+        deadline += period
+        await asyncio.sleep(max(deadline - loop.time(), 0))
+
+    return calls
+
+
+async def imitate(transport: AsyncCANTransport, can_id: int, data: bytes, count: int, period: float = 0.0) -> int:
+    """ECU imitation: send a frame count times, period seconds apart (back to back in batches without period)"""
+    if period:
+        return await every(period, transport.send, can_id, data, count=count)
+
+    frame = pack_frame(can_id, data, transport.fd_mode)
+    sent = 0
+    while sent < count:
+        sent += await transport.send_batch(frame * min(count - sent, DEFAULT_BATCH_SIZE))
+    return sent
+
+
+async def replay(transport: AsyncCANTransport, path: str, speed: float = 1.0) -> tuple:
+    """Replay a candump logfile with its original inter-frame gaps (scaled by speed), returns (sent, skipped).
+    CAN-FD frames longer than 8 bytes are skipped unless the transport is in FD mode."""
+    if not MIN_SPEED <= speed <= MAX_SPEED:
+        raise ValueError(f"speed must be between {MIN_SPEED:g} and {MAX_SPEED:g}")
+
+    loop = asyncio.get_running_loop()
+    origin = first = None
+    sent = 0
+    skipped = 0
+
+    for frame in read_log(path):
+        if len(frame.data) > CAN_MAX_DLEN and not transport.fd_mode:
+            skipped += 1
+            continue
+
+        if origin is None:
+            origin, first = loop.time(), frame.timestamp
+
+        delay = origin + (frame.timestamp - first) / speed - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        await transport.send(frame.can_id, frame.data)
+        sent += 1
+
+    return sent, skipped
+
+
+async def mitm(first: AsyncCANTransport, second: AsyncCANTransport, forward12=None, forward21=None, timeout: float = None) -> tuple:
+    """Man-in-the-Middle: bridge two buses, frames for which forward(can_id, data) is false are dropped
+    (everything is forwarded without filter). Runs until cancelled or for timeout seconds, returns frames forwarded per direction."""
+    forwarded = [0, 0]
+
+    async def bridge(source: AsyncCANTransport, target: AsyncCANTransport, forward, direction: int) -> None:
+        with source.frames() as frames:
+            async for can_id, data in frames:
+                if forward is None or forward(can_id, data):
+                    await target.send(can_id, data)
+                    forwarded[direction] += 1
+
+    bridges = asyncio.gather(bridge(first, second, forward12, 0), bridge(second, first, forward21, 1))
+    try:
+        await asyncio.wait_for(bridges, timeout)
+    except asyncio.TimeoutError:
+        pass
+
+    return tuple(forwarded)
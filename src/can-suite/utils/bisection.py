@@ -0,0 +1,50 @@
+"""
+    CAN Suite bisection replay.
+
+    Library isolating the frame responsible for an effect by replaying halves
+    of the candidate set (delta debugging) in about log2(n) rounds.
+
+    (c) Jannik Schmied, 2023
+"""
+
+
+def bisect(candidates: list, replay, triggered, verify: bool = True, on_round=None) -> list:
+    """Narrow candidates down to the one causing an effect.
+
+    replay(subset) sends a subset, triggered() tells whether the effect occurred.
+    With verify the second half is tested as well instead of being assumed guilty,
+    which detects flaky effects and effects caused by frames from both halves.
+    Returns the isolated candidate, or the smallest set that still triggered the effect."""
+    rounds = 0
+
+    while len(candidates) > 1:
+        rounds += 1
+        half = len(candidates) // 2
+        first, second = candidates[:half], candidates[half:]
+
+        if on_round:
+            on_round(rounds, len(candidates))
+
+        replay(first)
+        if triggered():
+            candidates = first
+            continue
+
+        if not verify:
+            candidates = second
+            continue
+
+        replay(second)
+        if triggered():
+            candidates = second
+            continue
+
+        # Neither half alone triggers the effect: it depends on frames of both halves
+        break
+
+    return candidates
+
+
+def rounds_needed(count: int) -> int:
+    """Bisection rounds needed to isolate one of count candidates"""
+    return max(count - 1, 0).bit_length()
@@ -0,0 +1,11 @@
+"""
+    CAN Suite bitrates.
+
+    Library listing the classic CAN bitrates the suite supports. It has no
+    dependencies, so rate control can validate bitrates without loading the
+    interface code.
+
+    (c) Jannik Schmied, 2023
+"""
+# Supported bus bitrates in kbit/s
+BITRATES: tuple = ("5", "10", "20", "33", "47", "50", "83", "95", "100", "125", "250", "500", "800", "1000")
@@ -0,0 +1,121 @@
+"""
+    CAN Suite brute force campaign state.
+
+    Library persisting the keyspace cursor of long running brute force
+    campaigns so they can be resumed and split into shards.
+
+    (c) Jannik Schmied, 2023
+"""
+import json
+import os
+from dataclasses import asdict, dataclass, fields
+from re import match, sub
+
+# Seconds between two checkpoints written during a campaign
+CHECKPOINT_INTERVAL: float = 1.0
+
+
+class InvalidShardException(Exception):
+    pass
+
+
+class CampaignMismatchException(Exception):
+    pass
+
+
+def parse_shard(shard: str) -> tuple:
+    """Parse shard specification k/N (1 <= k <= N) into (k, N)"""
+    result = match(r"^\s*(\d+)\s*/\s*(\d+)\s*$", shard)
+
+    if not result:
+        raise InvalidShardException(f"invalid shard: {shard} (expected k/N)")
+
+    index, count = int(result.group(1)), int(result.group(2))
+
+    if count < 1 or not 1 <= index <= count:
+        raise InvalidShardException(f"invalid shard: {shard} (k must be between 1 and N)")
+
+    return index, count
+
+
+def shard_range(size: int, index: int, count: int) -> tuple:
+    """Contiguous, non-overlapping [start, stop) slice of a keyspace for shard index/count"""
+    return size * (index - 1) // count, size * index // count
+
+
+@dataclass
+class Campaign:
+    """State of a (sharded) brute force campaign"""
+    can_id: str
+    length: int
+    order: str
+    seed: int
+    shard: int
+    shards: int
+    start: int
+    stop: int
+    cursor: int
+    sent: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def done(self) -> bool:
+        return self.cursor >= self.stop
+
+    @property
+    def progress(self) -> float:
+        total = self.stop - self.start
+        return (self.cursor - self.start) / total if total else 1.0
+
+    @property
+    def rate(self) -> float:
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    def matches(self, other: "Campaign") -> bool:
+        """Checks if both campaigns sweep the same keyspace slice"""
+        keys = ("can_id", "length", "order", "seed", "shard", "shards", "start", "stop")
+        return all(getattr(self, key) == getattr(other, key) for key in keys)
+
+    def advance(self, candidates: int, elapsed: float, frames: int = None) -> None:
+        """Move the cursor by candidates (sent as frames, more than one per candidate for several IDs)"""
+        self.cursor = min(self.cursor + candidates, self.stop)
+        self.sent += candidates if frames is None else frames
+        self.elapsed += elapsed
+
+    def save(self, path: str) -> None:
+        """Atomically write campaign state (a crash never leaves a truncated file)"""
+        state = asdict(self)
+        state["rate"] = round(self.rate, 1)
+
+        # Indices exceed JSON number precision for long payloads, keep them as hex strings
+        for key in ("start", "stop", "cursor"):
+            state[key] = hex(state[key])
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(state, file, indent=4)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Campaign":
+        with open(path, "r") as file:
+            state = json.load(file)
+
+        for key in ("start", "stop", "cursor"):
+            state[key] = int(state[key], 16)
+
+        return cls(**{field.name: state[field.name] for field in fields(cls) if field.name in state})
+
+    def resume(self, path: str) -> "Campaign":
+        """Load the saved state of this campaign, raises CampaignMismatchException if it sweeps another keyspace slice"""
+        saved = Campaign.load(path)
+
+        if not saved.matches(self):
+            raise CampaignMismatchException(f"campaign state {path} does not match the given parameters")
+
+        return saved
+
+    @staticmethod
+    def default_path(can_id: str, length: int, order: str, shard: int, shards: int) -> str:
+        label = sub(r"[^0-9a-z]+", "_", can_id.lower().replace("0x", "")).strip("_")
+        return f"canbrute_{label}_{length}b_{order}_{shard}of{shards}.json"
@@ -0,0 +1,248 @@
+"""
+    CAN Suite candump log parser.
+
+    Library streaming candump logfiles line by line, both the candump -l
+    format "(timestamp) interface ID#DATA" and the compact "ID#DATA" format.
+    Memory use does not depend on the size of the logfile. For analysis whole
+    logfiles are loaded into NumPy structured arrays instead.
+
+    (c) Jannik Schmied, 2023
+"""
+import re
+from binascii import unhexlify
+from socket import timeout as SocketTimeout
+from time import time
+from typing import NamedTuple
+
+import numpy as np
+
+from .socketcan import CAN_EFF_FLAG, CAN_EFF_MASK, CAN_ERR_FLAG, CAN_FRAME_DTYPE, CAN_MAX_DLEN, CAN_RTR_FLAG, CAN_SFF_MASK, CANFD_MAX_DLEN, NativeCANSocket, format_can_id, parse_frame
+
+# Read buffer for large logfiles
+READ_BUFFER: int = 1 << 20
+
+# Bytes of a logfile parsed at once by load_capture()
+LOAD_CHUNK_SIZE: int = 64 << 20
+
+# Frame flags of loaded captures
+FLAG_EFF: int = 0x1
+FLAG_RTR: int = 0x2
+FLAG_FD: int = 0x4
+
+# Flags nibble of CAN-FD frames ("##<flags>": CANFD_BRS 0x1, CANFD_ESI 0x2), kept in the frame flags above FLAG_FD
+FD_FLAGS_SHIFT: int = 3
+FD_FLAGS_MASK: int = 0x3
+
+# Timestamp and interface are optional (compact logfiles), FD frames carry "#<flags>" before the payload
+_FRAME_PATTERN = re.compile(rb"^[ \t]*(?:\(([0-9.]+)\)[ \t]+\S+[ \t]+)?([0-9A-Fa-f]{1,8})#(#[0-9A-Fa-f]|R)?([0-9A-Fa-f]*)[ \t\r]*$", re.MULTILINE)
+
+
+def capture_dtype(width: int = CAN_MAX_DLEN) -> np.dtype:
+    """Record layout of a loaded capture with payloads padded to width bytes"""
+    return np.dtype([("timestamp", "<f8"), ("can_id", "<u4"), ("flags", "u1"), ("dlc", "u1"), ("data", "u1", (width,))])
+
+
+CAPTURE_DTYPE: np.dtype = capture_dtype()
+
+
+class CANFrame(NamedTuple):
+    """Single frame of a candump logfile"""
+    timestamp: float
+    interface: str
+    can_id: int
+    data: bytes
+    # Flags nibble of CAN-FD frames, None for classic CAN frames
+    fd_flags: int = None
+
+    @property
+    def fd(self) -> bool:
+        return self.fd_flags is not None
+
+    @property
+    def key(self) -> tuple:
+        """Identity of a frame regardless of when and where it was seen"""
+        return self.can_id, self.data, self.fd
+
+    def compact(self) -> str:
+        """cansend style representation (ID#DATA)"""
+        if self.can_id & CAN_RTR_FLAG:
+            return f"{format_can_id(self.can_id)}#R"
+        if self.fd or len(self.data) > CAN_MAX_DLEN:
+            return f"{format_can_id(self.can_id)}##{self.fd_flags or 0:X}{self.data.hex().upper()}"
+        return f"{format_can_id(self.can_id)}#{self.data.hex().upper()}"
+
+    def __str__(self) -> str:
+        """candump -l style representation (compact for frames read from compact logfiles)"""
+        if not self.interface:
+            return self.compact()
+        return f"({self.timestamp:.6f}) {self.interface} {self.compact()}"
+
+
+def parse_line(line: str, default_interface: str = "") -> CANFrame:
+    """Parse a candump -l or compact line, returns None for lines without a frame"""
+    parts = line.split()
+
+    if len(parts) == 3 and parts[0].startswith("("):
+        timestamp, interface, frame = float(parts[0][1:-1]), parts[1], parts[2]
+    elif len(parts) == 1:
+        timestamp, interface, frame = 0.0, default_interface, parts[0]
+    else:
+        return None
+
+    if "#" not in frame:
+        return None
+
+    can_id, data = parse_frame(frame)
+    _, _, payload = frame.partition("#")
+    fd_flags = int(payload[1], 16) if payload.startswith("#") else None
+    return CANFrame(timestamp, interface, can_id, data, fd_flags)
+
+
+def read_log(path: str, default_interface: str = ""):
+    """Yield all frames of a candump logfile, malformed lines are skipped"""
+    with open(path, "r", errors="replace", buffering=READ_BUFFER) as logfile:
+        for line in logfile:
+            try:
+                frame = parse_line(line, default_interface)
+            except ValueError:
+                continue
+            if frame:
+                yield frame
+
+
+def dedupe_log(path: str, new_path: str, frames=None) -> tuple:
+    """Write every distinct frame once (in order of first appearance, with its first timestamp).
+    Single pass; memory is bounded by the number of distinct frames. Returns (total, unique).
+    frames replaces reading path as candump logfile (e.g. frames of a columnar capture)."""
+    seen = set()
+    total = 0
+
+    with open(new_path, "w", buffering=READ_BUFFER) as new_file:
+        for frame in frames if frames is not None else read_log(path):
+            total += 1
+            key = frame.key
+
+            if key in seen:
+                continue
+
+            seen.add(key)
+            new_file.write(f"{frame}\n")
+
+    return total, len(seen)
+
+
+def parse_chunk(chunk: bytes, width: int = CAN_MAX_DLEN) -> np.ndarray:
+    """Parse complete logfile lines into a capture array"""
+    matches = [match for match in _FRAME_PATTERN.findall(chunk) if len(match[3]) % 2 == 0 and len(match[3]) <= 2 * width]
+    count = len(matches)
+    frames = np.zeros(count, dtype=capture_dtype(width))
+
+    if not count:
+        return frames
+
+    # Column lists instead of zip(*matches), which is slowed down by the garbage collector for millions of tuples
+    timestamps = [match[0] for match in matches]
+    can_ids = [match[1] for match in matches]
+    kinds = np.array([match[2] for match in matches], dtype="S2")
+    payloads = [match[3] for match in matches]
+
+    try:
+        frames["timestamp"] = np.fromiter(map(float, timestamps), dtype=np.float64, count=count)
+    except ValueError:
+        # Compact lines have no timestamp
+        frames["timestamp"] = np.fromiter((float(timestamp or 0) for timestamp in timestamps), dtype=np.float64, count=count)
+
+    frames["can_id"] = np.frombuffer(unhexlify(b"".join(can_id.rjust(8, b"0") for can_id in can_ids)), dtype=">u4")
+    frames["dlc"] = np.fromiter(map(len, payloads), dtype=np.uint8, count=count) // 2
+    frames["data"] = np.frombuffer(unhexlify(b"".join(payload.ljust(2 * width, b"0") for payload in payloads)), dtype=np.uint8).reshape(-1, width)
+
+    # Same rules as parse_can_id(): 8 digit IDs and values above 0x7FF are extended IDs
+    extended = (np.fromiter(map(len, can_ids), dtype=np.uint8, count=count) == 8) | (frames["can_id"] > CAN_SFF_MASK)
+    frames["can_id"] &= CAN_EFF_MASK
+    fd = (kinds != b"") & (kinds != b"R")
+    fd_flags = np.fromiter((int(kind[1:], 16) & FD_FLAGS_MASK for kind in kinds[fd].tolist()), dtype=np.uint8)
+    frames["flags"] = extended * FLAG_EFF | (kinds == b"R") * FLAG_RTR | fd * FLAG_FD
+    frames["flags"][fd] |= fd_flags << FD_FLAGS_SHIFT
+
+    return frames
+
+
+def record_log(interface: str, path: str, stop, fd: bool = False) -> int:
+    """Write received frames in candump -l format until the stop event is set, returns number of frames.
+    Frames are stamped on reception (epoch seconds)."""
+    frames = 0
+
+    with NativeCANSocket(interface, fd=fd) as sock, open(path, "w", buffering=READ_BUFFER) as logfile:
+        sock.settimeout(0.1)
+
+        while not stop.is_set():
+            try:
+                can_id, data = sock.recv()
+            except SocketTimeout:
+                continue
+
+            if can_id & CAN_ERR_FLAG:
+                continue
+
+            logfile.write(f"{CANFrame(time(), interface, can_id, data, 0 if len(data) > CAN_MAX_DLEN else None)}\n")
+            frames += 1
+
+    return frames
+
+
+def log_width(path: str) -> int:
+    """Payload width needed to load a candump logfile without dropping frames (CANFD_MAX_DLEN if it has CAN-FD frames)"""
+    rest = b""
+
+    with open(path, "rb") as logfile:
+        while block := logfile.read(READ_BUFFER):
+            # Keep the last byte, "##" may be split between two blocks
+            if b"##" in rest + block:
+                return CANFD_MAX_DLEN
+            rest = block[-1:]
+
+    return CAN_MAX_DLEN
+
+
+def iter_capture(path: str, width: int = None, chunk_size: int = LOAD_CHUNK_SIZE):
+    """Yield a candump logfile as capture arrays of one chunk (chunk_size bytes) each.
+    Lines are matched by a compiled regex per chunk, not parsed one by one in Python.
+    width defaults to log_width(), malformed lines and frames longer than width are skipped."""
+    width = width or log_width(path)
+    rest = b""
+
+    with open(path, "rb") as logfile:
+        while True:
+            block = logfile.read(chunk_size)
+            if not block:
+                break
+
+            chunk, newline, tail = (rest + block).rpartition(b"\n")
+            rest = tail
+            if newline:
+                yield parse_chunk(chunk, width)
+
+    if rest:
+        yield parse_chunk(rest, width)
+
+
+def load_capture(path: str, width: int = None) -> np.ndarray:
+    """Load a whole candump logfile into a capture array (CAPTURE_DTYPE for classic CAN).
+    width defaults to log_width(), so CAN-FD frames are kept."""
+    width = width or log_width(path)
+    parts = list(iter_capture(path, width))
+    return np.concatenate(parts) if parts else np.zeros(0, dtype=capture_dtype(width))
+
+
+def pack_capture(capture: np.ndarray) -> np.ndarray:
+    """Serialize the classic CAN frames of a capture array into contiguous struct can_frame buffers (send_batch)"""
+    flags = capture["flags"]
+    frames = np.zeros(len(capture), dtype=CAN_FRAME_DTYPE)
+
+    frames["can_id"] = (capture["can_id"]
+                        | np.where(flags & FLAG_EFF, CAN_EFF_FLAG, 0).astype(np.uint32)
+                        | np.where(flags & FLAG_RTR, CAN_RTR_FLAG, 0).astype(np.uint32))
+    frames["len"] = capture["dlc"]
+    frames["data"] = capture["data"][:, :CAN_MAX_DLEN]
+
+    return frames
@@ -0,0 +1,220 @@
+"""
+    CAN Suite columnar capture format.
+
+    Library storing captures column by column (timestamp float64, id uint32,
+    flags uint8, dlc uint8, fixed width payload) behind a small header, so
+    they are opened with numpy.memmap without parsing or copying, and
+    converting candump logfiles from and to this format.
+
+    (c) Jannik Schmied, 2023
+"""
+import os
+import shutil
+import struct
+from itertools import repeat
+
+import numpy as np
+
+from .candump import FD_FLAGS_MASK, FD_FLAGS_SHIFT, FLAG_EFF, FLAG_FD, FLAG_RTR, READ_BUFFER, CANFrame, iter_capture, load_capture, log_width, read_log
+from .socketcan import CAN_EFF_FLAG, CAN_MAX_DLEN, CAN_RTR_FLAG, CANFD_MAX_DLEN, format_can_id
+
+CAPTURE_MAGIC: bytes = b"CANCOL01"
+CAPTURE_EXTENSION: str = ".cancol"
+
+# magic, payload width, reserved (2 bytes), reserved (4 bytes), frame count, interface name
+HEADER_FMT: str = "<8sHHIQ16s"
+HEADER_SIZE: int = 64
+
+# Every column starts at a multiple of this offset
+COLUMN_ALIGNMENT: int = 64
+
+# Column name, dtype and values per frame (the payload column has width values)
+COLUMNS: tuple = (("timestamp", "<f8"), ("can_id", "<u4"), ("flags", "u1"), ("dlc", "u1"), ("data", "u1"))
+
+
+class InvalidCaptureException(Exception):
+    pass
+
+
+class Capture:
+    """Columnar capture, indexed like a capture array (capture["can_id"], capture[mask]).
+    Columns are read-only memory maps when opened from disk."""
+    def __init__(self, columns: dict, interface: str = "") -> None:
+        self.columns = columns
+        self.interface = interface
+
+    def __len__(self) -> int:
+        return len(self.columns["timestamp"])
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.columns[key]
+        return Capture({name: column[key] for name, column in self.columns.items()}, self.interface)
+
+    @property
+    def width(self) -> int:
+        return self.columns["data"].shape[1]
+
+    @classmethod
+    def from_records(cls, records: np.ndarray, interface: str = "") -> "Capture":
+        return cls({name: records[name] for name, _ in COLUMNS}, interface)
+
+    @classmethod
+    def concatenate(cls, parts: list, interface: str = "") -> "Capture":
+        """Join Captures (or capture arrays) of the same payload width column by column"""
+        return cls({name: np.concatenate([part[name] for part in parts]) for name, _ in COLUMNS}, interface)
+
+
+def _column_layout(count: int, width: int) -> list:
+    """(name, dtype, shape, offset) of every column"""
+    layout = []
+    offset = HEADER_SIZE
+
+    for name, dtype in COLUMNS:
+        shape = (count, width) if name == "data" else (count,)
+        layout.append((name, np.dtype(dtype), shape, offset))
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        offset += -(-size // COLUMN_ALIGNMENT) * COLUMN_ALIGNMENT
+
+    return layout
+
+
+def is_capture_file(path: str) -> bool:
+    """Checks for the columnar format magic (anything else is treated as candump logfile)"""
+    with open(path, "rb") as file:
+        return file.read(len(CAPTURE_MAGIC)) == CAPTURE_MAGIC
+
+
+def open_capture(path: str) -> Capture:
+    """Memory map a columnar capture, nothing is read until columns are accessed"""
+    with open(path, "rb") as file:
+        header = file.read(HEADER_SIZE)
+
+    if len(header) < HEADER_SIZE:
+        raise InvalidCaptureException(f"truncated capture header: {path}")
+
+    magic, width, _, _, count, interface = struct.unpack_from(HEADER_FMT, header)
+    if magic != CAPTURE_MAGIC or width not in (CAN_MAX_DLEN, CANFD_MAX_DLEN):
+        raise InvalidCaptureException(f"not a columnar capture: {path}")
+
+    columns = {}
+    for name, dtype, shape, offset in _column_layout(count, width):
+        columns[name] = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape) if count else np.zeros(shape, dtype=dtype)
+
+    return Capture(columns, interface.rstrip(b"\0").decode())
+
+
+def write_capture(path: str, chunks, width: int = CAN_MAX_DLEN, interface: str = "") -> int:
+    """Write capture arrays (or Capture objects) to a columnar capture, returns number of frames.
+    Chunks are streamed into one temporary file per column, so memory use is bounded by the chunk size."""
+    count = 0
+    tmp_paths = {name: f"{path}.{name}.tmp" for name, _ in COLUMNS}
+    tmp_files = {name: open(tmp_path, "wb") for name, tmp_path in tmp_paths.items()}
+
+    try:
+        for chunk in chunks:
+            for name, dtype in COLUMNS:
+                tmp_files[name].write(np.ascontiguousarray(chunk[name], dtype=dtype).tobytes())
+            count += len(chunk)
+
+        for file in tmp_files.values():
+            file.close()
+
+        with open(f"{path}.tmp", "wb") as capture:
+            header = struct.pack(HEADER_FMT, CAPTURE_MAGIC, width, 0, 0, count, interface.encode()[:16])
+            capture.write(header.ljust(HEADER_SIZE, b"\0"))
+
+            for name, _, _, offset in _column_layout(count, width):
+                capture.write(b"\0" * (offset - capture.tell()))
+                with open(tmp_paths[name], "rb") as column:
+                    shutil.copyfileobj(column, capture, READ_BUFFER)
+
+        os.replace(f"{path}.tmp", path)
+    finally:
+        for name, file in tmp_files.items():
+            file.close()
+            if os.path.exists(tmp_paths[name]):
+                os.remove(tmp_paths[name])
+
+    return count
+
+
+def convert_log(log_path: str, path: str, width: int = None) -> int:
+    """candump logfile -> columnar capture (streamed chunk by chunk), returns number of frames.
+    width defaults to CANFD_MAX_DLEN for logfiles with CAN-FD frames, CAN_MAX_DLEN otherwise."""
+    width = width or log_width(log_path)
+    first = next(read_log(log_path), None)
+    interface = first.interface if first else ""
+    return write_capture(path, iter_capture(log_path, width), width, interface)
+
+
+def log_lines(capture, interfaces):
+    """Yield candump -l lines of a capture array or Capture, interfaces is one name or a name per frame"""
+    if isinstance(interfaces, str):
+        interfaces = repeat(interfaces)
+
+    flags = capture["flags"]
+    can_ids = capture["can_id"].astype(np.int64) | np.where(flags & FLAG_EFF, CAN_EFF_FLAG, 0)
+    names = {can_id: format_can_id(can_id) for can_id in np.unique(can_ids).tolist()}
+
+    # Hex encode all payloads at once, lines only slice them
+    width = capture["data"].shape[1]
+    payloads = capture["data"].tobytes().hex().upper()
+
+    rows = zip(capture["timestamp"].tolist(), can_ids.tolist(), capture["dlc"].tolist(), flags.tolist(), interfaces)
+    for row, (timestamp, can_id, dlc, flag, interface) in enumerate(rows):
+        payload = payloads[2 * row * width:2 * (row * width + dlc)]
+        if flag & FLAG_RTR:
+            frame = f"{names[can_id]}#R"
+        elif flag & FLAG_FD:
+            frame = f"{names[can_id]}##{(flag >> FD_FLAGS_SHIFT) & FD_FLAGS_MASK:X}{payload}"
+        else:
+            frame = f"{names[can_id]}#{payload}"
+        yield f"({timestamp:.6f}) {interface} {frame}\n"
+
+
+def export_log(path: str, log_path: str, interface: str = None) -> int:
+    """Columnar capture -> candump -l logfile, returns number of frames"""
+    capture = open_capture(path)
+
+    with open(log_path, "w", buffering=READ_BUFFER) as logfile:
+        logfile.writelines(log_lines(capture, interface or capture.interface or "can0"))
+
+    return len(capture)
+
+
+def load(path: str, width: int = None):
+    """Open a columnar capture or load a candump logfile (width defaults to log_width()), both index the same way"""
+    if is_capture_file(path):
+        return open_capture(path)
+    return load_capture(path, width)
+
+
+def iter_frames(capture, interface: str = ""):
+    """Yield CANFrames of a capture array or Capture"""
+    interface = getattr(capture, "interface", interface) or interface
+    flags = capture["flags"]
+    can_ids = (capture["can_id"].astype(np.int64)
+               | np.where(flags & FLAG_EFF, CAN_EFF_FLAG, 0)
+               | np.where(flags & FLAG_RTR, CAN_RTR_FLAG, 0))
+    fd_flags = np.where(flags & FLAG_FD, (flags.astype(np.int16) >> FD_FLAGS_SHIFT) & FD_FLAGS_MASK, -1)
+    data = capture["data"]
+
+    rows = zip(capture["timestamp"].tolist(), can_ids.tolist(), capture["dlc"].tolist(), fd_flags.tolist())
+    for row, (timestamp, can_id, dlc, fd_flag) in enumerate(rows):
+        yield CANFrame(timestamp, interface, can_id, data[row, :dlc].tobytes(), fd_flag if fd_flag >= 0 else None)
+
+
+def read_frames(path: str):
+    """Yield CANFrames of a columnar capture or a candump logfile"""
+    if is_capture_file(path):
+        yield from iter_frames(open_capture(path))
+    else:
+        yield from read_log(path)
+
+
+def count_frames(path: str) -> int:
+    """Number of frames of a columnar capture (from the header) or a candump logfile"""
+    if is_capture_file(path):
+        return len(open_capture(path))
+    return sum(1 for _ in read_log(path))
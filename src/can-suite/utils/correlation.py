@@ -0,0 +1,154 @@
+"""
+    CAN Suite OBD-II correlation.
+
+    Library locating physical signals in raw CAN traffic: OBD-II PID readings
+    recorded alongside a capture are cross-correlated (with lag) against every
+    candidate bit field of every ID at once. Lags are bounded, so only the
+    dot products of the matrix of all resampled fields with the shifted
+    reference are computed, no full length FFT.
+
+    (c) Jannik Schmied, 2023
+"""
+import csv
+from collections import defaultdict
+from dataclasses import dataclass
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .analysis import group_by_id
+from .signals import BIG_ENDIAN, LITTLE_ENDIAN, SIGNAL_PHYSICAL, Signal, field_values
+from .socketcan import format_can_id
+
+# Seconds between two points of the common time grid
+DEFAULT_RESOLUTION: float = 0.1
+
+# Largest lag (seconds) between a PID reading and the raw signal
+DEFAULT_MAX_LAG: float = 2.0
+
+# Matches reported per PID
+DEFAULT_TOP: int = 5
+
+
+@dataclass
+class Match:
+    """Raw bit field correlating with an OBD-II PID. A positive lag means the raw signal follows the PID reading."""
+    pid: str
+    signal: Signal
+    correlation: float
+    lag: float
+    factor: float
+    offset: float
+
+    def describe(self) -> str:
+        signal = self.signal
+        return (f"{format_can_id(signal.can_id)} start bit {signal.start_bit} ({signal.length} bit, {signal.byte_order.replace('_', ' ')}"
+                f"{', signed' if signal.signed else ''}): r = {self.correlation:+.3f}, lag {self.lag:+.1f} s, "
+                f"{self.pid} = {self.factor:.4g} * raw {self.offset:+.4g}")
+
+
+def read_pid_log(path: str) -> dict:
+    """Read a time,pid,value CSV (OBDConnection.record) into {pid: (times, values)}"""
+    samples = defaultdict(list)
+
+    with open(path, "r", newline="") as file:
+        for row in csv.DictReader(file):
+            samples[row["pid"]].append((float(row["time"]), float(row["value"])))
+
+    return {pid: tuple(np.array(column) for column in zip(*sorted(rows))) for pid, rows in samples.items()}
+
+
+def candidate_fields(can_id: int, dlc: int, signals: list = None) -> list:
+    """Byte aligned 8 bit and 16 bit (both byte orders) fields of an ID plus extracted signals"""
+    fields = {}
+
+    for byte in range(dlc):
+        bits = list(range(8 * byte, 8 * byte + 8))
+        fields[tuple(bits)] = Signal(can_id, f"B{byte}", bits, BIG_ENDIAN, False, SIGNAL_PHYSICAL, 0, 255)
+
+        if byte + 1 < dlc:
+            following = list(range(8 * byte + 8, 8 * byte + 16))
+            fields[tuple(bits + following)] = Signal(can_id, f"B{byte}B{byte + 1}", bits + following, BIG_ENDIAN, False, SIGNAL_PHYSICAL, 0, 0xFFFF)
+            fields[tuple(following + bits)] = Signal(can_id, f"B{byte + 1}B{byte}", following + bits, LITTLE_ENDIAN, False, SIGNAL_PHYSICAL, 0, 0xFFFF)
+
+    for signal in signals or ():
+        fields.setdefault(tuple(signal.bits), signal)
+
+    return list(fields.values())
+
+
+def _signal_values(data: np.ndarray, signal: Signal) -> np.ndarray:
+    values = field_values(data, signal.bits).astype(np.int64)
+    if signal.signed:
+        values = np.where(values >= 1 << (signal.length - 1), values - (1 << signal.length), values)
+    return values
+
+
+def _standardize(rows: np.ndarray) -> tuple:
+    """Zero mean, unit variance rows and a mask of rows that are not constant"""
+    rows = rows - rows.mean(axis=-1, keepdims=True)
+    std = rows.std(axis=-1, keepdims=True)
+    valid = std[..., 0] > 0
+    return np.divide(rows, std, out=np.zeros_like(rows), where=std > 0), valid
+
+
+def correlate(capture: np.ndarray, pids: dict, signals: dict = None, resolution: float = DEFAULT_RESOLUTION,
+              max_lag: float = DEFAULT_MAX_LAG, top: int = DEFAULT_TOP) -> dict:
+    """Best matching bit fields for every PID as {pid: [Match, ...]}, strongest first"""
+    capture, groups = group_by_id(capture)
+    if not groups or not pids:
+        return {}
+
+    # Common time grid: where capture and PID readings overlap
+    begin = max(capture["timestamp"].min(), min(times[0] for times, _ in pids.values()))
+    end = min(capture["timestamp"].max(), max(times[-1] for times, _ in pids.values()))
+    grid = np.arange(begin, end, resolution)
+    if len(grid) < 4:
+        raise ValueError("capture and OBD readings do not overlap")
+
+    # Sample and hold every candidate field of every ID onto the grid
+    fields = []
+    rows = []
+    for can_id, group in groups:
+        frames = capture[group]
+        dlc = int(frames["dlc"].max())
+        data = frames["data"]
+        held = np.clip(np.searchsorted(frames["timestamp"], grid, side="right") - 1, 0, len(frames) - 1)
+
+        for signal in candidate_fields(can_id, dlc, (signals or {}).get(can_id)):
+            fields.append(signal)
+            rows.append(_signal_values(data, signal)[held])
+
+    raw = np.array(rows, dtype=np.float32)
+    standardized, valid = _standardize(raw)
+
+    lags = int(max_lag / resolution)
+
+    matches = {}
+    for pid, (times, values) in pids.items():
+        resampled = np.interp(grid, times, values)
+        reference, reference_valid = _standardize(resampled)
+        if not reference_valid:
+            continue
+
+        # Cross-correlation of all fields at once: column lags + k holds sum(field[t] * reference[t - k]), zero padded
+        shifted = sliding_window_view(np.pad(reference.astype(standardized.dtype), lags), len(grid))[::-1]
+        correlation = (standardized @ shifted.T) / len(grid)
+        correlation[~valid] = 0
+        best = np.abs(correlation).argmax(axis=1)
+        strength = correlation[np.arange(len(fields)), best]
+
+        matches[pid] = []
+        for row in np.argsort(-np.abs(strength))[:top]:
+            if not valid[row]:
+                break
+            shift = int(best[row]) - lags
+
+            # Raw field value at t + shift explains the PID value at t
+            aligned = raw[row, max(shift, 0):len(grid) + min(shift, 0)]
+            expected = resampled[max(-shift, 0):len(grid) - max(shift, 0)]
+            factor, offset = np.polyfit(aligned, expected, 1)
+
+            matches[pid].append(Match(pid, fields[row], float(strength[row]), shift * resolution, float(factor), float(offset)))
+
+    return matches
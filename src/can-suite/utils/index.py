@@ -0,0 +1,318 @@
+"""
+    CAN Suite capture index.
+
+    Library maintaining a sparse index sidecar (<capture>.idx) for candump
+    logfiles and columnar captures: the capture is split into blocks with
+    their file offset and time span, and every ID has a posting list of the
+    blocks it occurs in. Time windows and single IDs are read by seeking to
+    the matching blocks only. A line index sidecar (<logfile>.lines) holds
+    the offset of every line for line based selection. Sidecars are memory
+    mapped.
+
+    (c) Jannik Schmied, 2023
+"""
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from .analysis import id_keys
+from .candump import LOAD_CHUNK_SIZE, capture_dtype, log_width, parse_chunk
+from .capture import is_capture_file, open_capture
+
+INDEX_MAGIC: bytes = b"CANIDX02"
+INDEX_EXTENSION: str = ".idx"
+
+# Bytes of a candump logfile / frames of a columnar capture per block
+BLOCK_BYTES: int = 64 << 10
+BLOCK_ROWS: int = 2048
+
+# magic, columnar flag, payload width, source size, source mtime (ns), blocks, IDs, postings
+HEADER_FMT: str = "<8sBxxxIQQQQQ"
+HEADER_SIZE: int = 64
+
+# Block: source offset and end (bytes for logfiles, rows for columnar captures), time span and number of frames
+BLOCK_DTYPE = np.dtype([("offset", "<u8"), ("end", "<u8"), ("first", "<f8"), ("last", "<f8"), ("frames", "<u8")])
+
+# ID (EFF flag for extended IDs) and its slice of the posting array
+ID_DTYPE = np.dtype([("can_id", "<u4"), ("count", "<u4"), ("start", "<u8")])
+
+LINES_MAGIC: bytes = b"CANLIN02"
+LINES_EXTENSION: str = ".lines"
+
+# magic, source size, source mtime (ns), lines, payload width
+LINES_HEADER_FMT: str = "<8sQQQI"
+
+
+class InvalidIndexException(Exception):
+    pass
+
+
+def index_path(path: str) -> str:
+    return f"{path}{INDEX_EXTENSION}"
+
+
+def _source_stamp(path: str) -> tuple:
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _log_blocks(path: str, width: int):
+    """Yield (offset, end, frames) of line aligned blocks of a candump logfile"""
+    position = 0
+    rest = b""
+
+    with open(path, "rb") as logfile:
+        while True:
+            block = logfile.read(LOAD_CHUNK_SIZE)
+            data = rest + block
+            if not data:
+                break
+
+            # Split at the first newline after every BLOCK_BYTES, keep the incomplete last line for the next read
+            start = 0
+            while True:
+                cut = data.find(b"\n", start + BLOCK_BYTES)
+                if cut < 0:
+                    break
+                yield position + start, position + cut + 1, parse_chunk(data[start:cut + 1], width)
+                start = cut + 1
+
+            if not block:
+                if start < len(data):
+                    yield position + start, position + len(data), parse_chunk(data[start:], width)
+                break
+
+            position += start
+            rest = data[start:]
+
+
+def _capture_blocks(capture):
+    for offset in range(0, len(capture), BLOCK_ROWS):
+        end = min(offset + BLOCK_ROWS, len(capture))
+        yield offset, end, capture[offset:end]
+
+
+def build_index(path: str) -> None:
+    """Scan a logfile or columnar capture once and write its index sidecar"""
+    columnar = is_capture_file(path)
+    width = open_capture(path).width if columnar else log_width(path)
+    blocks = []
+    keys = []
+    block_ids = []
+
+    for number, (offset, end, frames) in enumerate(_capture_blocks(open_capture(path)) if columnar else _log_blocks(path, width)):
+        timestamps = frames["timestamp"]
+        first, last = (float(timestamps.min()), float(timestamps.max())) if len(frames) else (np.inf, -np.inf)
+        blocks.append((offset, end, first, last, len(frames)))
+
+        unique = np.unique(id_keys(frames))
+        keys.append(unique)
+        block_ids.append(np.full(len(unique), number, dtype=np.uint32))
+
+    blocks = np.array(blocks, dtype=BLOCK_DTYPE)
+    keys = np.concatenate(keys) if keys else np.zeros(0, dtype=np.uint32)
+    block_ids = np.concatenate(block_ids) if block_ids else np.zeros(0, dtype=np.uint32)
+
+    # Posting lists: blocks of every ID, sorted by ID and block
+    order = np.lexsort((block_ids, keys))
+    keys, postings = keys[order], block_ids[order]
+    ids, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+    id_table = np.zeros(len(ids), dtype=ID_DTYPE)
+    id_table["can_id"], id_table["count"], id_table["start"] = ids, counts, starts
+
+    size, mtime = _source_stamp(path)
+    header = struct.pack(HEADER_FMT, INDEX_MAGIC, columnar, width, size, mtime, len(blocks), len(ids), len(postings))
+
+    tmp_path = f"{index_path(path)}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(header.ljust(HEADER_SIZE, b"\0"))
+        for array in (blocks, id_table, postings.astype("<u4")):
+            file.write(array.tobytes())
+    os.replace(tmp_path, index_path(path))
+
+
+class CaptureIndex:
+    """Memory mapped index sidecar of a logfile or columnar capture"""
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+        with open(index_path(path), "rb") as file:
+            header = file.read(HEADER_SIZE)
+
+        if len(header) < HEADER_SIZE:
+            raise InvalidIndexException(f"truncated index: {index_path(path)}")
+
+        magic, columnar, width, size, mtime, blocks, ids, postings = struct.unpack_from(HEADER_FMT, header)
+        if magic != INDEX_MAGIC:
+            raise InvalidIndexException(f"not an index: {index_path(path)}")
+
+        self.columnar = bool(columnar)
+        self.width = width
+        self.stamp = (size, mtime)
+
+        offset = HEADER_SIZE
+        arrays = []
+        for dtype, count in ((BLOCK_DTYPE, blocks), (ID_DTYPE, ids), (np.dtype("<u4"), postings)):
+            arrays.append(np.memmap(index_path(path), dtype=dtype, mode="r", offset=offset, shape=(count,)) if count else np.zeros(0, dtype=dtype))
+            offset += count * dtype.itemsize
+        self.blocks, self.ids, self.postings = arrays
+
+    @classmethod
+    def open(cls, path: str) -> "CaptureIndex":
+        """Open the index of a capture, (re)building it if it is missing or older than the capture"""
+        try:
+            index = cls(path)
+            if index.stamp == _source_stamp(path):
+                return index
+        except (FileNotFoundError, InvalidIndexException):
+            pass
+
+        build_index(path)
+        return cls(path)
+
+    @property
+    def begin(self) -> float:
+        """Earliest timestamp of the capture"""
+        return float(self.blocks["first"].min()) if len(self.blocks) else 0.0
+
+    @property
+    def frames(self) -> int:
+        return int(self.blocks["frames"].sum())
+
+    def id_blocks(self, can_id: int) -> np.ndarray:
+        """Posting list of an ID (EFF flag for extended IDs)"""
+        row = np.searchsorted(self.ids["can_id"], can_id)
+        if row == len(self.ids) or self.ids["can_id"][row] != can_id:
+            return np.zeros(0, dtype=np.uint32)
+        start = int(self.ids["start"][row])
+        return np.asarray(self.postings[start:start + int(self.ids["count"][row])])
+
+    def select_blocks(self, can_ids=None, start: float = None, end: float = None) -> np.ndarray:
+        """Blocks which may contain frames of the IDs within [start, end] (absolute timestamps)"""
+        selected = np.ones(len(self.blocks), dtype=bool)
+
+        if start is not None:
+            selected &= self.blocks["last"] >= start
+        if end is not None:
+            selected &= self.blocks["first"] <= end
+        if can_ids is not None:
+            wanted = np.zeros(len(self.blocks), dtype=bool)
+            for can_id in can_ids:
+                wanted[self.id_blocks(can_id)] = True
+            selected &= wanted
+
+        return np.flatnonzero(selected)
+
+    def select(self, can_ids=None, start: float = None, end: float = None):
+        """Frames of the IDs within [start, end] as capture array (Capture for columnar captures).
+        Only the matching blocks are read."""
+        numbers = self.select_blocks(can_ids, start, end)
+
+        if self.columnar:
+            capture = open_capture(self.path)
+            rows = np.concatenate([np.arange(int(self.blocks["offset"][number]), int(self.blocks["end"][number])) for number in numbers] or [np.zeros(0, dtype=np.int64)])
+            frames = capture[rows]
+        else:
+            parts = []
+            with open(self.path, "rb") as logfile:
+                for number in numbers:
+                    logfile.seek(int(self.blocks["offset"][number]))
+                    parts.append(parse_chunk(logfile.read(int(self.blocks["end"][number] - self.blocks["offset"][number])), self.width))
+            frames = np.concatenate(parts) if parts else np.zeros(0, dtype=capture_dtype(self.width))
+
+        # Blocks are coarse, filter the frames themselves
+        mask = np.ones(len(frames), dtype=bool)
+        if start is not None:
+            mask &= frames["timestamp"] >= start
+        if end is not None:
+            mask &= frames["timestamp"] <= end
+        if can_ids is not None:
+            mask &= np.isin(id_keys(frames), np.array(list(can_ids), dtype=np.uint32))
+
+        return frames[mask]
+
+
+def lines_path(path: str) -> str:
+    return f"{path}{LINES_EXTENSION}"
+
+
+def build_line_index(path: str) -> None:
+    """Scan a logfile once for newlines and write the offset of every line to its line index sidecar"""
+    offsets = [np.zeros(1, dtype=np.uint64)]
+    position = 0
+
+    with open(path, "rb") as logfile:
+        while True:
+            block = logfile.read(LOAD_CHUNK_SIZE)
+            if not block:
+                break
+            offsets.append(np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord("\n")).astype(np.uint64) + position + 1)
+            position += len(block)
+
+    # The last line may lack its newline
+    offsets = np.concatenate(offsets)
+    if offsets[-1] != position:
+        offsets = np.append(offsets, np.uint64(position))
+
+    size, mtime = _source_stamp(path)
+    header = struct.pack(LINES_HEADER_FMT, LINES_MAGIC, size, mtime, len(offsets) - 1, log_width(path))
+
+    tmp_path = f"{lines_path(path)}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(header.ljust(HEADER_SIZE, b"\0"))
+        file.write(offsets.astype("<u8").tobytes())
+    os.replace(tmp_path, lines_path(path))
+
+
+class LineIndex:
+    """Memory mapped line index sidecar of a logfile, line n (0-based) spans offsets[n] to offsets[n + 1]"""
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+        with open(lines_path(path), "rb") as file:
+            header = file.read(HEADER_SIZE)
+
+        if len(header) < HEADER_SIZE:
+            raise InvalidIndexException(f"truncated line index: {lines_path(path)}")
+
+        magic, size, mtime, lines, width = struct.unpack_from(LINES_HEADER_FMT, header)
+        if magic != LINES_MAGIC:
+            raise InvalidIndexException(f"not a line index: {lines_path(path)}")
+
+        self.stamp = (size, mtime)
+        # Payload width the lines are parsed with (CAN-FD logfiles need 64 bytes)
+        self.width = width
+        self.offsets = np.memmap(lines_path(path), dtype="<u8", mode="r", offset=HEADER_SIZE, shape=(lines + 1,))
+
+    @classmethod
+    def open(cls, path: str) -> "LineIndex":
+        """Open the line index of a logfile, (re)building it if it is missing or older than the logfile"""
+        try:
+            index = cls(path)
+            if index.stamp == _source_stamp(path):
+                return index
+        except (FileNotFoundError, InvalidIndexException):
+            pass
+
+        build_line_index(path)
+        return cls(path)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def read(self, lines) -> bytes:
+        """Text of the given lines (0-based, ascending), a contiguous range is read with a single seek"""
+        lines = np.asarray(lines, dtype=np.int64)
+        if not len(lines):
+            return b""
+
+        if lines[-1] - lines[0] == len(lines) - 1:
+            with open(self.path, "rb") as logfile:
+                logfile.seek(int(self.offsets[lines[0]]))
+                return logfile.read(int(self.offsets[lines[-1] + 1] - self.offsets[lines[0]]))
+
+        starts, ends = self.offsets[lines].tolist(), self.offsets[lines + 1].tolist()
+        with open(self.path, "rb") as logfile, mmap.mmap(logfile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return b"".join(data[start:end] for start, end in zip(starts, ends))
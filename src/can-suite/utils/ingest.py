@@ -0,0 +1,123 @@
+"""
+    CAN Suite bulk ingestion.
+
+    Library merging the capture files of a session (candump logfiles or
+    columnar captures) into one time-ordered capture: a process pool parses
+    and sorts every file into a temporary columnar capture, these are merged
+    with a k-way heap merge over memory mapped chunks. Only one chunk per
+    file is held in memory during the merge.
+
+    (c) Jannik Schmied, 2023
+"""
+import heapq
+import os
+import tempfile
+from multiprocessing import Pool
+
+import numpy as np
+
+from .candump import READ_BUFFER, load_capture, log_width, read_log
+from .capture import CAPTURE_EXTENSION, Capture, is_capture_file, log_lines, open_capture, write_capture
+
+# Frames per file buffered by the merge
+MERGE_ROWS: int = 1 << 16
+
+
+def _sort_file(job: tuple) -> int:
+    """Worker: parse one file, sort it by time and write it as columnar capture, returns number of frames"""
+    path, sorted_path, width = job
+
+    if is_capture_file(path):
+        capture = open_capture(path)
+        interface = capture.interface
+        if capture.width > width:
+            raise ValueError(f"{path}: payload width {capture.width}, expected {width}")
+        if capture.width < width:
+            # Classic captures merged with CAN-FD ones, pad the payloads
+            capture = Capture({**capture.columns, "data": np.pad(capture["data"], ((0, 0), (0, width - capture.width)))}, interface)
+    else:
+        capture = load_capture(path, width)
+        first = next(read_log(path), None)
+        interface = first.interface if first else ""
+
+    # candump logs are ordered already, merged or edited files may not be
+    timestamps = capture["timestamp"]
+    if np.any(timestamps[1:] < timestamps[:-1]):
+        capture = capture[np.argsort(timestamps, kind="stable")]
+
+    return write_capture(sorted_path, [capture], width, interface)
+
+
+def _chunks(capture: Capture):
+    for offset in range(0, len(capture), MERGE_ROWS):
+        yield capture[offset:offset + MERGE_ROWS]
+
+
+def merge_captures(captures: list):
+    """k-way merge of time-ordered Captures, yields (Capture, sources) with the index of the input of every frame.
+    The heap is keyed by the last timestamp of every buffered chunk, everything up to the smallest one
+    can be emitted at once, so frames are merged chunk by chunk instead of one by one.
+    Frames with equal timestamps keep the order of the inputs."""
+    sources = [_chunks(capture) for capture in captures]
+    buffers = [next(source, None) for source in sources]
+    heap = [(float(buffer["timestamp"][-1]), number) for number, buffer in enumerate(buffers) if buffer is not None]
+    heapq.heapify(heap)
+
+    while heap:
+        bound, number = heapq.heappop(heap)
+        parts = []
+        origins = []
+
+        for other, buffer in enumerate(buffers):
+            if buffer is None:
+                continue
+            cut = int(np.searchsorted(buffer["timestamp"], bound, side="right"))
+            if cut:
+                parts.append(buffer[:cut])
+                origins.append(np.full(cut, other, dtype=np.uint16))
+                buffers[other] = buffer[cut:]
+
+        if parts:
+            frames = Capture.concatenate(parts)
+            origins = np.concatenate(origins)
+            order = np.argsort(frames["timestamp"], kind="stable")
+            yield frames[order], origins[order]
+
+        # The popped chunk is used up, the others only shrank and keep their heap key
+        buffers[number] = next(sources[number], None)
+        if buffers[number] is not None:
+            heapq.heappush(heap, (float(buffers[number]["timestamp"][-1]), number))
+
+
+def ingest(paths: list, output: str, workers: int = None, width: int = None, on_file=None) -> int:
+    """Merge capture files into one time-ordered columnar capture (output ends with .cancol) or candump logfile.
+    Files are parsed by a pool of workers (default: one per core), each holds one whole file in memory.
+    width defaults to the widest input, so CAN-FD frames are kept.
+    on_file(path, frames) is called for every parsed file. Returns number of frames."""
+    count = 0
+    width = width or max(open_capture(path).width if is_capture_file(path) else log_width(path) for path in paths)
+
+    with tempfile.TemporaryDirectory(prefix="ingest_", dir=os.path.dirname(os.path.abspath(output))) as tmp_dir:
+        jobs = [(path, os.path.join(tmp_dir, f"{number}{CAPTURE_EXTENSION}"), width) for number, path in enumerate(paths)]
+
+        with Pool(min(workers or os.cpu_count(), len(jobs))) as pool:
+            for path, frames in zip(paths, pool.imap(_sort_file, jobs)):
+                if on_file:
+                    on_file(path, frames)
+
+        captures = [open_capture(sorted_path) for _, sorted_path, _ in jobs]
+        interfaces = [capture.interface or "can0" for capture in captures]
+        merged = merge_captures(captures)
+
+        if output.endswith(CAPTURE_EXTENSION):
+            interface = interfaces[0] if len(set(interfaces)) == 1 else ""
+            return write_capture(output, (frames for frames, _ in merged), width, interface)
+
+        # Logfiles keep the interface of every frame
+        names = np.array(interfaces)
+        with open(output, "w", buffering=READ_BUFFER) as logfile:
+            for frames, origins in merged:
+                logfile.writelines(log_lines(frames, names[origins].tolist()))
+                count += len(frames)
+
+    return count
@@ -0,0 +1,117 @@
+"""
+    CAN Suite keyspace generator.
+
+    Library enumerating brute force payloads as NumPy blocks of raw bytes
+    (one row per candidate) instead of nested loops building hex strings.
+
+    (c) Jannik Schmied, 2023
+"""
+import numpy as np
+
+# Payload length limits
+MIN_LENGTH: int = 1
+MAX_LENGTH: int = 8
+MAX_LENGTH_FD: int = 64
+
+# Candidates per generated block
+DEFAULT_BLOCK_SIZE: int = 0x10000
+
+_U64: int = 1 << 64
+
+# Odd multipliers for the random permutation rounds
+_MIX_MULTIPLIERS: tuple = (0xBF58476D1CE4E5B9, 0x94D049BB133111EB)
+
+
+def keyspace_size(length: int) -> int:
+    """Number of candidates for a payload length"""
+    return 1 << (8 * length)
+
+
+def is_valid_length(length: int, fd: bool = False) -> bool:
+    """Checks if payload length is supported (1-8 bytes, 1-64 bytes for CAN-FD)"""
+    return MIN_LENGTH <= length <= (MAX_LENGTH_FD if fd else MAX_LENGTH)
+
+
+def _counting(high: int, low: np.ndarray, bits: int, seed: int) -> tuple:
+    return high, low
+
+
+def _gray(high: int, low: np.ndarray, bits: int, seed: int) -> tuple:
+    """Reflected binary code: consecutive candidates differ in exactly one bit"""
+    gray = low ^ (low >> np.uint64(1))
+    if high & 1:
+        gray ^= np.uint64(1 << 63)
+    return high ^ (high >> 1), gray
+
+
+def _random(high: int, low: np.ndarray, bits: int, seed: int) -> tuple:
+    """Seeded bijection on the lowest 64 bits (multiply-odd and xorshift rounds)"""
+    low_bits = min(bits, 64)
+    mask = np.uint64((1 << low_bits) - 1)
+    shift = np.uint64(max(low_bits // 2, 1))
+    offset = np.uint64((seed * 0x9E3779B97F4A7C15) % _U64)
+
+    mixed = low.copy()
+    for multiplier in _MIX_MULTIPLIERS:
+        mixed = (mixed + offset) & mask
+        mixed = (mixed * np.uint64(multiplier)) & mask
+        mixed ^= mixed >> shift
+
+    return high, mixed
+
+
+# Enumeration orders, all bijective so every index maps to exactly one payload
+ORDERS: dict = {
+    "counting": _counting,      # last byte changes fastest (like the nested loops)
+    "gray": _gray,              # one bit flips between consecutive candidates
+    "walk": _counting,          # first byte changes fastest (bytes walked one by one)
+    "random": _random,          # seeded pseudo-random permutation
+}
+
+
+def payload_block(length: int, start: int, count: int, order: str = "counting", seed: int = 0) -> np.ndarray:
+    """Generate candidates start..start+count-1 as a (count, length) uint8 array"""
+    if order not in ORDERS:
+        raise ValueError(f"unknown enumeration order: {order}")
+
+    bits = 8 * length
+    low_bytes = min(length, 8)
+    high_bytes = length - low_bytes
+    transform = ORDERS[order]
+
+    block = np.empty((count, length), dtype=np.uint8)
+    row = 0
+    index = start
+
+    # Split at 2^64 boundaries so the varying part always fits into uint64
+    while row < count:
+        high, low = divmod(index, _U64)
+        rows = min(count - row, _U64 - low)
+
+        lows = np.arange(rows, dtype=np.uint64) + np.uint64(low)
+        high, lows = transform(high, lows, bits, seed)
+
+        target = block[row:row + rows]
+        target[:, high_bytes:] = lows.astype(">u8").view(np.uint8).reshape(rows, 8)[:, 8 - low_bytes:]
+        if high_bytes:
+            target[:, :high_bytes] = np.frombuffer(high.to_bytes(high_bytes, "big"), dtype=np.uint8)
+
+        row += rows
+        index += rows
+
+    if order == "walk":
+        block = np.ascontiguousarray(block[:, ::-1])
+
+    return block
+
+
+def keyspace(length: int, order: str = "counting", start: int = 0, stop: int = None, block_size: int = DEFAULT_BLOCK_SIZE, seed: int = 0):
+    """Yield (index, payloads) blocks covering the keyspace from start to stop"""
+    size = keyspace_size(length)
+    stop = size if stop is None else min(stop, size)
+    index = start
+
+    while index < stop:
+        count = min(block_size, stop - index)
+        yield index, payload_block(length, index, count, order, seed)
+        index += count
@@ -0,0 +1,182 @@
+"""
+    CAN Suite mutation fuzzer.
+
+    Library deriving fuzz cases from seed frames of a capture: bit flips,
+    byte arithmetic, boundary values and DLC changes are applied to whole
+    batches at once. Reactions of the bus (see oracle) serve as coverage:
+    a reaction not seen before adds the causing frame to the corpus and
+    raises the energy of its seed, so seeds are picked by how much new
+    behaviour their mutants uncovered.
+
+    (c) Jannik Schmied, 2023
+"""
+from collections import deque
+from dataclasses import dataclass
+
+import numpy as np
+
+from .analysis import group_by_id
+from .candump import FLAG_EFF, capture_dtype
+from .oracle import REACTION_CHANGED, REACTION_NEGATIVE_RESPONSE, REACTION_RESPONSE, Hit
+from .socketcan import CAN_EFF_FLAG, CAN_EFF_MASK, CAN_MAX_DLEN
+
+# Mutation operators
+MUTATION_BIT_FLIP: str = "bit_flip"
+MUTATION_ARITHMETIC: str = "arithmetic"
+MUTATION_BOUNDARY: str = "boundary"
+MUTATION_DLC: str = "dlc"
+MUTATIONS: tuple = (MUTATION_BIT_FLIP, MUTATION_ARITHMETIC, MUTATION_BOUNDARY, MUTATION_DLC)
+
+# Largest value added to or subtracted from a byte (as in AFL)
+ARITHMETIC_MAX: int = 35
+
+# Byte values at signed and unsigned boundaries
+BOUNDARY_VALUES: np.ndarray = np.array([0x00, 0x01, 0x7F, 0x80, 0xFE, 0xFF], dtype=np.uint8)
+
+# Distinct payloads per ID taken from the capture as seeds
+SEEDS_PER_ID: int = 4
+
+# Energy of a new seed and energy added to a seed whose mutant found new coverage
+NOVELTY_ENERGY: float = 8.0
+
+DEFAULT_FUZZ_BATCH: int = 256
+
+# Batches kept to look up the frame of a case number
+_RECENT_BATCHES: int = 256
+
+
+@dataclass
+class Seed:
+    """Frame mutated by the fuzzer, energy is its relative chance to be picked"""
+    can_id: int
+    data: bytes
+    energy: float = 1.0
+    cases: int = 0
+    finds: int = 0
+
+
+def seeds_from_capture(capture, can_ids=None, per_id: int = SEEDS_PER_ID) -> list:
+    """Up to per_id distinct payloads (spread over the capture) of every ID, restricted to can_ids if given"""
+    capture, groups = group_by_id(capture)
+    seeds = []
+
+    for can_id, group in groups:
+        if can_ids is not None and can_id not in can_ids:
+            continue
+
+        frames = capture[group]
+        frames = frames[frames["dlc"] <= CAN_MAX_DLEN]
+        if not len(frames):
+            continue
+
+        rows = np.concatenate([frames["dlc"][:, None], frames["data"][:, :CAN_MAX_DLEN]], axis=1)
+        _, first = np.unique(rows, axis=0, return_index=True)
+        first = np.sort(first)
+
+        for row in first[np.linspace(0, len(first) - 1, min(per_id, len(first))).astype(int)]:
+            seeds.append(Seed(can_id, frames["data"][row, :frames["dlc"][row]].tobytes()))
+
+    return seeds
+
+
+def mutate(data: bytes, count: int, rng: np.random.Generator) -> tuple:
+    """count mutants of a payload as (payloads (count, 8), dlcs, operators) with one mutation each.
+    Bytes beyond the DLC stay zero, so DLC changes expose them as zero padding."""
+    dlc = len(data)
+    payloads = np.zeros((count, CAN_MAX_DLEN), dtype=np.uint8)
+    payloads[:, :dlc] = np.frombuffer(data, dtype=np.uint8)
+    dlcs = np.full(count, dlc, dtype=np.uint8)
+
+    # Empty payloads can only grow
+    operators = rng.integers(len(MUTATIONS), size=count) if dlc else np.full(count, MUTATIONS.index(MUTATION_DLC))
+    positions = rng.integers(max(dlc, 1), size=count)
+
+    rows = np.flatnonzero(operators == MUTATIONS.index(MUTATION_BIT_FLIP))
+    payloads[rows, positions[rows]] ^= (1 << rng.integers(8, size=len(rows))).astype(np.uint8)
+
+    rows = np.flatnonzero(operators == MUTATIONS.index(MUTATION_ARITHMETIC))
+    deltas = rng.integers(1, ARITHMETIC_MAX + 1, size=len(rows)) * rng.choice((-1, 1), size=len(rows))
+    payloads[rows, positions[rows]] = (payloads[rows, positions[rows]].astype(np.int16) + deltas).astype(np.uint8)
+
+    rows = np.flatnonzero(operators == MUTATIONS.index(MUTATION_BOUNDARY))
+    payloads[rows, positions[rows]] = BOUNDARY_VALUES[rng.integers(len(BOUNDARY_VALUES), size=len(rows))]
+
+    rows = np.flatnonzero(operators == MUTATIONS.index(MUTATION_DLC))
+    dlcs[rows] = (dlc + rng.integers(1, CAN_MAX_DLEN + 1, size=len(rows))) % (CAN_MAX_DLEN + 1)
+
+    return payloads, dlcs, operators
+
+
+def coverage_key(hit: Hit, volatile: dict = None) -> tuple:
+    """Behaviour a reaction stands for: responses by service and NRC, changes by the new payload.
+    Volatile bytes of a changed payload (ResponseOracle.volatile: counters, checksums) are zeroed,
+    otherwise every later frame of the ID would count as new coverage."""
+    if hit.reaction in (REACTION_RESPONSE, REACTION_NEGATIVE_RESPONSE):
+        return hit.reaction, hit.can_id, hit.data[1:4]
+    if hit.reaction == REACTION_CHANGED:
+        mask = (volatile or {}).get(hit.can_id, 0)
+        stable = int.from_bytes(hit.data, "big") & ~mask
+        return hit.reaction, hit.can_id, stable.to_bytes(len(hit.data), "big")
+    return hit.reaction, hit.can_id
+
+
+class MutationFuzzer:
+    """Seed corpus, batch generation and coverage feedback"""
+    def __init__(self, seeds: list, rng_seed: int = None, batch: int = DEFAULT_FUZZ_BATCH) -> None:
+        if not seeds:
+            raise ValueError("no seed frames")
+
+        self.corpus = list(seeds)
+        self.coverage = set()
+        self.rng = np.random.default_rng(rng_seed)
+        self.batch = batch
+        self.cases = 0
+        self.recent = deque(maxlen=_RECENT_BATCHES)
+
+    def next_batch(self) -> tuple:
+        """Mutants of one seed (picked by energy) as (seed index, first case number, capture array)"""
+        energy = np.array([seed.energy for seed in self.corpus])
+        number = int(self.rng.choice(len(self.corpus), p=energy / energy.sum()))
+        seed = self.corpus[number]
+
+        payloads, dlcs, _ = mutate(seed.data, self.batch, self.rng)
+        frames = np.zeros(self.batch, dtype=capture_dtype())
+        frames["can_id"] = seed.can_id & CAN_EFF_MASK
+        frames["flags"] = FLAG_EFF if seed.can_id & CAN_EFF_FLAG else 0
+        frames["dlc"] = dlcs
+        frames["data"] = payloads
+
+        first = self.cases
+        self.cases += self.batch
+        seed.cases += self.batch
+        self.recent.append((first, frames))
+
+        return number, first, frames
+
+    def case(self, index: int) -> tuple:
+        """(can_id, data) of a recent case number, None if it is no longer kept"""
+        for first, frames in self.recent:
+            if first <= index < first + len(frames):
+                row = frames[index - first]
+                can_id = int(row["can_id"]) | (CAN_EFF_FLAG if row["flags"] & FLAG_EFF else 0)
+                return can_id, row["data"][:row["dlc"]].tobytes()
+        return None
+
+    def feedback(self, hit: Hit, volatile: dict = None) -> bool:
+        """Add a reaction to the coverage, returns True if it is new (the causing case becomes a seed).
+        volatile are the volatile payload bytes of the oracle (see coverage_key)."""
+        key = coverage_key(hit, volatile)
+        if key in self.coverage:
+            return False
+        self.coverage.add(key)
+
+        if hit.tag is not None:
+            parent = self.corpus[hit.tag]
+            parent.energy += NOVELTY_ENERGY
+            parent.finds += 1
+
+        frame = self.case(hit.index) if hit.index is not None else None
+        if frame:
+            self.corpus.append(Seed(*frame, energy=NOVELTY_ENERGY))
+
+        return True
@@ -0,0 +1,318 @@
+"""
+    CAN Suite response oracle.
+
+    Library monitoring the bus while frames are injected. Reactions (new IDs,
+    changed payloads on watched IDs, UDS/OBD responses, error frames, missing
+    heartbeats of periodic IDs) are attributed to the candidate sent shortly
+    before and collected in a hit list.
+
+    (c) Jannik Schmied, 2023
+"""
+import csv
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from socket import timeout as SocketTimeout
+from time import monotonic, sleep
+
+import numpy as np
+
+from .socketcan import CAN_EFF_FLAG, CAN_EFF_MASK, CAN_ERR_FLAG, CAN_ERR_MASK, NativeCANSocket, format_can_id
+
+# Default seconds between an injection and a reaction
+DEFAULT_WINDOW: float = 0.05
+
+# Default seconds of bus traffic learned before injecting
+DEFAULT_LEARN_TIME: float = 2.0
+
+# OBD-II response IDs (ISO 15765-4) and offset of physical UDS responses
+OBD_RESPONSE_IDS: range = range(0x7E8, 0x7F0)
+UDS_RESPONSE_OFFSET: int = 0x8
+UDS_NEGATIVE_RESPONSE: int = 0x7F
+
+# Reaction types
+REACTION_NEW_ID: str = "new_id"
+REACTION_CHANGED: str = "changed"
+REACTION_RESPONSE: str = "response"
+REACTION_NEGATIVE_RESPONSE: str = "negative_response"
+REACTION_ERROR_FRAME: str = "error_frame"
+REACTION_MISSING: str = "missing"
+
+# A learned periodic ID is missing after this many periods without a frame
+HEARTBEAT_FACTOR: float = 3.0
+
+# IDs with longer periods (seconds) or fewer frames while learning are not treated as heartbeats
+MAX_HEARTBEAT_PERIOD: float = 1.0
+MIN_HEARTBEAT_FRAMES: int = 5
+
+_RECV_TIMEOUT: float = 0.1
+_HEARTBEAT_CHECK: float = 0.01
+_ID_MASK: int = CAN_EFF_FLAG | CAN_EFF_MASK
+
+
+@dataclass
+class Hit:
+    """Reaction on the bus and the candidate it is attributed to"""
+    time: float
+    reaction: str
+    can_id: int
+    data: bytes
+    candidate_id: int
+    candidate: bytes
+    index: int = None
+    tag: object = None
+    suspects: list = field(default_factory=list, repr=False)
+
+    def describe(self) -> str:
+        return (f"{self.reaction} {format_can_id(self.can_id)}#{self.data.hex()} "
+                f"<- {format_can_id(self.candidate_id)}#{self.candidate.hex()} ({len(self.suspects)} suspects)")
+
+
+class ResponseOracle:
+    """Background receiver correlating bus reactions with injected candidates"""
+    def __init__(self, interface: str, injected_ids, watch_ids=None, window: float = DEFAULT_WINDOW, fd: bool = False,
+                 errors: bool = False, watch_all: bool = False) -> None:
+        self.socket = NativeCANSocket(interface, fd=fd, errors=errors)
+        self.injected_ids = {can_id & _ID_MASK for can_id in injected_ids}
+        self.watch_ids = {can_id & _ID_MASK for can_id in watch_ids or ()}
+        self.watch_all = watch_all
+        self.errors = errors
+        self.response_ids = set(OBD_RESPONSE_IDS) | {can_id + UDS_RESPONSE_OFFSET for can_id in self.injected_ids}
+        self.window = window
+
+        # Learned bus state
+        self.known_ids = set()
+        self.learned_ids = set()
+        self.references = {}
+        self.volatile = {}
+
+        # Heartbeats: first/last reception and frames per ID while learning, learned periods, IDs overdue
+        self.first_seen = {}
+        self.last_seen = {}
+        self.counts = {}
+        self.periods = {}
+        self.missing = set()
+        self.checked = 0.0
+
+        self.journal = deque()
+        self.hits = []
+        self.reactions = 0
+        self.lock = threading.Lock()
+        self.learning = False
+        self.running = False
+        self.thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        self.running = True
+        self.thread = threading.Thread(target=self._receive, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.socket.close()
+
+    def learn(self, duration: float = DEFAULT_LEARN_TIME) -> None:
+        """Record IDs and volatile payload bytes of regular traffic before injecting"""
+        self.learning = True
+        sleep(duration)
+
+        with self.lock:
+            self.learning = False
+            self.learned_ids = set(self.known_ids)
+
+            # Regular traffic on a response ID is not a response
+            self.response_ids -= self.learned_ids
+
+            for can_id, count in self.counts.items():
+                period = (self.last_seen[can_id] - self.first_seen[can_id]) / max(count - 1, 1)
+                if count >= MIN_HEARTBEAT_FRAMES and 0 < period <= MAX_HEARTBEAT_PERIOD:
+                    self.periods[can_id] = period
+
+    def reset(self) -> None:
+        """Forget IDs and reactions seen since learning, so a replay detects them again"""
+        with self.lock:
+            self.known_ids = set(self.learned_ids)
+            self.missing = set()
+            self.hits = []
+            self.reactions = 0
+
+    def record(self, can_ids, payloads: np.ndarray, started: float, finished: float, indices: np.ndarray = None, tag=None) -> None:
+        """Register a block of candidates sent between started and finished (monotonic time).
+        can_ids is a single ID or one ID per payload row, indices the keyspace index per row."""
+        with self.lock:
+            self.journal.append((started, finished, can_ids, payloads, indices, tag))
+
+            # Keep only what can still be attributed
+            horizon = finished - max(4 * self.window, 1.0)
+            while self.journal and self.journal[0][1] < horizon:
+                self.journal.popleft()
+
+    def pop_hits(self) -> list:
+        with self.lock:
+            hits, self.hits = self.hits, []
+        return hits
+
+    def pop_reactions(self) -> int:
+        """Number of reactions since the last call, attributed or not"""
+        with self.lock:
+            reactions, self.reactions = self.reactions, 0
+        return reactions
+
+    def _receive(self) -> None:
+        self.socket.settimeout(_RECV_TIMEOUT)
+
+        while self.running:
+            try:
+                can_id, data, local = self.socket.recv_flags()
+            except SocketTimeout:
+                self._check_heartbeats(monotonic())
+                continue
+            except OSError:
+                break
+
+            now = monotonic()
+
+            if can_id & CAN_ERR_FLAG:
+                if self.errors and not self.learning:
+                    self._react(now, REACTION_ERROR_FRAME, can_id & CAN_ERR_MASK, data)
+                continue
+
+            can_id &= _ID_MASK
+
+            if self.learning:
+                self._learn_frame(can_id, data, now)
+                continue
+
+            self._check_heartbeats(now)
+
+            # Own injections (sent from this host); on a real bus ECUs may still answer on an injected ID
+            if local and can_id in self.injected_ids:
+                continue
+
+            self.last_seen[can_id] = now
+            self.missing.discard(can_id)
+
+            reaction = self._classify(can_id, data)
+            if reaction:
+                self._react(now, reaction, can_id, data)
+
+    def _react(self, now: float, reaction: str, can_id: int, data: bytes) -> None:
+        with self.lock:
+            self.reactions += 1
+        self._attribute(now, reaction, can_id, data)
+
+    def _check_heartbeats(self, now: float) -> None:
+        """Report learned periodic IDs which stopped, attributed to the time their next frame was due"""
+        if self.learning or now - self.checked < _HEARTBEAT_CHECK:
+            return
+        self.checked = now
+
+        for can_id, period in self.periods.items():
+            last = self.last_seen[can_id]
+            if can_id not in self.missing and now - last > HEARTBEAT_FACTOR * period:
+                self.missing.add(can_id)
+                self._react(last + period, REACTION_MISSING, can_id, b"")
+
+    def _learn_frame(self, can_id: int, data: bytes, now: float) -> None:
+        self.known_ids.add(can_id)
+        self.first_seen.setdefault(can_id, now)
+        self.last_seen[can_id] = now
+        self.counts[can_id] = self.counts.get(can_id, 0) + 1
+
+        if self.watch_all and can_id not in self.injected_ids:
+            self.watch_ids.add(can_id)
+
+        if can_id not in self.watch_ids:
+            return
+
+        reference = self.references.setdefault(can_id, data)
+        if len(reference) != len(data):
+            return
+
+        # Whole bytes are marked volatile, not only the bits seen changing
+        changed = bytes(0xFF if old != new else 0x00 for old, new in zip(reference, data))
+        self.volatile[can_id] = self.volatile.get(can_id, 0) | int.from_bytes(changed, "big")
+
+    def _classify(self, can_id: int, data: bytes):
+        if can_id in self.response_ids:
+            # ISO-TP single frame: PCI byte followed by service ID (0x7F for negative responses)
+            if len(data) > 1 and data[1] == UDS_NEGATIVE_RESPONSE:
+                return REACTION_NEGATIVE_RESPONSE
+            return REACTION_RESPONSE
+
+        if can_id not in self.known_ids:
+            self.known_ids.add(can_id)
+            return REACTION_NEW_ID
+
+        if can_id in self.watch_ids:
+            reference = self.references.get(can_id)
+            self.references[can_id] = data
+
+            if reference is None or len(reference) != len(data):
+                return REACTION_CHANGED
+
+            # Bytes which already changed during learning (counters, sensor values) are ignored
+            changed = int.from_bytes(reference, "big") ^ int.from_bytes(data, "big")
+            if changed & ~self.volatile.get(can_id, 0):
+                return REACTION_CHANGED
+
+        return None
+
+    def _attribute(self, now: float, reaction: str, can_id: int, data: bytes) -> None:
+        suspects = []
+
+        with self.lock:
+            for started, finished, can_ids, payloads, indices, tag in self.journal:
+                if finished < now - self.window or started > now:
+                    continue
+
+                # Candidates of a batch are spread evenly over its send time
+                times = np.linspace(started, finished, len(payloads))
+                rows = np.nonzero((times >= now - self.window) & (times <= now))[0]
+                suspects.extend((int(can_ids[row]) if isinstance(can_ids, np.ndarray) else can_ids,
+                                 payloads[row].tobytes(),
+                                 None if indices is None else int(indices[row]),
+                                 tag) for row in rows)
+
+            if not suspects:
+                return
+
+            # The candidate sent last before the reaction is the most likely cause
+            candidate_id, candidate, index, tag = suspects[-1]
+            self.hits.append(Hit(now, reaction, can_id, data, candidate_id, candidate, index, tag, suspects))
+
+    def confirm(self, sender, hit: Hit) -> Hit:
+        """Replay the suspects of a hit one by one (newest first) to pin down the causing candidate.
+        Works for responses and new IDs, changed payloads only reproduce if the ECU state was reset."""
+        for candidate_id, candidate, index, tag in reversed(hit.suspects):
+            self.pop_hits()
+            self.known_ids.discard(hit.can_id)
+            sent = monotonic()
+            sender(candidate_id, candidate)
+            self.record(candidate_id, np.frombuffer(candidate, dtype=np.uint8).reshape(1, -1), sent, sent, None if index is None else np.array([index]), tag)
+            sleep(self.window)
+
+            if self.pop_hits():
+                return Hit(hit.time, hit.reaction, hit.can_id, hit.data, candidate_id, candidate, index, tag, [(candidate_id, candidate, index, tag)])
+
+        return hit
+
+
+def write_hits(path: str, hits: list) -> None:
+    """Write hit list as CSV"""
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["time", "reaction", "id", "data", "candidate_id", "candidate", "index", "tag", "suspects"])
+        for hit in hits:
+            writer.writerow([f"{hit.time:.6f}", hit.reaction, format_can_id(hit.can_id), hit.data.hex(),
+                             format_can_id(hit.candidate_id), hit.candidate.hex(),
+                             "" if hit.index is None else hex(hit.index), "" if hit.tag is None else hit.tag, len(hit.suspects)])
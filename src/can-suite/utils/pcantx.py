@@ -0,0 +1,188 @@
+"""
+    CAN Suite PCAN transmit adapter.
+
+    Library driving PCAN-USB(-FD) adapters at bus speed. A pool of
+    TPCANMsg/TPCANMsgFD structures is allocated once and filled in place
+    (single frames with memmove, batches through a NumPy view of the pool),
+    so no ctypes structure is built per frame. Frames are taken in the
+    packed SocketCAN layout, so the adapter stands in for NativeCANSocket.
+
+    (c) Jannik Schmied, 2023
+"""
+from ctypes import addressof, memmove, sizeof
+from time import sleep
+
+import numpy as np
+
+from . import PCAN
+from .bitrates import BITRATES
+from .PCAN import (PCAN_BAUD_5K, PCAN_BAUD_10K, PCAN_BAUD_20K, PCAN_BAUD_33K, PCAN_BAUD_47K, PCAN_BAUD_50K, PCAN_BAUD_83K,
+                   PCAN_BAUD_95K, PCAN_BAUD_100K, PCAN_BAUD_125K, PCAN_BAUD_250K, PCAN_BAUD_500K, PCAN_BAUD_800K, PCAN_BAUD_1M, PCAN_ERROR_OK, PCAN_ERROR_QXMTFULL, PCAN_ERROR_XMTFULL, PCAN_MESSAGE_BRS,
+                   PCAN_MESSAGE_EXTENDED, PCAN_MESSAGE_FD, PCAN_MESSAGE_RTR, PCAN_MESSAGE_STANDARD, PCAN_USBBUS1,
+                   PCANBasic, TPCANHandle, TPCANMsg, TPCANMsgFD)
+from .socketcan import (CAN_EFF_FLAG, CAN_EFF_MASK, CAN_FRAME_DTYPE, CAN_FRAME_SIZE, CAN_RTR_FLAG, CANFD_FRAME_DTYPE,
+                        CANFD_FRAME_SIZE, DEFAULT_BATCH_SIZE, ENOBUFS_RETRY_DELAY)
+
+# PCAN baud rate register value of every supported bitrate (kbit/s)
+BAUD_RATES: dict = dict(zip(BITRATES, (PCAN_BAUD_5K, PCAN_BAUD_10K, PCAN_BAUD_20K, PCAN_BAUD_33K, PCAN_BAUD_47K, PCAN_BAUD_50K,
+                                       PCAN_BAUD_83K, PCAN_BAUD_95K, PCAN_BAUD_100K, PCAN_BAUD_125K, PCAN_BAUD_250K,
+                                       PCAN_BAUD_500K, PCAN_BAUD_800K, PCAN_BAUD_1M)))
+
+# Nominal 500 kbit/s, data 2 Mbit/s at an 80 MHz clock
+DEFAULT_BITRATE_FD: bytes = b"f_clock_mhz=80, nom_brp=10, nom_tseg1=12, nom_tseg2=3, nom_sjw=1, data_brp=4, data_tseg1=7, data_tseg2=2, data_sjw=1"
+
+# Bit rate switch flag of struct canfd_frame (linux/can.h)
+CANFD_BRS: int = 0x01
+
+# CAN-FD data length code of every payload length (lengths between valid sizes are rounded up)
+FD_LENGTHS: np.ndarray = np.array([0, 1, 2, 3, 4, 5, 6, 7, 8, 12, 16, 20, 24, 32, 48, 64])
+FD_DLC: np.ndarray = np.searchsorted(FD_LENGTHS, np.arange(FD_LENGTHS[-1] + 1)).astype(np.uint8)
+
+# Status codes of a full transmit queue, retried after a backoff
+_QUEUE_FULL: tuple = (PCAN_ERROR_XMTFULL, PCAN_ERROR_QXMTFULL)
+
+
+class PCANException(OSError):
+    pass
+
+
+def pcan_channel(name) -> TPCANHandle:
+    """PCAN channel handle by name, e.g. PCAN_USBBUS1 (handles are returned unchanged)"""
+    if isinstance(name, TPCANHandle):
+        return name
+    handle = getattr(PCAN, name.upper(), None)
+    if not name.upper().startswith("PCAN_") or not isinstance(handle, TPCANHandle):
+        raise ValueError(f"invalid PCAN channel: {name} (e.g. PCAN_USBBUS1)")
+    return handle
+
+
+def _message_dtype(message) -> np.dtype:
+    """NumPy view of a PCAN message structure, offsets taken from ctypes"""
+    length = "DLC" if message is TPCANMsgFD else "LEN"
+    return np.dtype({"names": ["ID", "MSGTYPE", "LEN", "DATA"],
+                     "formats": ["=u4", "u1", "u1", ("u1", (message.DATA.size,))],
+                     "offsets": [message.ID.offset, message.MSGTYPE.offset, getattr(message, length).offset, message.DATA.offset],
+                     "itemsize": sizeof(message)})
+
+
+class PCANTransmitter:
+    """PCAN channel with a preallocated message pool, initialized here unless an initialized PCANBasic is passed"""
+    def __init__(self, channel=PCAN_USBBUS1, fd: bool = False, pcan: PCANBasic = None, baud_rate=PCAN_BAUD_500K,
+                 bitrate_fd: bytes = DEFAULT_BITRATE_FD, rate=None, pool_size: int = DEFAULT_BATCH_SIZE) -> None:
+        self.channel = channel
+        self.fd_mode = fd
+        self.rate = rate
+        self.frame_size = CANFD_FRAME_SIZE if fd else CAN_FRAME_SIZE
+        self.frame_dtype = CANFD_FRAME_DTYPE if fd else CAN_FRAME_DTYPE
+        self.sent = 0
+        self.owner = pcan is None
+
+        if pcan is None:
+            pcan = PCANBasic()
+            if fd:
+                self._check(pcan, pcan.InitializeFD(channel, bitrate_fd))
+            else:
+                self._check(pcan, pcan.Initialize(channel, baud_rate))
+
+        self.pcan = pcan
+        self.write = pcan.WriteFD if fd else pcan.Write
+
+        message = TPCANMsgFD if fd else TPCANMsg
+        self.pool = (message * max(pool_size, 1))()
+        self.messages = list(self.pool)
+        self.view = np.frombuffer(self.pool, dtype=_message_dtype(message))
+        self.data_address = addressof(self.pool) + message.DATA.offset
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    @staticmethod
+    def _check(pcan: PCANBasic, status) -> None:
+        if status != PCAN_ERROR_OK:
+            error, text = pcan.GetErrorText(status)
+            raise PCANException(text.decode(errors="replace") if error == PCAN_ERROR_OK else f"PCAN error 0x{status:X}")
+
+    def _message_type(self, can_id: int) -> int:
+        message_type = PCAN_MESSAGE_EXTENDED.value if can_id & CAN_EFF_FLAG else PCAN_MESSAGE_STANDARD.value
+        if self.fd_mode:
+            return message_type | PCAN_MESSAGE_FD.value
+        return message_type | (PCAN_MESSAGE_RTR.value if can_id & CAN_RTR_FLAG else 0)
+
+    def send(self, can_id: int, data: bytes) -> None:
+        """Fill the first pool message in place and send it"""
+        message = self.messages[0]
+        length = len(data)
+
+        message.ID = can_id & CAN_EFF_MASK
+        message.MSGTYPE = self._message_type(can_id)
+        if self.fd_mode:
+            message.DLC = int(FD_DLC[length])
+        else:
+            message.LEN = length
+        memmove(self.data_address, data, length)
+
+        self._send(message, length, bool(can_id & CAN_EFF_FLAG))
+        self.sent += 1
+
+    def send_raw(self, frame: bytes) -> None:
+        """Send one pre-packed struct can_frame (or canfd_frame)"""
+        self.send_batch(frame)
+
+    def send_batch(self, frames) -> int:
+        """Send a contiguous buffer of pre-packed frames, returns number of frames sent.
+        Every pool-sized slice is converted to PCAN messages at once, then written message by message."""
+        frames = np.frombuffer(memoryview(frames).cast("B"), dtype=self.frame_dtype)
+        pool_size = len(self.messages)
+
+        for offset in range(0, len(frames), pool_size):
+            block = frames[offset:offset + pool_size]
+            count = len(block)
+            view = self.view[:count]
+            can_ids = block["can_id"]
+
+            message_types = np.where(can_ids & CAN_EFF_FLAG, PCAN_MESSAGE_EXTENDED.value, PCAN_MESSAGE_STANDARD.value).astype(np.uint8)
+            if self.fd_mode:
+                message_types |= PCAN_MESSAGE_FD.value | np.where(block["flags"] & CANFD_BRS, PCAN_MESSAGE_BRS.value, 0).astype(np.uint8)
+                view["LEN"] = FD_DLC[block["len"]]
+            else:
+                message_types |= np.where(can_ids & CAN_RTR_FLAG, PCAN_MESSAGE_RTR.value, 0).astype(np.uint8)
+                view["LEN"] = block["len"]
+            view["ID"] = can_ids & CAN_EFF_MASK
+            view["MSGTYPE"] = message_types
+            view["DATA"] = block["data"]
+
+            lengths = block["len"].tolist()
+            extended = (can_ids & CAN_EFF_FLAG).astype(bool).tolist()
+            for message, length, eff in zip(self.messages[:count], lengths, extended):
+                self._send(message, length, eff)
+
+        self.sent += len(frames)
+        return len(frames)
+
+    def _send(self, message, length: int, extended: bool) -> None:
+        """Write a pool message paced by the rate controller (if any), waiting while the transmit queue is full"""
+        rate = self.rate
+
+        if rate:
+            rate.acquire(length, extended)
+
+        while True:
+            status = self.write(self.channel, message)
+            if status == PCAN_ERROR_OK:
+                break
+            if status not in _QUEUE_FULL:
+                self._check(self.pcan, status)
+            if rate:
+                rate.backoff()
+            else:
+                sleep(ENOBUFS_RETRY_DELAY)
+
+        if rate:
+            rate.recovered()
+
+    def close(self) -> None:
+        if self.owner:
+            self.pcan.Uninitialize(self.channel)
@@ -0,0 +1,169 @@
+"""
+    CAN Suite transmit rate control.
+
+    Library pacing transmits with a token bucket to a target frame rate or
+    bus load, so fast engines neither overrun the TX queue (ENOBUFS) nor
+    starve regular traffic.
+
+    (c) Jannik Schmied, 2023
+"""
+from time import perf_counter, sleep
+
+from .bitrates import BITRATES
+
+DEFAULT_BITRATE: str = "500"
+
+# Largest burst the bucket allows (in frames) after being idle
+DEFAULT_BURST: int = 32
+
+# Backoff on ENOBUFS (TX queue full), doubled on every consecutive error
+MIN_BACKOFF: float = 0.0002
+MAX_BACKOFF: float = 0.05
+
+# Bits outside the stuffed region: CRC delimiter, ACK slot + delimiter, EOF (7) and intermission (3)
+_UNSTUFFED_BITS: int = 13
+
+# Bits from SOF to the end of the CRC field without data (11 bit / 29 bit identifier)
+_STUFFED_BITS_STANDARD: int = 34
+_STUFFED_BITS_EXTENDED: int = 54
+
+
+def bitrate(key: str) -> int:
+    """Bus bitrate in bit/s for a BITRATES key (kbit/s, e.g. "500")"""
+    if key not in BITRATES:
+        raise ValueError(f"invalid bitrate: {key} (valid: {', '.join(BITRATES)})")
+    return int(key) * 1000
+
+
+def frame_bits(length: int, extended: bool = False) -> int:
+    """Worst case bits on the wire for a classic CAN data frame including stuff bits"""
+    stuffed = (_STUFFED_BITS_EXTENDED if extended else _STUFFED_BITS_STANDARD) + 8 * min(length, 8)
+    return stuffed + _UNSTUFFED_BITS + (stuffed - 1) // 4
+
+
+def _crc15(bits: list) -> int:
+    """CAN CRC-15 (polynomial 0x4599) of a bit sequence"""
+    crc = 0
+    for bit in bits:
+        feedback = bit ^ (crc >> 14)
+        crc = (crc << 1) & 0x7FFF
+        if feedback:
+            crc ^= 0x4599
+    return crc
+
+
+def stuffed_frame_bits(can_id: int, data: bytes, extended: bool = False) -> int:
+    """Exact bits on the wire for a classic CAN data frame, stuff bits counted on the actual bit stream"""
+    def field(value: int, width: int) -> list:
+        return [(value >> shift) & 1 for shift in range(width - 1, -1, -1)]
+
+    # SOF, arbitration and control field (SRR and IDE recessive in extended frames)
+    if extended:
+        bits = [0] + field(can_id >> 18, 11) + [1, 1] + field(can_id, 18) + [0, 0, 0]
+    else:
+        bits = [0] + field(can_id, 11) + [0, 0, 0]
+    bits += field(min(len(data), 8), 4)
+    for byte in data[:8]:
+        bits += field(byte, 8)
+    bits += field(_crc15(bits), 15)
+
+    # A stuff bit of opposite level follows five equal bits and starts the next run
+    stuff = 0
+    run = 0
+    level = None
+    for bit in bits:
+        run = run + 1 if bit == level else 1
+        level = bit
+        if run == 5:
+            stuff += 1
+            level = 1 - bit
+            run = 1
+
+    return len(bits) + stuff + _UNSTUFFED_BITS
+
+
+class RateController:
+    """Token bucket holding a target frame rate (frames/s) or bus load (percent)"""
+    def __init__(self, frames_per_second: float = None, bus_load: float = None, bus_bitrate: int = 500000, burst: int = DEFAULT_BURST) -> None:
+        if (frames_per_second is None) == (bus_load is None):
+            raise ValueError("exactly one of frames_per_second and bus_load must be set")
+        if (frames_per_second is not None and frames_per_second <= 0) or (bus_load is not None and not 0 < bus_load <= 100):
+            raise ValueError("target rate must be positive and bus load at most 100 %")
+
+        self.frames_per_second = frames_per_second
+        self.bus_load = bus_load
+        self.bus_bitrate = bus_bitrate
+
+        # Tokens are frames in frame rate mode and bits in bus load mode
+        if bus_load is not None:
+            self.rate = bus_bitrate * bus_load / 100
+            self.capacity = burst * frame_bits(8)
+        else:
+            self.rate = frames_per_second
+            self.capacity = burst
+
+        self.tokens = self.capacity
+        self.last = None
+        self.started = None
+
+        # Statistics
+        self.frames = 0
+        self.bits = 0
+        self.enobufs = 0
+        self.backoff_delay = MIN_BACKOFF
+
+    def acquire(self, length: int = 8, extended: bool = False) -> None:
+        """Block until the next frame may be sent"""
+        now = perf_counter()
+
+        if self.last is None:
+            self.started = self.last = now
+
+        bits = frame_bits(length, extended)
+        cost = bits if self.bus_load is not None else 1
+
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+        if self.tokens < cost:
+            sleep((cost - self.tokens) / self.rate)
+            now = perf_counter()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+
+        self.tokens -= cost
+        self.frames += 1
+        self.bits += bits
+
+    def backoff(self) -> None:
+        """TX queue full: wait (exponentially longer on consecutive errors) and drain the bucket"""
+        self.enobufs += 1
+        sleep(self.backoff_delay)
+        self.backoff_delay = min(self.backoff_delay * 2, MAX_BACKOFF)
+        self.tokens = 0
+
+    def recovered(self) -> None:
+        self.backoff_delay = MIN_BACKOFF
+
+    @property
+    def elapsed(self) -> float:
+        return perf_counter() - self.started if self.started is not None else 0.0
+
+    @property
+    def achieved_rate(self) -> float:
+        elapsed = self.elapsed
+        return self.frames / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def achieved_load(self) -> float:
+        elapsed = self.elapsed
+        return 100 * self.bits / elapsed / self.bus_bitrate if elapsed > 0 else 0.0
+
+    def report(self) -> str:
+        if self.bus_load is not None:
+            target = f"{self.bus_load:.1f} % bus load"
+        else:
+            target = f"{self.frames_per_second:.0f} frames/s"
+
+        return (f"achieved {self.achieved_rate:.0f} frames/s ({self.achieved_load:.1f} % bus load at {self.bus_bitrate // 1000} kbit/s), "
+                f"target {target}, {self.enobufs} ENOBUFS backoffs")
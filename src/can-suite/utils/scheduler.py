@@ -0,0 +1,73 @@
+"""
+    CAN Suite replay scheduler.
+
+    Library replaying frames with their original inter-frame gaps on the
+    monotonic clock. Sleeping alone is only accurate to about a millisecond,
+    so the scheduler sleeps until shortly before each deadline and spins for
+    the rest. Lateness of every frame is kept for jitter statistics.
+
+    (c) Jannik Schmied, 2023
+"""
+from array import array
+from time import perf_counter, sleep
+
+import numpy as np
+
+# Replay speed factor limits
+MIN_SPEED: float = 0.1
+MAX_SPEED: float = 100.0
+
+# Seconds before a deadline spent spinning instead of sleeping
+SPIN_THRESHOLD: float = 0.002
+
+# Frames later than this (seconds) are counted as late
+LATE_THRESHOLD: float = 0.001
+
+
+class ReplayScheduler:
+    """Waits for the send time of capture timestamps, scaled by the speed factor (2.0 replays twice as fast)"""
+    def __init__(self, speed: float = 1.0, spin: float = SPIN_THRESHOLD) -> None:
+        if not MIN_SPEED <= speed <= MAX_SPEED:
+            raise ValueError(f"speed must be between {MIN_SPEED:g} and {MAX_SPEED:g}")
+
+        self.speed = speed
+        self.spin = spin
+        self.origin = None
+        self.first = None
+
+        # Lateness of every frame in seconds
+        self.lateness = array("d")
+
+    def wait(self, timestamp: float) -> float:
+        """Block until the frame with this capture timestamp is due, returns its lateness in seconds.
+        The first frame is sent immediately. Frames behind schedule are sent at once without catching up pauses."""
+        if self.origin is None:
+            self.origin, self.first = perf_counter(), timestamp
+
+        deadline = self.origin + (timestamp - self.first) / self.speed
+        remaining = deadline - perf_counter()
+
+        if remaining > self.spin:
+            sleep(remaining - self.spin)
+        while perf_counter() < deadline:
+            pass
+
+        lateness = max(perf_counter() - deadline, 0.0)
+        self.lateness.append(lateness)
+        return lateness
+
+    @property
+    def elapsed(self) -> float:
+        return perf_counter() - self.origin if self.origin is not None else 0.0
+
+    def report(self) -> str:
+        if not self.lateness:
+            return "no frames scheduled"
+
+        lateness = np.frombuffer(self.lateness, dtype=np.float64) * 1e6
+        late = np.count_nonzero(lateness > LATE_THRESHOLD * 1e6)
+        median, p99 = np.percentile(lateness, [50, 99])
+
+        return (f"{len(lateness)} frames in {self.elapsed:.2f} s at {self.speed:g}x, jitter mean {lateness.mean():.1f} us, "
+                f"median {median:.1f} us, p99 {p99:.1f} us, max {lateness.max():.1f} us, "
+                f"{late} frames more than {LATE_THRESHOLD * 1e3:g} ms late")
@@ -0,0 +1,51 @@
+"""
+    CAN Suite byte sensitivity search.
+
+    Library building candidate blocks around a baseline payload: every byte
+    position is swept on its own first, then pairs of positions which caused
+    a reaction. This replaces 2^(8*len) exhaustive sweeps by len*256 frames
+    plus 65536 frames per reactive pair.
+
+    (c) Jannik Schmied, 2023
+"""
+from itertools import combinations
+
+import numpy as np
+
+BYTE_VALUES: int = 0x100
+
+
+def parse_positions(positions: str, length: int) -> list:
+    """Parse comma separated byte positions (e.g. 0,3,7)"""
+    result = sorted({int(position) for position in positions.replace(" ", "").split(",") if position})
+
+    for position in result:
+        if not 0 <= position < length:
+            raise ValueError(f"byte position {position} out of range (0-{length - 1})")
+
+    return result
+
+
+def single_byte_sweep(baseline: bytes, position: int) -> np.ndarray:
+    """All 256 values of one byte position, remaining bytes fixed to the baseline"""
+    block = np.tile(np.frombuffer(baseline, dtype=np.uint8), (BYTE_VALUES, 1))
+    block[:, position] = np.arange(BYTE_VALUES, dtype=np.uint8)
+    return block
+
+
+def byte_pair_sweep(baseline: bytes, first: int, second: int) -> np.ndarray:
+    """All 65536 value combinations of two byte positions, remaining bytes fixed to the baseline"""
+    values = np.arange(BYTE_VALUES * BYTE_VALUES, dtype=np.uint16)
+    block = np.tile(np.frombuffer(baseline, dtype=np.uint8), (len(values), 1))
+    block[:, first] = values >> 8
+    block[:, second] = values & 0xFF
+    return block
+
+
+def byte_pairs(reactive: list) -> list:
+    return list(combinations(sorted(reactive), 2))
+
+
+def search_space(length: int, reactive: list) -> int:
+    """Number of candidates of a sensitivity search (single byte phase plus pair phase)"""
+    return length * BYTE_VALUES + len(byte_pairs(reactive)) * BYTE_VALUES * BYTE_VALUES
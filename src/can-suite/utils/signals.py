@@ -0,0 +1,261 @@
+"""
+    CAN Suite signal extraction.
+
+    Library segmenting payloads into signals in the style of the READ
+    algorithm (Marchetti & Stabili): bit-flip rates of all IDs are computed
+    in one pass, signal boundaries are placed where the order of magnitude
+    of the flip rate drops. Byte order, signedness, counters and checksums
+    are inferred from the field values and exported as a draft DBC file.
+
+    (c) Jannik Schmied, 2023
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+from .analysis import BYTE_CHECKSUM, MATCH_THRESHOLD, analyze_id, group_by_id
+from .socketcan import CAN_EFF_FLAG, CAN_EFF_MASK, CAN_MAX_DLEN, format_can_id
+
+# Signal kinds
+SIGNAL_PHYSICAL: str = "signal"
+SIGNAL_COUNTER: str = "counter"
+SIGNAL_CHECKSUM: str = "checksum"
+
+BIG_ENDIAN: str = "big_endian"
+LITTLE_ENDIAN: str = "little_endian"
+
+# Share of high byte changes that must coincide with a wrap-around of the low byte (little endian)
+CARRY_THRESHOLD: float = 0.8
+
+# A signed interpretation must be at least this much smoother than the unsigned one
+SIGNED_SMOOTHNESS: float = 0.5
+
+_BITS: int = 8 * CAN_MAX_DLEN
+_NO_FLIPS: int = -99
+
+
+@dataclass
+class Signal:
+    """Bit field of an ID. bits are payload bit indices MSB first (bit 0 is bit 7 of byte 0), ordered from the MSB to the LSB of the value."""
+    can_id: int
+    name: str
+    bits: list
+    byte_order: str
+    signed: bool
+    kind: str
+    minimum: int
+    maximum: int
+
+    @property
+    def length(self) -> int:
+        return len(self.bits)
+
+    @property
+    def start_bit(self) -> int:
+        """DBC start bit: MSB for big endian (Motorola), LSB for little endian (Intel) signals"""
+        bit = self.bits[0] if self.byte_order == BIG_ENDIAN else self.bits[-1]
+        return _dbc_bit(bit)
+
+    def describe(self) -> str:
+        sign = "signed" if self.signed else "unsigned"
+        return (f"{self.name}: {self.kind}, start bit {self.start_bit} ({self.length} bit), "
+                f"{self.byte_order.replace('_', ' ')}, {sign}, range {self.minimum}..{self.maximum}")
+
+
+def _dbc_bit(bit: int) -> int:
+    """MSB first payload bit index to DBC bit numbering (bit 0 is the LSB of byte 0)"""
+    return 8 * (bit // 8) + 7 - bit % 8
+
+
+def flip_rate_matrix(capture: np.ndarray, groups: list) -> np.ndarray:
+    """Bit-flip rates of all IDs at once as (IDs, 64) matrix, capture sorted as returned by group_by_id()"""
+    starts = np.array([group.start for _, group in groups])
+    transitions = np.array([group.stop - group.start - 1 for _, group in groups])
+    data = capture["data"][:, :CAN_MAX_DLEN]
+    flips = np.zeros((len(groups), _BITS), dtype=np.int64)
+
+    # One byte column at a time keeps the unpacked bits small for captures with millions of frames
+    for byte in range(CAN_MAX_DLEN):
+        xor = np.zeros(len(capture), dtype=np.uint8)
+        xor[1:] = data[1:, byte] ^ data[:-1, byte]
+        xor[starts] = 0
+        flips[:, 8 * byte:8 * byte + 8] = np.add.reduceat(np.unpackbits(xor[:, None], axis=1), starts, axis=0, dtype=np.int64)
+
+    return flips / np.maximum(transitions, 1)[:, None]
+
+
+def field_starts(rates: np.ndarray, excluded: np.ndarray) -> np.ndarray:
+    """READ boundaries for all IDs at once: a field starts where the flip rate magnitude drops,
+    where flipping bits begin and at excluded (checksum) bits"""
+    active = (rates > 0) & ~excluded
+
+    with np.errstate(divide="ignore"):
+        magnitude = np.where(rates > 0, np.floor(np.log10(rates)), _NO_FLIPS)
+
+    starts = np.zeros(rates.shape, dtype=bool)
+    starts[:, 0] = True
+    starts[:, 1:] = (magnitude[:, :-1] > magnitude[:, 1:]) | (active[:, :-1] != active[:, 1:])
+
+    return starts & active
+
+
+def field_values(data: np.ndarray, bits: list) -> np.ndarray:
+    """Unsigned values of a bit field (MSB first) for every frame"""
+    unpacked = np.unpackbits(data, axis=1)[:, bits].astype(np.uint64)
+    weights = np.uint64(1) << np.arange(len(bits) - 1, -1, -1, dtype=np.uint64)
+    return unpacked @ weights
+
+
+def _segments(starts: np.ndarray, active: np.ndarray) -> list:
+    """Contiguous active bit runs of one ID"""
+    segments = []
+    for bit in range(_BITS):
+        if not active[bit]:
+            continue
+        if starts[bit] or not segments or segments[-1][-1] != bit - 1:
+            segments.append([bit])
+        else:
+            segments[-1].append(bit)
+    return segments
+
+
+def _is_carry(low: np.ndarray, high: np.ndarray, low_range: int) -> bool:
+    """High part only changes when the low part wraps around (little endian multi-byte value)"""
+    changes = np.nonzero(high[1:] != high[:-1])[0]
+    if len(changes) < 3:
+        return False
+    jumps = np.abs(low[changes + 1].astype(np.int64) - low[changes].astype(np.int64))
+    return np.count_nonzero(jumps > low_range // 2) >= CARRY_THRESHOLD * len(changes)
+
+
+def _split_big_endian(data: np.ndarray, segments: list) -> list:
+    """Split segments crossing a byte boundary unless the upper part behaves like the high bits of one value.
+    Neighbouring signals with similar flip rates are not separated by READ boundaries alone."""
+    result = []
+
+    for segment in segments:
+        while segment[0] // 8 != segment[-1] // 8:
+            boundary = segment.index(8 * (segment[0] // 8 + 1))
+            high, low = segment[:boundary], segment[boundary:]
+            if _is_carry(field_values(data, low), field_values(data, high), 1 << len(low)):
+                break
+            result.append(high)
+            segment = low
+        result.append(segment)
+
+    return result
+
+
+def _merge_little_endian(data: np.ndarray, segments: list) -> list:
+    """Join a whole byte with the end of the following byte if it behaves like the low byte of one value"""
+    merged = []
+
+    for segment in segments:
+        if merged:
+            low = merged[-1]
+            high_byte = low[0] // 8
+            whole_byte = low[:8] == list(range(8 * high_byte, 8 * high_byte + 8))
+            if whole_byte and segment[-1] == 8 * high_byte + 15 and segment[0] // 8 == high_byte + 1:
+                if _is_carry(field_values(data, low), field_values(data, segment), 1 << len(low)):
+                    # Value bits MSB first: high part first, then the low part
+                    merged[-1] = segment + low
+                    continue
+        merged.append(segment)
+
+    return merged
+
+
+def _is_signed(values: np.ndarray, length: int) -> bool:
+    """Two's complement is assumed if it makes the series considerably smoother (no jumps around zero)"""
+    if length < 2 or len(values) < 2:
+        return False
+    unsigned = values.astype(np.int64)
+    signed = np.where(unsigned >= 1 << (length - 1), unsigned - (1 << length), unsigned)
+    unsigned_steps = np.abs(np.diff(unsigned)).mean()
+    signed_steps = np.abs(np.diff(signed)).mean()
+    return unsigned_steps > 0 and signed_steps < SIGNED_SMOOTHNESS * unsigned_steps
+
+
+def _is_counter(values: np.ndarray, length: int) -> bool:
+    steps = (np.diff(values.astype(np.int64))) % (1 << length)
+    if not len(steps) or np.count_nonzero(steps) < MATCH_THRESHOLD * len(steps):
+        return False
+    return np.bincount(steps[steps > 0]).max() >= MATCH_THRESHOLD * len(steps)
+
+
+def _signal(can_id: int, data: np.ndarray, bits: list, byte_order: str, kind: str, index: int) -> Signal:
+    values = field_values(data, bits)
+    length = len(bits)
+    signed = kind == SIGNAL_PHYSICAL and _is_signed(values, length)
+
+    if signed:
+        values = np.where(values >= 1 << (length - 1), values.astype(np.int64) - (1 << length), values.astype(np.int64))
+
+    if kind == SIGNAL_PHYSICAL and _is_counter(values, length):
+        kind = SIGNAL_COUNTER
+
+    name = f"ID_{format_can_id(can_id)}_{kind.upper()}_{index}"
+    return Signal(can_id, name, bits, byte_order, signed, kind, int(values.min()), int(values.max()))
+
+
+def extract_signals(capture: np.ndarray, statistics: list = None) -> dict:
+    """Signals of every ID of a capture as {can_id: [Signal, ...]}, statistics of analyze_capture() are reused if given"""
+    capture, groups = group_by_id(capture)
+    if not groups:
+        return {}
+
+    classes = {stats.can_id: stats.classes for stats in statistics or ()}
+
+    rates = flip_rate_matrix(capture, groups)
+    excluded = np.zeros(rates.shape, dtype=bool)
+
+    # Checksum bytes are found by the byte classification and kept as whole bytes
+    checksums = {}
+    for row, (can_id, group) in enumerate(groups):
+        if can_id not in classes:
+            classes[can_id] = analyze_id(can_id, capture[group]).classes
+        checksums[can_id] = [byte for byte, kind in enumerate(classes[can_id]) if kind == BYTE_CHECKSUM]
+        for byte in checksums[can_id]:
+            excluded[row, 8 * byte:8 * byte + 8] = True
+
+    starts = field_starts(rates, excluded)
+    active = (rates > 0) & ~excluded
+
+    signals = {}
+    for row, (can_id, group) in enumerate(groups):
+        data = capture["data"][group][:, :CAN_MAX_DLEN]
+        fields = []
+
+        for segment in _merge_little_endian(data, _split_big_endian(data, _segments(starts[row], active[row]))):
+            byte_order = LITTLE_ENDIAN if segment[0] // 8 > segment[-1] // 8 else BIG_ENDIAN
+            fields.append((segment, byte_order, SIGNAL_PHYSICAL))
+        for byte in checksums[can_id]:
+            fields.append((list(range(8 * byte, 8 * byte + 8)), BIG_ENDIAN, SIGNAL_CHECKSUM))
+
+        fields.sort(key=lambda field: min(field[0]))
+        signals[can_id] = [_signal(can_id, data, bits, byte_order, kind, index) for index, (bits, byte_order, kind) in enumerate(fields)]
+
+    return signals
+
+
+def write_dbc(path: str, signals: dict, dlcs: dict = None) -> None:
+    """Write a draft DBC file (raw values, factor 1, offset 0) with the signal kind as comment"""
+    dlcs = dlcs or {}
+    lines = ['VERSION ""', "", "NS_ :", "", "BS_:", "", "BU_: Vector__XXX", ""]
+    comments = []
+
+    for can_id, id_signals in sorted(signals.items()):
+        dbc_id = (can_id & CAN_EFF_MASK) | CAN_EFF_FLAG if can_id & CAN_EFF_FLAG else can_id
+        dlc = dlcs.get(can_id, CAN_MAX_DLEN)
+        lines.append(f"BO_ {dbc_id} ID_{format_can_id(can_id)}: {dlc} Vector__XXX")
+
+        for signal in id_signals:
+            order = "0" if signal.byte_order == BIG_ENDIAN else "1"
+            sign = "-" if signal.signed else "+"
+            lines.append(f' SG_ {signal.name} : {signal.start_bit}|{signal.length}@{order}{sign} (1,0) [{signal.minimum}|{signal.maximum}] "" Vector__XXX')
+            comments.append(f'CM_ SG_ {dbc_id} {signal.name} "{signal.kind} (draft, extracted from capture)";')
+
+        lines.append("")
+
+    with open(path, "w") as file:
+        file.write("\n".join(lines + comments) + "\n")
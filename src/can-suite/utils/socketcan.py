@@ -0,0 +1,214 @@
+"""
+    CAN Suite native SocketCAN transport.
+
+    Library writing pre-packed struct can_frame buffers through a single
+    AF_CAN raw socket instead of spawning one cansend process per frame.
+
+    (c) Jannik Schmied, 2023
+"""
+import errno
+import socket
+import struct
+import sys
+from time import sleep
+
+import numpy as np
+
+# struct can_frame / struct canfd_frame (linux/can.h)
+CAN_FRAME_FMT: str = "=IB3x8s"
+CAN_FRAME_SIZE: int = struct.calcsize(CAN_FRAME_FMT)
+CANFD_FRAME_FMT: str = "=IBB2x64s"
+CANFD_FRAME_SIZE: int = struct.calcsize(CANFD_FRAME_FMT)
+CAN_MAX_DLEN: int = 8
+CANFD_MAX_DLEN: int = 64
+
+# CAN ID flags and masks
+CAN_EFF_FLAG: int = 0x80000000
+CAN_RTR_FLAG: int = 0x40000000
+CAN_ERR_FLAG: int = 0x20000000
+CAN_SFF_MASK: int = 0x000007FF
+CAN_EFF_MASK: int = 0x1FFFFFFF
+CAN_ERR_MASK: int = 0x1FFFFFFF
+
+# Socket option for receiving error frames (linux/can/raw.h), missing in the socket module of some Python builds
+CAN_RAW_ERR_FILTER: int = getattr(socket, "CAN_RAW_ERR_FILTER", 2)
+
+# NumPy views of struct can_frame / struct canfd_frame for block packing
+CAN_FRAME_DTYPE = np.dtype([("can_id", "=u4"), ("len", "u1"), ("pad", "u1", (3,)), ("data", "u1", (CAN_MAX_DLEN,))])
+CANFD_FRAME_DTYPE = np.dtype([("can_id", "=u4"), ("len", "u1"), ("flags", "u1"), ("pad", "u1", (2,)), ("data", "u1", (CANFD_MAX_DLEN,))])
+
+# Frames written per send_batch() call before yielding to the caller
+DEFAULT_BATCH_SIZE: int = 256
+ENOBUFS_RETRY_DELAY: float = 0.0005
+
+
+def parse_can_id(can_id: str) -> int:
+    """Parse cansend style arbitration ID (3 hex digits SFF, 8 hex digits EFF)"""
+    digits = can_id.lower().removeprefix("0x")
+    value = int(digits, 16)
+
+    if len(digits) == 8 or value > CAN_SFF_MASK:
+        if value > CAN_EFF_MASK:
+            raise ValueError(f"invalid CAN ID: {can_id}")
+        return value | CAN_EFF_FLAG
+
+    return value
+
+
+def parse_id_list(ids: str) -> list:
+    """Parse comma separated IDs and ID ranges (e.g. 700-7FF,123) into a sorted list"""
+    result = set()
+
+    for item in ids.replace(" ", "").split(","):
+        if not item:
+            continue
+        first, _, last = item.partition("-")
+        if last:
+            low, high = parse_can_id(first), parse_can_id(last)
+            flag = (low | high) & CAN_EFF_FLAG
+            low, high = low & CAN_EFF_MASK, high & CAN_EFF_MASK
+            if low > high:
+                raise ValueError(f"invalid ID range: {item}")
+            result.update(can_id | flag for can_id in range(low, high + 1))
+        else:
+            result.add(parse_can_id(first))
+
+    return sorted(result)
+
+
+def format_can_id(can_id: int) -> str:
+    """Format arbitration ID the way cansend expects it"""
+    if can_id & CAN_EFF_FLAG:
+        return f"{can_id & CAN_EFF_MASK:08X}"
+    return f"{can_id & CAN_SFF_MASK:03X}"
+
+
+def parse_frame(frame: str) -> tuple:
+    """Parse cansend style frame (e.g. 123#DEADBEEF) into (can_id, data)"""
+    can_id, _, data = frame.strip().partition("#")
+
+    if data.startswith("R"):
+        return parse_can_id(can_id) | CAN_RTR_FLAG, b""
+
+    # CAN-FD frames carry a flags nibble after a second '#'
+    if data.startswith("#"):
+        data = data[2:]
+
+    return parse_can_id(can_id), bytes.fromhex(data.replace(".", ""))
+
+
+def pack_frame(can_id: int, data: bytes, fd: bool = False) -> bytes:
+    """Serialize a frame to a struct can_frame (or canfd_frame) buffer"""
+    if fd:
+        return struct.pack(CANFD_FRAME_FMT, can_id, len(data), 0, data)
+    return struct.pack(CAN_FRAME_FMT, can_id, len(data), data)
+
+
+def pack_block(can_id, payloads: np.ndarray, fd: bool = False) -> np.ndarray:
+    """Serialize a (count, length) uint8 payload block into contiguous frame buffers"""
+    frames = np.zeros(len(payloads), dtype=CANFD_FRAME_DTYPE if fd else CAN_FRAME_DTYPE)
+    length = payloads.shape[1]
+
+    frames["can_id"] = can_id
+    frames["len"] = length
+    frames["data"][:, :length] = payloads
+
+    return frames
+
+
+def unpack_frame(buffer: bytes) -> tuple:
+    """Deserialize a struct can_frame (or canfd_frame) buffer into (can_id, data)"""
+    if len(buffer) == CANFD_FRAME_SIZE:
+        can_id, length, _, data = struct.unpack(CANFD_FRAME_FMT, buffer)
+    else:
+        can_id, length, data = struct.unpack(CAN_FRAME_FMT, buffer)
+    return can_id, data[:length]
+
+
+class NativeCANSocket:
+    """Raw AF_CAN socket kept open for the lifetime of a campaign"""
+    def __init__(self, interface: str, fd: bool = False, receive_own: bool = False, rate=None, errors: bool = False) -> None:
+        self.interface = interface
+        self.fd_mode = fd
+        self.rate = rate
+        self.frame_size = CANFD_FRAME_SIZE if fd else CAN_FRAME_SIZE
+        self.sent = 0
+
+        self.socket = socket.socket(socket.AF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
+
+        if fd:
+            self.socket.setsockopt(socket.SOL_CAN_RAW, socket.CAN_RAW_FD_FRAMES, 1)
+        if receive_own:
+            self.socket.setsockopt(socket.SOL_CAN_RAW, socket.CAN_RAW_RECV_OWN_MSGS, 1)
+        if errors:
+            # Error frames arrive with CAN_ERR_FLAG set in the ID
+            self.socket.setsockopt(socket.SOL_CAN_RAW, CAN_RAW_ERR_FILTER, CAN_ERR_MASK)
+
+        self.socket.bind((interface,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def fileno(self) -> int:
+        return self.socket.fileno()
+
+    def send(self, can_id: int, data: bytes) -> None:
+        """Pack and send a single frame"""
+        self.send_raw(pack_frame(can_id, data, self.fd_mode))
+
+    def send_raw(self, frame: bytes) -> None:
+        """Send one pre-packed frame"""
+        self._send(memoryview(frame).cast("B"))
+        self.sent += 1
+
+    def send_batch(self, frames) -> int:
+        """Send a contiguous buffer of pre-packed frames, returns number of frames sent"""
+        view = memoryview(frames).cast("B")
+        frame_size = self.frame_size
+        count = len(view) // frame_size
+
+        for offset in range(0, count * frame_size, frame_size):
+            self._send(view[offset:offset + frame_size])
+
+        self.sent += count
+        return count
+
+    def _send(self, frame: memoryview) -> None:
+        """Send a frame paced by the rate controller (if any), waiting for TX queue space on ENOBUFS"""
+        rate = self.rate
+
+        if rate:
+            rate.acquire(frame[4], bool(int.from_bytes(frame[:4], sys.byteorder) & CAN_EFF_FLAG))
+
+        while True:
+            try:
+                self.socket.send(frame)
+                break
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                if rate:
+                    rate.backoff()
+                else:
+                    sleep(ENOBUFS_RETRY_DELAY)
+
+        if rate:
+            rate.recovered()
+
+    def recv(self) -> tuple:
+        """Receive a single frame as (can_id, data)"""
+        return unpack_frame(self.socket.recv(CANFD_FRAME_SIZE))
+
+    def recv_flags(self) -> tuple:
+        """Receive a single frame as (can_id, data, local), local frames were sent from this host"""
+        buffer, _, flags, _ = self.socket.recvmsg(CANFD_FRAME_SIZE)
+        return *unpack_frame(buffer), bool(flags & socket.MSG_DONTROUTE)
+
+    def settimeout(self, timeout) -> None:
+        self.socket.settimeout(timeout)
+
+    def close(self) -> None:
+        self.socket.close()
@@ -0,0 +1,294 @@
+"""
+    CAN Suite transport backends.
+
+    Library providing a registry of CAN transports with a common interface
+    (send, send_raw, send_batch, recv, settimeout, close): the native raw
+    SocketCAN socket, python-can, PCAN and an in-process loopback bus with
+    configurable latency and frame drops for deterministic local runs.
+
+    (c) Jannik Schmied, 2023
+"""
+import random
+import threading
+from collections import deque
+from socket import timeout as SocketTimeout
+from time import monotonic, perf_counter, sleep
+
+import numpy as np
+
+from .PCAN import PCAN_BAUD_500K, PCAN_ERROR_OK, PCAN_ERROR_QRCVEMPTY, PCAN_MESSAGE_EXTENDED, PCAN_MESSAGE_RTR, PCAN_MESSAGE_STATUS
+from .pcantx import FD_LENGTHS, PCANTransmitter, pcan_channel
+from .socketcan import (CAN_EFF_FLAG, CAN_EFF_MASK, CAN_ERR_FLAG, CAN_FRAME_DTYPE, CAN_FRAME_SIZE, CAN_RTR_FLAG,
+                        CANFD_FRAME_DTYPE, CANFD_FRAME_SIZE, NativeCANSocket, unpack_frame)
+
+DEFAULT_TRANSPORT: str = "native"
+
+# Seconds between polls of the PCAN receive queue
+PCAN_POLL_INTERVAL: float = 0.0005
+
+
+def _unpack_batch(frames, fd: bool):
+    """(can_id, data) of every frame in a contiguous buffer of pre-packed frames"""
+    frames = np.frombuffer(memoryview(frames).cast("B"), dtype=CANFD_FRAME_DTYPE if fd else CAN_FRAME_DTYPE)
+    for can_id, length, data in zip(frames["can_id"].tolist(), frames["len"].tolist(), frames["data"]):
+        yield can_id, data[:length].tobytes()
+
+
+class PCANTransport(PCANTransmitter):
+    """PCAN transmit adapter with polled reception, interface is a PCAN channel name (e.g. PCAN_USBBUS1)"""
+    def __init__(self, interface: str, fd: bool = False, rate=None, baud_rate=PCAN_BAUD_500K, **options) -> None:
+        super().__init__(pcan_channel(interface), fd, baud_rate=baud_rate, rate=rate, **options)
+        self.interface = interface
+        self.read = self.pcan.ReadFD if fd else self.pcan.Read
+        self.timeout = None
+
+    def settimeout(self, timeout) -> None:
+        self.timeout = timeout
+
+    def recv(self) -> tuple:
+        """Receive a single frame as (can_id, data), status messages are skipped"""
+        deadline = None if self.timeout is None else monotonic() + self.timeout
+
+        while True:
+            status, message, _ = self.read(self.channel)
+
+            if status == PCAN_ERROR_OK:
+                if message.MSGTYPE & PCAN_MESSAGE_STATUS.value:
+                    continue
+                can_id = message.ID | (CAN_EFF_FLAG if message.MSGTYPE & PCAN_MESSAGE_EXTENDED.value else 0)
+                can_id |= CAN_RTR_FLAG if message.MSGTYPE & PCAN_MESSAGE_RTR.value else 0
+                length = int(FD_LENGTHS[message.DLC]) if self.fd_mode else message.LEN
+                return can_id, bytes(message.DATA[:length])
+
+            if status != PCAN_ERROR_QRCVEMPTY:
+                self._check(self.pcan, status)
+            if deadline is not None and monotonic() >= deadline:
+                raise SocketTimeout("timed out")
+            sleep(PCAN_POLL_INTERVAL)
+
+
+class PythonCANTransport:
+    """python-can bus, interface is [bustype:]channel (socketcan by default, e.g. kvaser:0 or can0)"""
+    def __init__(self, interface: str, fd: bool = False, rate=None, bitrate: int = None) -> None:
+        # Optional dependency, only needed for this transport
+        import can
+
+        bustype, _, channel = interface.rpartition(":")
+        options = {"bitrate": bitrate} if bitrate and bustype not in ("", "socketcan") else {}
+
+        self.interface = interface
+        self.fd_mode = fd
+        self.rate = rate
+        self.frame_size = CANFD_FRAME_SIZE if fd else CAN_FRAME_SIZE
+        self.sent = 0
+        self.timeout = None
+        self.bus = can.Bus(channel=channel, interface=bustype or "socketcan", fd=fd, **options)
+
+        # Reused for every frame, the bus serializes it on send
+        self.message = can.Message(is_fd=fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def send(self, can_id: int, data: bytes) -> None:
+        if self.rate:
+            self.rate.acquire(len(data), bool(can_id & CAN_EFF_FLAG))
+
+        message = self.message
+        message.arbitration_id = can_id & CAN_EFF_MASK
+        message.is_extended_id = bool(can_id & CAN_EFF_FLAG)
+        message.is_remote_frame = bool(can_id & CAN_RTR_FLAG)
+        message.data = data
+        message.dlc = len(data)
+        self.bus.send(message)
+        self.sent += 1
+
+    def send_raw(self, frame: bytes) -> None:
+        self.send(*unpack_frame(bytes(frame)))
+
+    def send_batch(self, frames) -> int:
+        count = 0
+        for can_id, data in _unpack_batch(frames, self.fd_mode):
+            self.send(can_id, data)
+            count += 1
+        return count
+
+    def settimeout(self, timeout) -> None:
+        self.timeout = timeout
+
+    def recv(self) -> tuple:
+        message = self.bus.recv(self.timeout)
+        if message is None:
+            raise SocketTimeout("timed out")
+
+        can_id = message.arbitration_id | (CAN_EFF_FLAG if message.is_extended_id else 0)
+        can_id |= (CAN_RTR_FLAG if message.is_remote_frame else 0) | (CAN_ERR_FLAG if message.is_error_frame else 0)
+        return can_id, bytes(message.data)
+
+    def close(self) -> None:
+        self.bus.shutdown()
+
+
+class LoopbackBus:
+    """In-process bus delivering every frame to all attached transports after latency seconds.
+    Frames are lost with probability drop (seeded, so runs are reproducible)."""
+    def __init__(self, latency: float = 0.0, drop: float = 0.0, seed: int = None) -> None:
+        if latency < 0 or not 0 <= drop < 1:
+            raise ValueError("latency must not be negative and drop must be between 0 and 1")
+
+        self.latency = latency
+        self.drop = drop
+        self.rng = random.Random(seed)
+        self.transports = []
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.dropped = 0
+
+    def attach(self, transport) -> None:
+        with self.lock:
+            self.transports.append(transport)
+
+    def detach(self, transport) -> None:
+        with self.lock:
+            if transport in self.transports:
+                self.transports.remove(transport)
+
+    def transmit(self, sender, can_id: int, data: bytes) -> None:
+        with self.lock:
+            self.frames += 1
+            if self.drop and self.rng.random() < self.drop:
+                self.dropped += 1
+                return
+
+            due = perf_counter() + self.latency
+            for transport in self.transports:
+                if transport is not sender or transport.receive_own:
+                    transport.deliver(due, can_id, data, transport is sender)
+
+
+# Loopback buses by interface name, transports opened on the same name share a bus
+LOOPBACK_BUSES: dict = {}
+_LOOPBACK_LOCK = threading.Lock()
+
+
+def loopback_bus(name: str, latency: float = 0.0, drop: float = 0.0, seed: int = None) -> LoopbackBus:
+    """Loopback bus of this name, created with the given latency and drop rate if it does not exist yet"""
+    with _LOOPBACK_LOCK:
+        if name not in LOOPBACK_BUSES:
+            LOOPBACK_BUSES[name] = LoopbackBus(latency, drop, seed)
+        return LOOPBACK_BUSES[name]
+
+
+class LoopbackTransport:
+    """Transport attached to a loopback bus, interface is the bus name (e.g. lo0)"""
+    def __init__(self, interface: str, fd: bool = False, rate=None, receive_own: bool = False,
+                 latency: float = 0.0, drop: float = 0.0, seed: int = None) -> None:
+        self.interface = interface
+        self.fd_mode = fd
+        self.rate = rate
+        self.receive_own = receive_own
+        self.frame_size = CANFD_FRAME_SIZE if fd else CAN_FRAME_SIZE
+        self.sent = 0
+        self.timeout = None
+
+        # Received frames as (due time, can_id, data, local)
+        self.queue = deque()
+        self.condition = threading.Condition()
+
+        self.bus = loopback_bus(interface, latency, drop, seed)
+        self.bus.attach(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def send(self, can_id: int, data: bytes) -> None:
+        if self.rate:
+            self.rate.acquire(len(data), bool(can_id & CAN_EFF_FLAG))
+        self.bus.transmit(self, can_id, bytes(data))
+        self.sent += 1
+
+    def send_raw(self, frame: bytes) -> None:
+        self.send(*unpack_frame(bytes(frame)))
+
+    def send_batch(self, frames) -> int:
+        count = 0
+        for can_id, data in _unpack_batch(frames, self.fd_mode):
+            self.send(can_id, data)
+            count += 1
+        return count
+
+    def deliver(self, due: float, can_id: int, data: bytes, local: bool) -> None:
+        with self.condition:
+            self.queue.append((due, can_id, data, local))
+            self.condition.notify()
+
+    def settimeout(self, timeout) -> None:
+        self.timeout = timeout
+
+    def recv_flags(self) -> tuple:
+        """Receive a single frame as (can_id, data, local), local frames were sent by this transport"""
+        deadline = None if self.timeout is None else perf_counter() + self.timeout
+
+        with self.condition:
+            while True:
+                now = perf_counter()
+                if self.queue and self.queue[0][0] <= now:
+                    _, can_id, data, local = self.queue.popleft()
+                    return can_id, data, local
+
+                if deadline is not None and now >= deadline:
+                    raise SocketTimeout("timed out")
+
+                # Wake up when the head frame is due, the timeout expires or a frame arrives
+                waits = [time - now for time in (self.queue[0][0] if self.queue else None, deadline) if time is not None]
+                self.condition.wait(min(waits) if waits else None)
+
+    def recv(self) -> tuple:
+        return self.recv_flags()[:2]
+
+    def close(self) -> None:
+        self.bus.detach(self)
+
+
+def _native(interface: str, fd: bool = False, rate=None, receive_own: bool = False, **_) -> NativeCANSocket:
+    return NativeCANSocket(interface, fd=fd, receive_own=receive_own, rate=rate)
+
+
+def _python_can(interface: str, fd: bool = False, rate=None, bitrate: int = None, **_) -> PythonCANTransport:
+    return PythonCANTransport(interface, fd, rate, bitrate)
+
+
+def _pcan(interface: str, fd: bool = False, rate=None, baud_rate=PCAN_BAUD_500K, pool_size: int = None, **_) -> PCANTransport:
+    return PCANTransport(interface, fd, rate, baud_rate, **({"pool_size": pool_size} if pool_size else {}))
+
+
+def _loopback(interface: str, fd: bool = False, rate=None, receive_own: bool = False, latency: float = 0.0,
+              drop: float = 0.0, seed: int = None, **_) -> LoopbackTransport:
+    return LoopbackTransport(interface, fd, rate, receive_own, latency, drop, seed)
+
+
+# Transport factories by name, options a backend does not use are ignored
+TRANSPORTS: dict = {
+    "native": _native,              # raw AF_CAN socket (Linux SocketCAN)
+    "python-can": _python_can,      # any python-can interface ([bustype:]channel)
+    "pcan": _pcan,                  # PCAN-Basic with preallocated message pool (PCAN channel name)
+    "loopback": _loopback,          # in-process bus with latency and drops (bus name)
+}
+
+
+def register_transport(name: str, factory) -> None:
+    """Add a transport, factory(interface, fd, rate, **options) returns an object with the common interface"""
+    TRANSPORTS[name] = factory
+
+
+def open_transport(name: str, interface: str, fd: bool = False, rate=None, **options):
+    """Open a transport by name on an interface (network interface, PCAN channel or loopback bus name)"""
+    if name not in TRANSPORTS:
+        raise ValueError(f"unknown transport: {name} (available: {', '.join(TRANSPORTS)})")
+    return TRANSPORTS[name](interface, fd=fd, rate=rate, **options)